@@ -1,16 +1,49 @@
 import sys
-from flask import Flask, request, render_template, redirect, url_for, send_from_directory, jsonify, session, abort, flash
+from flask import Flask, request, render_template, redirect, url_for, jsonify, session, abort, flash, g, send_file
 from flask_pymongo import PyMongo
 import os
 import secrets
+import hashlib
+import io
+import mimetypes
+import atexit
+import threading
+import time
 import traceback
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 from bson.objectid import ObjectId
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 from functools import wraps
+from search_engine import SearchIndex, INDEX_PROJECTION
+from facets import FacetIndex, FACET_PROJECTION
+from pagination import paginate, paginate_ids
+from suggest import SuggestIndex, SUGGEST_PROJECTION
+from fuzzy import TrigramIndex, FUZZY_PROJECTION
+from query_parser import compile_query
+from db_indexes import ensure_indexes
+from result_cache import ResultCache
+from pdf_text import TextExtractionPipeline, drop_book_text, search_pages
+from user_names import UserNameCache
+import grants
+from counters import WriteBehindCounter
+from usage_events import EventLog, DOWNLOAD, PREVIEW, EVENTS_COLLECTION, drop_book_usage, top_books
+from trending import TrendingIndex, TRENDING_PROJECTION
+import recommend
+from file_transfer import TRANSFER_MODES, FileTransferStat, bytes_sent, send_book_file, starts_download, stored_file_hash
+from storage import BlobStore, is_blob_path
+from storage_backends import BACKENDS, make_backend
+from file_metadata import FileStat, StatCache, describe_file
+from small_files import SmallFileCache
+import resumable_upload
+from resumable_upload import UploadError
+from thumbnails import ALL_VARIANTS, COVER_WIDTHS, FORMATS, ThumbnailPipeline, is_image, negotiate_format
+from search_engine import fold
+from pymongo import ReturnDocument
+from pymongo.errors import ExecutionTimeout
+from projections import CATALOG_PROJECTION, ADMIN_BOOK_PROJECTION, BOOK_LABEL_PROJECTION, USER_LIST_PROJECTION
 
 app = Flask(__name__)
 
@@ -25,6 +58,9 @@ app.config["MONGO_URI"] = os.getenv('MONGO_URI_LOCAL', 'mongodb://localhost:2701
 
 print(f"🔧 MongoDB URI: {app.config['MONGO_URI']}")
 
+# Server-side time budget for every catalog query
+app.config["CATALOG_MAX_TIME_MS"] = int(os.getenv('CATALOG_MAX_TIME_MS', '2000'))
+
 try:
     mongo = PyMongo(app)
     print("✅ PyMongo initialized successfully")
@@ -35,17 +71,333 @@ except Exception as e:
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Process-wide id -> name cache shared by all requests
+user_name_cache = UserNameCache(ttl=int(os.getenv('USER_NAME_CACHE_TTL', '300')))
+
+def load_user_names(user_ids):
+    """Resolve a batch of user ids with one query and memoize them for the rest of the request."""
+    names = g.setdefault('user_names', {})
+    missing = {str(user_id) for user_id in user_ids if user_id} - names.keys()
+    if missing:
+        try:
+            names.update(user_name_cache.resolve(mongo.db, missing))
+        except Exception as e:
+            print(f"❌ Failed to resolve user names: {e}")
+    return names
+
 # Helper function to get user name from user_id
 def get_user_name(user_id):
     try:
-        user = mongo.db.users.find_one({"_id": ObjectId(user_id)})
-        return user.get('name', 'Unknown User') if user else 'Unknown User'
+        return load_user_names([user_id]).get(str(user_id), 'Unknown User')
     except:
         return 'Unknown User'
 
 # Register get_user_name with Jinja
 app.jinja_env.globals.update(get_user_name=get_user_name)
 
+# Cached catalog pages and book documents, invalidated by any catalog write
+result_cache = ResultCache(
+    max_entries=int(os.getenv('RESULT_CACHE_ENTRIES', '512')),
+    ttl=int(os.getenv('RESULT_CACHE_TTL', '60')),
+)
+
+# Registered indexes are reconciled once per process, before the first request
+indexes_reconciled = False
+
+def ensure_app_indexes():
+    """Create any registered index missing from the configured database."""
+    global indexes_reconciled
+    if indexes_reconciled:
+        return
+    indexes_reconciled = True
+    try:
+        for collection_name, name, status in ensure_indexes(mongo.db):
+            if status != "ok":
+                print(f"📊 Index {collection_name}.{name}: {status}")
+    except Exception as e:
+        print(f"❌ Index reconciliation failed: {e}")
+
+# Legacy allowed_users arrays are moved into the grants collection once per process
+grants_migrated = False
+
+def migrate_legacy_grants():
+    """Move any books.allowed_users arrays into the grants collection."""
+    global grants_migrated
+    if grants_migrated:
+        return
+    grants_migrated = True
+    try:
+        written = grants.migrate_embedded_grants(mongo.db)
+        if written:
+            print(f"🔐 Migrated {written} legacy grant(s) into the grants collection")
+    except Exception as e:
+        print(f"❌ Grant migration failed: {e}")
+
+@app.before_request
+def reconcile_indexes_before_first_request():
+    ensure_app_indexes()
+    migrate_legacy_grants()
+
+# Catalog writes bump a shared version document. Each worker updates its own
+# indexes in place on its own writes and, when the version shows another
+# worker (or node) wrote since, rebuilds them in a background thread.
+CATALOG_STATE_ID = "catalog"
+catalog_version_seen = None   # version this process's indexes reflect
+catalog_version_checked = 0.0
+catalog_rebuilding = threading.Lock()
+
+def read_catalog_version():
+    doc = mongo.db.catalog_state.find_one({"_id": CATALOG_STATE_ID}, {"version": 1})
+    return doc["version"] if doc else 0
+
+def bump_catalog_version():
+    """Record a catalog write this process has already applied to its own indexes."""
+    global catalog_version_seen
+    try:
+        doc = mongo.db.catalog_state.find_one_and_update(
+            {"_id": CATALOG_STATE_ID}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER)
+        if catalog_version_seen is not None and doc["version"] == catalog_version_seen + 1:
+            catalog_version_seen = doc["version"]
+    except Exception as e:
+        print(f"❌ Failed to bump catalog version: {e}")
+
+def check_catalog_version():
+    """Start a background rebuild when another process changed the catalog (checked every few seconds)."""
+    global catalog_version_seen, catalog_version_checked
+    now = time.monotonic()
+    if now - catalog_version_checked < float(os.getenv('CATALOG_VERSION_CHECK_SECONDS', '5')):
+        return
+    catalog_version_checked = now
+    try:
+        version = read_catalog_version()
+    except Exception as e:
+        print(f"❌ Failed to read catalog version: {e}")
+        return
+    if catalog_version_seen is None:
+        catalog_version_seen = version   # nothing built yet; first use builds from the current catalog
+    elif version != catalog_version_seen:
+        threading.Thread(target=rebuild_catalog_indexes_in_background, args=(version,), daemon=True).start()
+
+def rebuilt(index, projection):
+    """A fresh copy of a loaded index built from the books collection, swapped in by the caller."""
+    if not index.loaded:
+        return index
+    fresh = type(index)()
+    fresh.build(mongo.db.books.find({}, projection))
+    return fresh
+
+def rebuild_catalog_indexes_in_background(version):
+    global search_index, facet_index, suggest_index, fuzzy_index, catalog_version_seen
+    if not catalog_rebuilding.acquire(blocking=False):
+        return
+    try:
+        search_index = rebuilt(search_index, INDEX_PROJECTION)
+        facet_index = rebuilt(facet_index, FACET_PROJECTION)
+        suggest_index = rebuilt(suggest_index, SUGGEST_PROJECTION)
+        fuzzy_index = rebuilt(fuzzy_index, FUZZY_PROJECTION)
+        catalog_version_seen = version
+        result_cache.bump_version()
+        print(f"🔄 Catalog indexes rebuilt at version {version}")
+    except Exception as e:
+        print(f"❌ Catalog index rebuild failed: {e}")
+    finally:
+        catalog_rebuilding.release()
+
+# In-process full-text index over the books collection
+search_index = SearchIndex()
+
+def get_search_index():
+    """Return the search index, building it from the books collection on first use."""
+    check_catalog_version()
+    if not search_index.loaded:
+        search_index.build(mongo.db.books.find({}, INDEX_PROJECTION))
+        print(f"🔎 Search index built with {len(search_index)} books")
+    return search_index
+
+# Facet counts for the filter dropdowns
+facet_index = FacetIndex()
+
+def get_facet_index():
+    """Return the facet index, building it from the books collection on first use."""
+    check_catalog_version()
+    if not facet_index.loaded:
+        facet_index.build(mongo.db.books.find({}, FACET_PROJECTION))
+        print(f"📋 Facet index built with {len(facet_index)} books")
+    return facet_index
+
+# Autocomplete over titles, authors, subjects and tags
+suggest_index = SuggestIndex()
+
+def get_suggest_index():
+    """Return the autocomplete index, building it from the books collection on first use."""
+    check_catalog_version()
+    if not suggest_index.loaded:
+        suggest_index.build(mongo.db.books.find({}, SUGGEST_PROJECTION))
+        print(f"💡 Suggest index built with {len(suggest_index)} completions")
+    return suggest_index
+
+# Trigram index for typo-tolerant search
+fuzzy_index = TrigramIndex()
+
+def get_fuzzy_index():
+    """Return the trigram index, building it from the books collection on first use."""
+    check_catalog_version()
+    if not fuzzy_index.loaded:
+        fuzzy_index.build(mongo.db.books.find({}, FUZZY_PROJECTION))
+        print(f"🔤 Fuzzy index built with {len(fuzzy_index)} books")
+    return fuzzy_index
+
+# Time-decayed trending scores, rebuilt from the usage buckets periodically
+trending_index = TrendingIndex(half_life_hours=float(os.getenv('TRENDING_HALF_LIFE_HOURS', '24')),
+                               order_ttl=float(os.getenv('TRENDING_ORDER_SECONDS', '30')))
+trending_rebuilding = threading.Lock()
+
+def build_trending_index():
+    """Recompute every trending score from the usage buckets in the decay window."""
+    since = datetime.now() - timedelta(hours=trending_index.window_hours)
+    trending_index.build(
+        mongo.db.books.find({}, TRENDING_PROJECTION).sort("upload_date", -1),
+        mongo.db[EVENTS_COLLECTION].find({"hour": {"$gte": since}}, {"book_id": 1, "hour": 1, "downloads": 1, "previews": 1}),
+    )
+    print(f"🔥 Trending index built with {len(trending_index)} books")
+
+def rebuild_trending_in_background():
+    if not trending_rebuilding.acquire(blocking=False):
+        return
+    try:
+        build_trending_index()
+    except Exception as e:
+        print(f"❌ Trending rebuild failed: {e}")
+    finally:
+        trending_rebuilding.release()
+
+def get_trending_index():
+    """
+    Return the trending index, building it on first use. Afterwards it is
+    updated in place on every event and re-synced from the shared usage log
+    (which includes other workers' events) in a background thread.
+    """
+    if not trending_index.loaded:
+        build_trending_index()
+    elif time.monotonic() - trending_index.built_at > int(os.getenv('TRENDING_REBUILD_SECONDS', '600')):
+        trending_index.built_at = time.monotonic()
+        threading.Thread(target=rebuild_trending_in_background, daemon=True).start()
+    return trending_index
+
+# Background extraction of PDF page text for content search
+text_pipeline = None
+
+def get_text_pipeline():
+    """Return the text extraction pipeline, starting its worker pool on first use."""
+    global text_pipeline
+    if text_pipeline is None:
+        text_pipeline = TextExtractionPipeline(mongo.db, app.config['UPLOAD_FOLDER'],
+                                               max_workers=int(os.getenv('TEXT_EXTRACTION_WORKERS', '2')),
+                                               resolve=book_store.full_path, open_blob=book_store.open)
+    return text_pipeline
+
+def queue_text_extraction(book_id):
+    """Queue a book's PDF for page text extraction without blocking the request."""
+    try:
+        get_text_pipeline().submit(book_id)
+        print(f"📄 Queued text extraction for book {book_id}")
+    except Exception as e:
+        print(f"❌ Failed to queue text extraction for book {book_id}: {e}")
+
+def download_counts_flushed(batch):
+    """Stored download counts changed, so cached pages sorted by downloads are stale."""
+    result_cache.bump_version()
+
+# Download counts are buffered in memory and written in batches
+download_counter = None
+
+def get_download_counter():
+    """Return the write-behind download counter, creating it on first use."""
+    global download_counter
+    if download_counter is None:
+        download_counter = WriteBehindCounter(
+            mongo.db.books, field="downloads",
+            interval=float(os.getenv('DOWNLOAD_FLUSH_SECONDS', '5')),
+            max_pending=int(os.getenv('DOWNLOAD_FLUSH_MAX_PENDING', '1000')),
+            on_flush=download_counts_flushed,
+        )
+    return download_counter
+
+# Download and preview events, appended to hourly buckets in batches
+event_log = None
+
+def get_event_log():
+    """Return the usage event log, creating it on first use."""
+    global event_log
+    if event_log is None:
+        event_log = EventLog(
+            mongo.db,
+            interval=float(os.getenv('USAGE_FLUSH_SECONDS', '5')),
+            rollup_interval=int(os.getenv('USAGE_ROLLUP_SECONDS', '300')),
+        )
+    return event_log
+
+def record_usage(kind, book, bytes_sent=0):
+    """Buffer a download or preview event without adding a database round-trip."""
+    try:
+        get_event_log().record(kind, book['_id'], subject=book.get('subject'),
+                               user_id=session.get('user_id'), bytes_sent=bytes_sent)
+        if trending_index.loaded:
+            trending_index.record(book['_id'], kind)
+    except Exception as e:
+        print(f"❌ Failed to record {kind} event: {e}")
+
+@atexit.register
+def flush_buffers_on_shutdown():
+    """Write buffered download counts and usage events before the process exits."""
+    if download_counter is not None:
+        try:
+            flushed = download_counter.close()
+            print(f"📥 Flushed download counts for {flushed} book(s) on shutdown")
+        except Exception as e:
+            print(f"❌ Failed to flush download counts on shutdown: {e}")
+    if event_log is not None:
+        try:
+            flushed = event_log.close()
+            print(f"📈 Flushed {flushed} usage event(s) on shutdown")
+        except Exception as e:
+            print(f"❌ Failed to flush usage events on shutdown: {e}")
+
+def sync_book_indexes(book_id):
+    """Refresh in-process indexes after a book has been inserted or updated."""
+    try:
+        book = mongo.db.books.find_one({"_id": ObjectId(book_id)}, {**INDEX_PROJECTION, **FACET_PROJECTION, **SUGGEST_PROJECTION, **FUZZY_PROJECTION})
+        if book:
+            search_index.add(book)
+            suggest_index.add(book)
+            fuzzy_index.add(book)
+            trending_index.add(book)
+            get_facet_index().add(book)
+    except Exception as e:
+        print(f"❌ Failed to refresh indexes for book {book_id}: {e}")
+    try:
+        stored = recommend.fold_in(mongo.db, book_id)
+        print(f"🧭 Stored {stored} similar book(s) for {book_id}")
+    except Exception as e:
+        print(f"❌ Failed to update similar books for {book_id}: {e}")
+    bump_catalog_version()
+    result_cache.bump_version()
+
+def drop_book_indexes(book_id):
+    """Remove a deleted book from in-process indexes."""
+    try:
+        search_index.remove(book_id)
+        suggest_index.remove(book_id)
+        fuzzy_index.remove(book_id)
+        trending_index.remove(book_id)
+        get_facet_index().remove(book_id)
+        drop_book_text(mongo.db, book_id)
+        recommend.drop_book(mongo.db, book_id)
+    except Exception as e:
+        print(f"❌ Failed to drop indexes for book {book_id}: {e}")
+    bump_catalog_version()
+    result_cache.bump_version()
+
 # Test database connection
 @app.route("/test-db")
 def test_db():
@@ -82,6 +434,7 @@ def debug_data():
         
         books = list(mongo.db.books.find().limit(5))
         users = list(mongo.db.users.find().limit(5))
+        load_user_names(book.get('uploaded_by') for book in books)
         
         for book in books:
             book['_id'] = str(book['_id'])
@@ -109,10 +462,169 @@ def debug_data():
 UPLOAD_FOLDER = os.path.join('static', 'books')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+COVER_FOLDER = os.path.join('static', 'covers')
+
+# Where book and cover bytes live: "local" disk, or "gridfs" so several app
+# nodes share one library, each with a size-bounded local read cache
+app.config['STORAGE_BACKEND'] = os.getenv('STORAGE_BACKEND', 'local')
+if app.config['STORAGE_BACKEND'] not in BACKENDS:
+    print(f"⚠️ Unknown STORAGE_BACKEND {app.config['STORAGE_BACKEND']!r}, using local")
+    app.config['STORAGE_BACKEND'] = 'local'
+
+def storage_backend(root, bucket_name):
+    return make_backend(app.config['STORAGE_BACKEND'], root, bucket_name, lambda: mongo.db,
+                        cache_dir=os.getenv('BLOB_CACHE_DIR', 'blob_cache'),
+                        cache_max_bytes=int(os.getenv('BLOB_CACHE_MAX_BYTES', str(2 * 1024 ** 3))))
+
+# Content-addressed, reference-counted storage for book files and covers
+book_store = BlobStore(UPLOAD_FOLDER, "book", storage_backend(UPLOAD_FOLDER, "book_files"))
+cover_store = BlobStore(COVER_FOLDER, "cover", storage_backend(COVER_FOLDER, "cover_files"))
+
+def stored_book_fields(stored, original_filename):
+    """Book fields for a stored file: its path plus size, mtime, sha256, MIME type and page count."""
+    original_filename = secure_filename(original_filename)
+    return {
+        "filename": stored.path,
+        "original_filename": original_filename,
+        **describe_file(book_store.full_path(stored.path), original_filename, stored.digest),
+    }
+
+def store_book_file(file):
+    """Store an uploaded book file and return the book fields that describe it."""
+    stored = book_store.put(mongo.db, file.stream, file.filename)
+    print(f"💾 Book file stored at {stored.path} ({'new' if stored.created else 'already stored'})")
+    return stored_book_fields(stored, file.filename)
+
+# Stat results for book files whose metadata predates ingest-time recording
+file_stat_cache = StatCache(max_entries=int(os.getenv('FILE_STAT_CACHE_ENTRIES', '4096')),
+                            ttl=int(os.getenv('FILE_STAT_CACHE_TTL', '30')))
+
+def book_file_stat(book):
+    """
+    Size and mtime of a book's file from the book document when recorded at
+    ingest, otherwise from the stat cache. None when the file is missing.
+    """
+    if book.get("file_size") is not None and book.get("file_mtime") is not None:
+        return FileStat(book["file_size"], book["file_mtime"])
+    return file_stat_cache.stat(os.path.join(app.config['UPLOAD_FOLDER'], book['filename']))
+
+# Contents of small book files and cover variants, served without touching
+# storage; larger files keep going through sendfile / the front proxy
+small_file_cache = SmallFileCache(max_bytes=int(os.getenv('SMALL_FILE_CACHE_BYTES', str(64 * 1024 * 1024))),
+                                  max_file_bytes=int(os.getenv('SMALL_FILE_MAX_BYTES', str(256 * 1024))))
+
+# Resized JPEG/WebP cover variants, rendered in a process pool
+thumbnail_pipeline = None
+
+def get_thumbnail_pipeline():
+    """Return the cover variant pipeline, creating it on first use."""
+    global thumbnail_pipeline
+    if thumbnail_pipeline is None:
+        thumbnail_pipeline = ThumbnailPipeline(COVER_FOLDER, max_workers=int(os.getenv('THUMBNAIL_WORKERS', '2')),
+                                               source=cover_store.full_path)
+    return thumbnail_pipeline
+
+def store_cover(cover):
+    """Store an uploaded cover image, queue its variants and return its path under static/covers."""
+    stored = cover_store.put(mongo.db, cover.stream, cover.filename)
+    print(f"🖼️ Cover stored at {stored.path} ({'new' if stored.created else 'already stored'})")
+    try:
+        get_thumbnail_pipeline().submit(stored.path)
+    except Exception as e:
+        print(f"❌ Failed to queue cover variants for {stored.path}: {e}")
+    return stored.path
+
+def release_book_files(book, keep_file=False, keep_cover=False):
+    """Drop a book's references to its stored file and cover."""
+    try:
+        if book.get("filename") and not keep_file:
+            book_store.release(mongo.db, book["filename"])
+        if book.get("cover_filename") and not keep_cover:
+            if cover_store.release(mongo.db, book["cover_filename"]):
+                get_thumbnail_pipeline().remove(book["cover_filename"])
+                for width, fmt in ALL_VARIANTS:
+                    small_file_cache.discard(("cover", book["cover_filename"], width, fmt))
+    except Exception as e:
+        print(f"❌ Failed to release stored files: {e}")
+
+def cover_version(cover_filename):
+    """Short tag that changes with the cover, so variant URLs can be cached forever."""
+    return hashlib.sha1(cover_filename.encode("utf-8")).hexdigest()[:10]
+
+def cover_url(book_id, cover_filename, width=COVER_WIDTHS[0]):
+    """URL of a cover at `width` pixels (the original for covers that are not images)."""
+    if not is_image(cover_filename):
+        width = COVER_WIDTHS[0]   # one URL per original, so browsers cache it once
+    return url_for('cover_variant', book_id=str(book_id), width=width, v=cover_version(cover_filename))
+
+def cover_srcset(book_id, cover_filename):
+    """srcset with a width hint for every rendered variant of a cover."""
+    if not is_image(cover_filename):
+        return ""
+    return ", ".join(f"{cover_url(book_id, cover_filename, width)} {width}w" for width in COVER_WIDTHS)
+
+app.jinja_env.globals.update(cover_url=cover_url, cover_srcset=cover_srcset)
+
+# How file bytes leave the app: "direct" (Range-aware, sendfile when the server
+# supports it), or handed to a front proxy with "x-accel" (nginx) / "x-sendfile"
+app.config['FILE_TRANSFER_MODE'] = os.getenv('FILE_TRANSFER_MODE', 'direct')
+if app.config['FILE_TRANSFER_MODE'] not in TRANSFER_MODES:
+    print(f"⚠️ Unknown FILE_TRANSFER_MODE {app.config['FILE_TRANSFER_MODE']!r}, using direct")
+    app.config['FILE_TRANSFER_MODE'] = 'direct'
+app.config['X_ACCEL_PREFIX'] = os.getenv('X_ACCEL_PREFIX', '/protected-books/')
 
 print("🚀 Flask server has started...")
 print(f"📁 Upload folder: {UPLOAD_FOLDER}")
 
+def get_granted_book_ids():
+    """
+    Return the set of book ids the logged-in user may download (directly or
+    through a group or role grant), resolved once per request and cached
+    until the next catalog write.
+    """
+    if 'granted_book_ids' in g:
+        return g.granted_book_ids
+    user_id = session.get('user_id')
+    granted = set()
+    if user_id:
+        cache_key = ("grants", user_id)
+        hit, cached = result_cache.get(cache_key)
+        if hit:
+            granted = cached
+        else:
+            cache_version = result_cache.version
+            user = mongo.db.users.find_one({"_id": ObjectId(user_id)}, {"role": 1, "groups": 1}) if ObjectId.is_valid(user_id) else None
+            principals = grants.principals_for(user) if user else [grants.user_principal(user_id)]
+            granted = grants.granted_book_ids(mongo.db, principals)
+            result_cache.set(cache_key, granted, cache_version)
+    g.granted_book_ids = granted
+    return granted
+
+def can_download_book(book_id):
+    """O(1) download permission check for the current user."""
+    if session.get('role') == 'admin':
+        return True
+    return str(book_id) in get_granted_book_ids()
+
+app.jinja_env.globals.update(can_download_book=can_download_book)
+
+def render_catalog_page(page, search_term, author, year, subject, language, sort, fuzzy, content):
+    """Render index.html from a (possibly cached) catalog page plus the caller's selections."""
+    return render_template(
+        "index.html",
+        **page,
+        selected_author=author,
+        selected_year=year,
+        selected_subject=subject,
+        selected_language=language,
+        search_term=search_term,
+        sort=sort,
+        fuzzy=fuzzy,
+        content=content,
+        logged_in='logged_in' in session,
+        is_admin=(session.get('role') == 'admin')
+    )
+
 @app.route("/", methods=["GET", "POST"])
 def index():
     print("🏠 Index route called")
@@ -134,28 +646,54 @@ def index():
         subject = request.args.get("subject", "")
         language = request.args.get("language", "")
         sort = request.args.get("sort", "")
+        cursor = request.args.get("cursor", "")
+        fuzzy = request.args.get("fuzzy", "") == "1"
+        content = request.args.get("content", "") == "1"
 
         print(f"🔧 Filters - Author: '{author}', Year: '{year}', Subject: '{subject}', Language: '{language}', Sort: '{sort}'")
 
+        cache_key = ("index", " ".join(fold(search_term).split()), author, year, subject, language,
+                     sort, cursor, fuzzy, content)
+        hit, page = result_cache.get(cache_key)
+        if hit:
+            print("⚡ Serving catalog page from result cache")
+            return render_catalog_page(page, search_term, author, year, subject, language, sort, fuzzy, content)
+        cache_version = result_cache.version
+
         query = {}
-        if search_term:
-            query["$or"] = [
-                {"title": {"$regex": search_term, "$options": "i"}},
-                {"author": {"$regex": search_term, "$options": "i"}},
-                {"subject": {"$regex": search_term, "$options": "i"}},
-                {"tags": {"$regex": search_term, "$options": "i"}},
-            ]
+        ranked_ids = None
+        fuzzy_used = False
+        content_pages = {}
+        max_time_ms = app.config["CATALOG_MAX_TIME_MS"]
+        compiled = compile_query(search_term, resolve=get_facet_index().resolve) if search_term else None
+        if compiled and compiled.terms and content:
+            # Search inside book contents; hits carry their page numbers
+            ranked_ids, content_pages = search_pages(mongo.db, " ".join(token for token, _ in compiled.terms),
+                                                     max_time_ms=max_time_ms)
+            print(f"📄 Content search returned {len(ranked_ids)} books")
+        elif compiled and compiled.terms:
+            if not fuzzy:
+                ranked_ids = get_search_index().search_terms(compiled.terms)
+                print(f"🔎 Search index returned {len(ranked_ids)} hits")
+            if fuzzy or not ranked_ids:
+                # Explicit fuzzy mode, or a misspelling that matched nothing exactly
+                ranked_ids = get_fuzzy_index().search(" ".join(token for token, _ in compiled.terms))
+                fuzzy_used = True
+                print(f"🔤 Fuzzy search returned {len(ranked_ids)} hits")
         if author:
             query["author"] = author
+        year_filter = None
         if year:
             try:
-                query["year"] = int(year)
+                year_filter = query["year"] = int(year)
             except:
                 pass
         if subject:
             query["subject"] = subject
         if language:
             query["language"] = language
+        if compiled and compiled.mongo:
+            query = {"$and": [query, compiled.mongo]} if query else dict(compiled.mongo)
 
         print(f"🔍 MongoDB Query: {query}")
 
@@ -174,7 +712,7 @@ def index():
             books_collection = db['books']
             print(f"✅ Connected to database: {db.name}")
             
-            total_books = books_collection.count_documents({})
+            total_books = len(get_facet_index())
             print(f"📚 Total books in collection: {total_books}")
             
             if total_books == 0:
@@ -182,8 +720,46 @@ def index():
                 collections = db.list_collection_names()
                 print(f"📋 Available collections: {collections}")
             
-            books_cursor = books_collection.find(query).sort(sort_field, sort_dir)
-            books = list(books_cursor)
+            if compiled and compiled.phrases and ranked_ids and not fuzzy_used and not content:
+                # Confirm phrase matches among the search hits only
+                phrase_query = {"$and": [{"_id": {"$in": [ObjectId(i) for i in ranked_ids]}}] + compiled.phrases}
+                confirmed = {str(doc['_id']) for doc in books_collection.find(phrase_query, {"_id": 1}).max_time_ms(max_time_ms)}
+                ranked_ids = [book_id for book_id in ranked_ids if book_id in confirmed]
+
+            # Books allowed by the search text and field qualifiers, before dropdown filters
+            restrict_ids = None if ranked_ids is None else set(ranked_ids)
+            for field, values in (compiled.values.items() if compiled else []):
+                field_ids = get_facet_index().ids_for(field, values)
+                restrict_ids = field_ids if restrict_ids is None else restrict_ids & field_ids
+
+            facet_filters = {"author": author, "year": year_filter, "subject": subject, "language": language}
+            filtered_ids = get_facet_index().matching(facet_filters)
+            if restrict_ids is not None:
+                filtered_ids = restrict_ids if filtered_ids is None else filtered_ids & restrict_ids
+            if ranked_ids is not None:
+                ranked_ids = [book_id for book_id in ranked_ids if book_id in filtered_ids]
+                matching_books = len(ranked_ids)
+            else:
+                matching_books = total_books if filtered_ids is None else len(filtered_ids)
+
+            if sort == "trending":
+                # Hottest first among the matching books, ordered from memory
+                ranked_ids = get_trending_index().ranked(restrict=filtered_ids if ranked_ids is None else set(ranked_ids))
+
+            if ranked_ids is not None and (not sort or sort == "trending"):
+                # Without an explicit sort, search results keep their relevance order
+                page_ids, next_cursor, prev_cursor = paginate_ids(ranked_ids, cursor)
+                found = {str(book['_id']): book for book in books_collection.find(
+                    {"_id": {"$in": [ObjectId(i) for i in page_ids]}}, CATALOG_PROJECTION
+                ).max_time_ms(max_time_ms)}
+                books = [found[book_id] for book_id in page_ids if book_id in found]
+            else:
+                if ranked_ids is not None:
+                    id_filter = {"_id": {"$in": [ObjectId(book_id) for book_id in ranked_ids]}}
+                    query = {"$and": [query, id_filter]} if query else id_filter
+                books, next_cursor, prev_cursor = paginate(books_collection, query, sort_field, sort_dir, cursor,
+                                                           projection=CATALOG_PROJECTION,
+                                                           max_time_ms=max_time_ms)
             for book in books:
                 book['_id'] = str(book['_id'])  # Convert ObjectId to string
             
@@ -192,6 +768,10 @@ def index():
             for i, book in enumerate(books[:3]):
                 print(f"📖 Book {i+1}: {book.get('title', 'No title')} by {book.get('author', 'Unknown author')}")
 
+        except ExecutionTimeout:
+            print(f"⏱️ Catalog query exceeded {max_time_ms} ms")
+            return render_template("index.html", books=[], search_term=search_term,
+                                   error="Search took too long. Try a more specific query.")
         except Exception as db_error:
             print(f"❌ Database error: {db_error}")
             print(f"📊 Error details: {traceback.format_exc()}")
@@ -199,10 +779,11 @@ def index():
 
         try:
             print("📋 Getting filter dropdown values...")
-            authors = sorted(db.books.distinct("author"))
-            years = sorted(set([b.get("year") for b in db.books.find({}, {"year": 1}) if b.get("year")]))
-            subjects = sorted(db.books.distinct("subject"))
-            languages = sorted(db.books.distinct("language"))
+            facet_counts = get_facet_index().counts(facet_filters, restrict_to=restrict_ids)
+            authors = facet_counts["author"]
+            years = facet_counts["year"]
+            subjects = facet_counts["subject"]
+            languages = facet_counts["language"]
             
             print(f"👥 Authors: {len(authors)} found")
             print(f"📅 Years: {len(years)} found")
@@ -212,24 +793,37 @@ def index():
         except Exception as filter_error:
             print(f"❌ Error getting filter values: {filter_error}")
             authors = years = subjects = languages = []
+            cache_version = None
+
+        trending = []
+        if not search_term and not cursor and not (author or year or language):
+            # Homepage strip: overall, or within the chosen subject
+            try:
+                top = get_trending_index().top(limit=8, subject=subject or None)
+                titles = {str(book['_id']): book.get('title', '') for book in mongo.db.books.find(
+                    {"_id": {"$in": [ObjectId(book_id) for book_id, _ in top]}}, BOOK_LABEL_PROJECTION)}
+                trending = [{"_id": book_id, "title": titles[book_id]} for book_id, _ in top if book_id in titles]
+            except Exception as e:
+                print(f"❌ Failed to load trending books: {e}")
+
+        page = {
+            "books": books,
+            "trending": trending,
+            "authors": authors,
+            "years": years,
+            "subjects": subjects,
+            "languages": languages,
+            "fuzzy_used": fuzzy_used,
+            "content_pages": content_pages,
+            "total_books": matching_books,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
+        }
+        if cache_version is not None:
+            result_cache.set(cache_key, page, cache_version)
 
         print("🎨 Rendering template...")
-        return render_template(
-            "index.html",
-            books=books,
-            authors=authors,
-            years=years,
-            subjects=subjects,
-            languages=languages,
-            selected_author=author,
-            selected_year=year,
-            selected_subject=subject,
-            selected_language=language,
-            search_term=search_term,
-            sort=sort,
-            logged_in='logged_in' in session,
-            is_admin=(session.get('role') == 'admin')
-        )
+        return render_catalog_page(page, search_term, author, year, subject, language, sort, fuzzy, content)
         
     except Exception as e:
         error_msg = f"Error in index(): {str(e)}"
@@ -237,6 +831,22 @@ def index():
         print(f"📊 Full traceback: {traceback.format_exc()}")
         return render_template("index.html", books=[], error=f"Database error: {str(e)}")
 
+@app.route("/api/suggest")
+def api_suggest():
+    prefix = request.args.get("q", "").strip()
+    try:
+        limit = min(max(int(request.args.get("limit", 10)), 1), 50)
+    except ValueError:
+        limit = 10
+    if not prefix:
+        return jsonify({"query": prefix, "suggestions": []})
+    try:
+        suggestions = get_suggest_index().suggest(prefix, limit)
+        return jsonify({"query": prefix, "suggestions": suggestions})
+    except Exception as e:
+        print(f"❌ Suggest error: {str(e)}")
+        return jsonify({"query": prefix, "suggestions": [], "error": str(e)}), 500
+
 @app.route("/upload", methods=["GET", "POST"])
 def upload():
     print("📤 Upload route called")
@@ -259,19 +869,11 @@ def upload():
             print(f"🖼️ Cover: {cover.filename if cover and cover.filename else 'None'}")
 
             if file and file.filename.endswith(".pdf"):
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                print(f"💾 File saved to: {filepath}")
+                file_fields = store_book_file(file)
 
                 cover_filename = None
                 if cover and cover.filename != '':
-                    cover_filename = secure_filename(cover.filename)
-                    cover_folder = os.path.join('static', 'covers')
-                    os.makedirs(cover_folder, exist_ok=True)
-                    cover_path = os.path.join(cover_folder, cover_filename)
-                    cover.save(cover_path)
-                    print(f"🖼️ Cover saved to: {cover_path}")
+                    cover_filename = store_cover(cover)
 
                 book_data = {
                     "title": form["title"],
@@ -283,7 +885,7 @@ def upload():
                     "language": form.get("language", ""),
                     "year": int(form.get("year", 0)) if form.get("year") else 0,
                     "tags": [tag.strip() for tag in form.get("tags", "").split(",") if tag.strip()],
-                    "filename": filename,
+                    **file_fields,
                     "cover_filename": cover_filename,
                     "upload_date": datetime.now(),
                     "downloads": 0,
@@ -292,6 +894,8 @@ def upload():
                 
                 print(f"📊 Book data to insert: {book_data}")
                 result = mongo.db.books.insert_one(book_data)
+                sync_book_indexes(result.inserted_id)
+                queue_text_extraction(result.inserted_id)
                 
                 print(f"✅ Book uploaded successfully! ID: {result.inserted_id}")
                 return redirect(url_for('index'))
@@ -305,32 +909,300 @@ def upload():
 
     return render_template("upload.html")
 
+# Resumable chunked uploads: idle sessions are reaped in the background
+upload_reaping = threading.Lock()
+uploads_reaped_at = 0.0
+
+def reap_uploads_in_background():
+    if not upload_reaping.acquire(blocking=False):
+        return
+    try:
+        max_age = timedelta(hours=float(os.getenv('UPLOAD_SESSION_MAX_AGE_HOURS', '24')))
+        reaped = resumable_upload.reap_stale(mongo.db, book_store, max_age)
+        if reaped:
+            print(f"🧹 Reaped {reaped} stale upload session(s)")
+    except Exception as e:
+        print(f"❌ Upload reaper failed: {e}")
+    finally:
+        upload_reaping.release()
+
+def schedule_upload_reaper():
+    """Start a reaper pass when the last one is older than UPLOAD_REAP_SECONDS."""
+    global uploads_reaped_at
+    if time.monotonic() - uploads_reaped_at > int(os.getenv('UPLOAD_REAP_SECONDS', '3600')):
+        uploads_reaped_at = time.monotonic()
+        threading.Thread(target=reap_uploads_in_background, daemon=True).start()
+
+def upload_error_response(e):
+    return jsonify({"error": str(e), **e.details}), e.status
+
+@app.route("/api/uploads", methods=["POST"])
+def api_upload_create():
+    if 'user_id' not in session:
+        return jsonify({"error": "Login required"}), 401
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = resumable_upload.create_session(mongo.db, book_store, session['user_id'], data.get("filename"),
+                                                 data.get("size"), data.get("sha256"))
+    except UploadError as e:
+        return upload_error_response(e)
+    schedule_upload_reaper()
+    print(f"📤 Resumable upload {upload['_id']} started: {upload['filename']} ({upload['size']} bytes)")
+    return jsonify(resumable_upload.session_status(upload)), 201
+
+@app.route("/api/uploads/<upload_id>", methods=["GET", "PUT", "DELETE"])
+def api_upload_session(upload_id):
+    """GET: received/missing ranges; PUT ?offset=N: one chunk; DELETE: abort."""
+    if 'user_id' not in session:
+        return jsonify({"error": "Login required"}), 401
+    try:
+        upload = resumable_upload.get_session(mongo.db, upload_id, session['user_id'])
+        if request.method == "DELETE":
+            resumable_upload.abort(mongo.db, book_store, upload)
+            return "", 204
+        if request.method == "PUT":
+            try:
+                offset = int(request.args.get("offset", ""))
+            except ValueError:
+                return jsonify({"error": "offset query parameter is required"}), 400
+            upload = resumable_upload.write_chunk(mongo.db, book_store, upload, offset, request.content_length,
+                                                  request.stream, request.headers.get("X-Chunk-SHA256"))
+        return jsonify(resumable_upload.session_status(upload))
+    except UploadError as e:
+        return upload_error_response(e)
+
+@app.route("/api/uploads/<upload_id>/commit", methods=["POST"])
+def api_upload_commit(upload_id):
+    """Finish an upload and create the book from the metadata in the JSON body."""
+    if 'user_id' not in session:
+        return jsonify({"error": "Login required"}), 401
+    data = request.get_json(silent=True) or {}
+    missing = [field for field in ("title", "author", "subject") if not str(data.get(field, "")).strip()]
+    if missing:
+        return jsonify({"error": f"Missing fields: {', '.join(missing)}"}), 400
+    try:
+        upload = resumable_upload.get_session(mongo.db, upload_id, session['user_id'])
+        stored = resumable_upload.commit(mongo.db, book_store, upload)
+    except UploadError as e:
+        return upload_error_response(e)
+
+    tags = data.get("tags", [])
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    try:
+        year = int(data.get("year") or 0)
+    except (TypeError, ValueError):
+        year = 0
+    book_data = {
+        "title": data["title"],
+        "author": data["author"],
+        "subject": data["subject"],
+        "description": data.get("description", ""),
+        "isbn": data.get("isbn", ""),
+        "publisher": data.get("publisher", ""),
+        "language": data.get("language", ""),
+        "year": year,
+        "tags": [str(tag).strip() for tag in tags if str(tag).strip()],
+        **stored_book_fields(stored, upload["filename"]),
+        "cover_filename": None,
+        "upload_date": datetime.now(),
+        "downloads": 0,
+        "uploaded_by": session['user_id'],
+    }
+    result = mongo.db.books.insert_one(book_data)
+    sync_book_indexes(result.inserted_id)
+    queue_text_extraction(result.inserted_id)
+    print(f"✅ Resumable upload {upload_id} committed as book {result.inserted_id}")
+    return jsonify({"book_id": str(result.inserted_id), "filename": stored.path, "sha256": stored.digest}), 201
+
+# Book fields needed to serve its file (the stored hash doubles as the ETag)
+BOOK_FILE_PROJECTION = {"title": 1, "filename": 1, "original_filename": 1, "subject": 1,
+                        "file_sha256": 1, "file_size": 1, "file_mtime": 1}
+
+def small_book_file(book):
+    """
+    (contents, mtime, etag) of a book file small enough for the in-memory
+    cache, or None when it should be served from storage. Blobs are keyed by
+    their sha256 and need no stat at all; legacy files by path, size and
+    mtime from the stat cache.
+    """
+    filename = book['filename']
+    if is_blob_path(filename):
+        digest = book.get('file_sha256')
+        if not digest or not small_file_cache.fits(book.get('file_size')):
+            return None
+        data = small_file_cache.get(digest)
+        if data is None:
+            path = book_store.full_path(filename)
+            if path is None:
+                return None
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                return None
+            small_file_cache.put(digest, data)
+        return data, book.get('file_mtime') or 0, digest
+
+    path = book_store.full_path(filename)
+    stat = file_stat_cache.stat(path)
+    if stat is None or not small_file_cache.fits(stat.size):
+        return None
+    try:
+        data = small_file_cache.read((path, stat.size, stat.mtime), path)
+    except OSError:
+        return None
+    return data, stat.mtime, stored_file_hash(mongo.db, book, path, FileTransferStat(stat.size, stat.mtime))
+
+def send_stored_book(book, as_attachment):
+    """Serve a book's file with conditional and Range request handling."""
+    filename = book['filename']
+    download_name = book.get('original_filename') or os.path.basename(filename)
+    small = small_book_file(book)
+    if small is not None:
+        # Served straight from memory; a proxy handoff costs more than the bytes
+        data, mtime, etag = small
+        book['file_size'] = len(data)
+        return send_book_file(None, etag, download_name, as_attachment=as_attachment,
+                              stat=FileTransferStat(len(data), mtime), opener=lambda: io.BytesIO(data))
+    path = book_store.full_path(filename)
+    if path is None:
+        # Too large for the local blob cache: stream it from the storage backend
+        blob = book_store.stat(filename)
+        if blob is None or not book.get('file_sha256'):
+            print(f"❌ File not found in storage: {filename}")
+            abort(404)
+        book['file_size'] = blob.size
+        return send_book_file(None, book['file_sha256'], download_name, as_attachment=as_attachment,
+                              stat=FileTransferStat(blob.size, blob.mtime), opener=lambda: book_store.open(filename))
+    try:
+        stat = os.stat(path)
+    except OSError:
+        print(f"❌ File not found at: {path}")
+        abort(404)
+    if is_blob_path(filename) and book.get('file_sha256'):
+        etag = book['file_sha256']   # content-addressed: the name is the hash
+    else:
+        etag = stored_file_hash(mongo.db, book, path, stat)
+    book['file_size'] = stat.st_size
+    return send_book_file(path, etag, download_name, as_attachment=as_attachment,
+                          mode=app.config['FILE_TRANSFER_MODE'], internal_prefix=app.config['X_ACCEL_PREFIX'],
+                          internal_name=filename, stat=stat)
+
 @app.route("/download/<book_id>")
 def download(book_id):
     print(f"⬇️ Download requested for book ID: {book_id}")
-    book = mongo.db.books.find_one({"_id": ObjectId(book_id)})
+    book = mongo.db.books.find_one({"_id": ObjectId(book_id)}, BOOK_FILE_PROJECTION)
     if not book:
         print("❌ Book not found")
         abort(404)
 
-    user_id = session.get('user_id')
-    can_download = False
-    
-    if session.get('role') == 'admin':
-        can_download = True
-        print("✅ Admin can download")
-    elif user_id and user_id in book.get('allowed_users', []):
-        can_download = True
-        print("✅ User has download permission")
+    can_download = can_download_book(book_id)
+    print(f"{'✅' if can_download else '❌'} Download permission: {can_download}")
     
     if can_download:
-        mongo.db.books.update_one({"_id": ObjectId(book_id)}, {"$inc": {"downloads": 1}})
-        print(f"📥 Download count incremented for: {book.get('title')}")
-        return send_from_directory(app.config['UPLOAD_FOLDER'], book['filename'], as_attachment=True)
+        response = send_stored_book(book, as_attachment=True)
+        # Resumed or parallel range requests only count once, on the request for the first byte
+        if starts_download(response, book.get('file_size', 0)):
+            get_download_counter().incr(book_id)
+            suggest_index.bump(book_id)
+            print(f"📥 Download count buffered for: {book.get('title')}")
+            record_usage(DOWNLOAD, book, bytes_sent=bytes_sent(response, book.get('file_size', 0)))
+        return response
     else:
         print("❌ Download not allowed for user")
         return render_template("access_denied.html", message="Download not allowed. You can only preview this book online.")
 
+@app.route("/preview/<book_id>/file")
+def preview_file(book_id):
+    """The PDF behind the preview viewer, served inline with Range support."""
+    book = mongo.db.books.find_one({"_id": ObjectId(book_id)}, BOOK_FILE_PROJECTION)
+    if not book or not book.get("filename"):
+        abort(404)
+    return send_stored_book(book, as_attachment=False)
+
+def send_cover_original(cover, immutable):
+    """
+    A cover's original file (HTML covers, or an image whose variant failed
+    to render), from the small-file cache when it fits. Blobs are keyed by
+    their content-addressed path; legacy names by path, size and mtime.
+    """
+    mimetype = mimetypes.guess_type(cover)[0] or "application/octet-stream"
+    if is_blob_path(cover):
+        key, etag = ("cover", cover), cover_version(cover)
+    else:
+        stat = file_stat_cache.stat(cover_store.full_path(cover))
+        if stat is None:
+            abort(404)
+        key, etag = ("cover", cover, stat.size, stat.mtime), f"{cover_version(cover)}-{stat.size}-{stat.mtime}"
+    data = small_file_cache.get(key)
+    if data is None:
+        path = cover_store.full_path(cover)
+        try:
+            if path is None:
+                # Too large for the local blob cache: stream it from the storage backend
+                body = cover_store.open(cover)
+            elif small_file_cache.fits(os.path.getsize(path)):
+                with open(path, "rb") as f:
+                    data = f.read()
+                small_file_cache.put(key, data)
+                body = io.BytesIO(data)
+            else:
+                body = path
+        except FileNotFoundError:
+            abort(404)
+    else:
+        body = io.BytesIO(data)
+    response = send_file(body, mimetype=mimetype, conditional=True, etag=etag,
+                         max_age=31536000 if immutable else 3600)
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+@app.route("/covers/<book_id>/<int:width>")
+def cover_variant(book_id, width):
+    """
+    A book's cover resized to one of COVER_WIDTHS, as WebP when the client
+    accepts it and JPEG otherwise. Missing variants are rendered on demand.
+    """
+    if width not in COVER_WIDTHS or not ObjectId.is_valid(book_id):
+        abort(404)
+    cache_key = ("cover", book_id)
+    hit, cover = result_cache.get(cache_key)
+    if not hit:
+        cache_version = result_cache.version
+        book = mongo.db.books.find_one({"_id": ObjectId(book_id)}, {"cover_filename": 1})
+        cover = book.get("cover_filename") if book else None
+        result_cache.set(cache_key, cover, cache_version)
+    if not cover:
+        abort(404)
+    # URLs carrying the current cover version never change content
+    immutable = request.args.get("v") == cover_version(cover)
+    if not is_image(cover):
+        return send_cover_original(cover, immutable)
+
+    fmt = negotiate_format(request.accept_mimetypes)
+    variant_key = ("cover", cover, width, fmt)
+    data = small_file_cache.get(variant_key)
+    if data is None:
+        try:
+            path = get_thumbnail_pipeline().variant(cover, width, fmt)
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            abort(404)
+        except Exception as e:
+            print(f"❌ Failed to render {width}px {fmt} variant of {cover}: {e}")
+            return send_cover_original(cover, immutable=False)
+        small_file_cache.put(variant_key, data)
+    response = send_file(io.BytesIO(data), mimetype=FORMATS[fmt][2], conditional=True,
+                         etag=f"{cover_version(cover)}-{width}-{fmt}",
+                         max_age=31536000 if immutable else 3600)
+    if immutable:
+        response.cache_control.immutable = True
+    response.vary.add("Accept")
+    return response
+
 @app.route("/preview/<book_id>")
 def preview(book_id):
     print(f"👁️ Preview requested for book ID: {book_id}")
@@ -343,13 +1215,13 @@ def preview(book_id):
         print("❌ No file available for preview")
         return "No file to preview.", 400
 
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], book['filename'])
-    if not os.path.exists(file_path):
-        print(f"❌ File not found at: {file_path}")
+    if book_file_stat(book) is None:
+        print(f"❌ File not found: {book['filename']}")
         return "File not found or inaccessible.", 404
 
-    file_url = url_for('static', filename=f"books/{book['filename']}")
+    file_url = url_for('preview_file', book_id=book_id)
     print(f"🔗 Preview URL: {file_url}")
+    record_usage(PREVIEW, book)
     return render_template("preview.html", book=book, file_url=file_url)
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -434,26 +1306,42 @@ def admin_required(f):
 @admin_required
 def allow_download(book_id, user_id):
     print(f"✅ Admin allowing download for user {user_id} on book {book_id}")
-    mongo.db.books.update_one({"_id": ObjectId(book_id)}, {"$addToSet": {"allowed_users": user_id}})
+    grants.grant(mongo.db, grants.user_principal(user_id), book_id)
+    result_cache.bump_version()
     return redirect(url_for('admin_user_detail', user_id=user_id))
 
 @app.route("/admin/disallow_download/<book_id>/<user_id>")
 @admin_required
 def disallow_download(book_id, user_id):
     print(f"❌ Admin removing download permission for user {user_id} on book {book_id}")
-    mongo.db.books.update_one({"_id": ObjectId(book_id)}, {"$pull": {"allowed_users": user_id}})
+    grants.revoke(mongo.db, grants.user_principal(user_id), book_id)
+    result_cache.bump_version()
     return redirect(url_for('admin_user_detail', user_id=user_id))
 
 @app.route("/admin/dashboard")
 @admin_required
 def admin_dashboard():
     print("🔧 Admin dashboard accessed")
-    books = list(mongo.db.books.find())
+    books, books_next, books_prev = paginate(mongo.db.books, {}, "upload_date", -1, request.args.get("books_cursor"),
+                                             projection=ADMIN_BOOK_PROJECTION)
     for book in books:
         book['_id'] = str(book['_id'])
-    users = list(mongo.db.users.find())
-    print(f"📚 Admin dashboard: {len(books)} books, {len(users)} users")
-    return render_template("admin.html", books=books, users=users)
+    load_user_names(book.get('uploaded_by') for book in books)
+    users, users_next, users_prev = paginate(mongo.db.users, {}, "_id", 1, request.args.get("users_cursor"),
+                                             projection=USER_LIST_PROJECTION)
+    print(f"📚 Admin dashboard: {len(books)} books, {len(users)} users on this page")
+    try:
+        weekly = top_books(mongo.db, days=7, limit=10)
+        titles = {str(book['_id']): book.get('title', '') for book in mongo.db.books.find(
+            {"_id": {"$in": [ObjectId(book_id) for book_id, _ in weekly if ObjectId.is_valid(book_id)]}}, BOOK_LABEL_PROJECTION)}
+        top_weekly = [(book_id, titles[book_id], downloads) for book_id, downloads in weekly if book_id in titles]
+    except Exception as e:
+        print(f"❌ Failed to load weekly usage: {e}")
+        top_weekly = []
+    return render_template("admin.html", books=books, users=users,
+                           books_next=books_next, books_prev=books_prev,
+                           users_next=users_next, users_prev=users_prev,
+                           top_weekly=top_weekly)
 
 @app.route("/admin/add", methods=["GET", "POST"])
 @admin_required
@@ -464,20 +1352,16 @@ def admin_add():
         form = request.form
         file = request.files.get("file")
         cover = request.files.get("cover")
-        filename = None
+        file_fields = {"filename": None}
         cover_filename = None
         external_link = form.get("external_link", "")
         
         if file and file.filename:
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            print(f"💾 Admin uploaded file: {filename}")
+            file_fields = store_book_file(file)
+            print(f"💾 Admin uploaded file: {file_fields['original_filename']}")
             
         if cover and cover.filename:
-            cover_filename = secure_filename(cover.filename)
-            cover_folder = os.path.join('static', 'covers')
-            os.makedirs(cover_folder, exist_ok=True)
-            cover.save(os.path.join(cover_folder, cover_filename))
+            cover_filename = store_cover(cover)
             print(f"🖼️ Admin uploaded cover: {cover_filename}")
             
         book_data = {
@@ -492,7 +1376,7 @@ def admin_add():
             "year": int(form.get("year", 0)) if form.get("year") else 0,
             "tags": [tag.strip() for tag in form.get("tags", "").split(",") if tag.strip()],
             "keywords": [kw.strip() for kw in form.get("keywords", "").split(",") if kw.strip()],
-            "filename": filename,
+            **file_fields,
             "external_link": external_link,
             "cover_filename": cover_filename,
             "upload_date": datetime.now(),
@@ -501,6 +1385,9 @@ def admin_add():
         }
         
         result = mongo.db.books.insert_one(book_data)
+        sync_book_indexes(result.inserted_id)
+        if file_fields["filename"]:
+            queue_text_extraction(result.inserted_id)
         print(f"✅ Admin added book successfully! ID: {result.inserted_id}")
         return redirect(url_for('admin_dashboard'))
     return render_template("admin_book_form.html", book=None)
@@ -515,20 +1402,16 @@ def admin_edit(book_id):
         form = request.form
         file = request.files.get("file")
         cover = request.files.get("cover")
-        filename = book.get("filename")
+        file_fields = {}
         cover_filename = book.get("cover_filename")
         external_link = form.get("external_link", book.get("external_link", ""))
         
         if file and file.filename:
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            print(f"💾 Admin updated file: {filename}")
+            file_fields = store_book_file(file)
+            print(f"💾 Admin updated file: {file_fields['original_filename']}")
             
         if cover and cover.filename:
-            cover_filename = secure_filename(cover.filename)
-            cover_folder = os.path.join('static', 'covers')
-            os.makedirs(cover_folder, exist_ok=True)
-            cover.save(os.path.join(cover_folder, cover_filename))
+            cover_filename = store_cover(cover)
             print(f"🖼️ Admin updated cover: {cover_filename}")
             
         mongo.db.books.update_one({"_id": ObjectId(book_id)}, {"$set": {
@@ -543,10 +1426,15 @@ def admin_edit(book_id):
             "year": int(form.get("year", 0)) if form.get("year") else 0,
             "tags": [tag.strip() for tag in form.get("tags", "").split(",") if tag.strip()],
             "keywords": [kw.strip() for kw in form.get("keywords", "").split(",") if kw.strip()],
-            "filename": filename,
+            **file_fields,
             "external_link": external_link,
             "cover_filename": cover_filename
         }})
+        # The new files hold their own references (even identical re-uploads), so the old ones can go
+        release_book_files(book, keep_file=not file_fields, keep_cover=not (cover and cover.filename))
+        sync_book_indexes(book_id)
+        if file and file.filename:
+            queue_text_extraction(book_id)
         print(f"✅ Admin updated book successfully!")
         return redirect(url_for('admin_dashboard'))
     return render_template("admin_book_form.html", book=book)
@@ -555,15 +1443,20 @@ def admin_edit(book_id):
 @admin_required
 def admin_delete(book_id):
     print(f"🗑️ Admin deleting book: {book_id}")
-    result = mongo.db.books.delete_one({"_id": ObjectId(book_id)})
-    print(f"✅ Deleted {result.deleted_count} book(s)")
+    book = mongo.db.books.find_one_and_delete({"_id": ObjectId(book_id)}, {"filename": 1, "cover_filename": 1})
+    if book:
+        release_book_files(book)
+    grants.drop_book_grants(mongo.db, book_id)
+    drop_book_usage(mongo.db, book_id)
+    drop_book_indexes(book_id)
+    print(f"✅ Deleted {1 if book else 0} book(s)")
     return redirect(url_for('admin_dashboard'))
 
 @app.route("/admin/users")
 @admin_required
 def admin_users():
     print("👥 Admin users page accessed")
-    users = list(mongo.db.users.find())
+    users = list(mongo.db.users.find({}, USER_LIST_PROJECTION))
     print(f"👥 Found {len(users)} users")
     return render_template("admin_users.html", users=users)
 
@@ -571,44 +1464,42 @@ def admin_users():
 @admin_required
 def manage_access():
     print("🔐 Admin access management")
-    users = list(mongo.db.users.find({'role': 'user'}))
-    books = list(mongo.db.books.find())
-    for book in books:
-        book['_id'] = str(book['_id'])
-    print(f"🔐 Managing access for {len(users)} users and {len(books)} books")
-
     if request.method == 'POST':
-        user_id = request.form['user_id']
-        selected_books = request.form.getlist('books')
-        print(f"🔐 Updating access for user {user_id} with books: {selected_books}")
+        user_id = request.form.get('user_id', '')
+        group = request.form.get('group', '').strip()
+        selected_books = [book_id for book_id in request.form.getlist('books') if ObjectId.is_valid(book_id)]
+        page_books = [book_id for book_id in request.form.getlist('page_books') if ObjectId.is_valid(book_id)]
+        print(f"🔐 Updating access for {'group ' + group if group else 'user ' + user_id} with books: {selected_books}")
 
         try:
-            if not ObjectId.is_valid(user_id):
+            if group:
+                principal = grants.group_principal(group)
+            elif ObjectId.is_valid(user_id):
+                principal = grants.user_principal(user_id)
+            else:
                 flash("Invalid user ID.", "error")
                 return redirect(url_for('manage_access'))
 
-            mongo.db.books.update_many(
-                {"allowed_users": user_id},
-                {"$pull": {"allowed_users": user_id}}
-            )
-
-            for book_id in selected_books:
-                if ObjectId.is_valid(book_id):
-                    mongo.db.books.update_one(
-                        {'_id': ObjectId(book_id)},
-                        {'$addToSet': {'allowed_users': user_id}}
-                    )
-                else:
-                    print(f"❌ Invalid book ID: {book_id}")
+            # Only the books shown on the submitted page are changed, in one bulk write
+            added, removed = grants.set_grants(mongo.db, principal, selected_books, scope=page_books)
+            print(f"🔐 Granted {added} and revoked {removed} book(s) for {principal}")
             
+            result_cache.bump_version()
             flash("Access updated successfully.", "success")
         except Exception as e:
             print(f"❌ Error updating access: {str(e)}")
             flash(f"Error updating access: {str(e)}", "error")
         
-        return redirect(url_for('manage_access'))
+        return redirect(url_for('manage_access', cursor=request.form.get('cursor') or None))
 
-    return render_template('admin_manage_access.html', users=users, books=books)
+    users = list(mongo.db.users.find({'role': 'user'}, {'name': 1, 'email': 1}))
+    cursor = request.args.get('cursor')
+    books, next_cursor, prev_cursor = paginate(mongo.db.books, {}, "title", 1, cursor, projection=BOOK_LABEL_PROJECTION)
+    for book in books:
+        book['_id'] = str(book['_id'])
+    print(f"🔐 Managing access for {len(users)} users and {len(books)} books on this page")
+    return render_template('admin_manage_access.html', users=users, books=books, cursor=cursor,
+                           next_cursor=next_cursor, prev_cursor=prev_cursor)
 
 @app.route("/admin/user/<user_id>")
 @admin_required
@@ -619,12 +1510,24 @@ def admin_user_detail(user_id):
         print("❌ User not found")
         return redirect(url_for('admin_users'))
     
-    user_books = list(mongo.db.books.find({"uploaded_by": user_id}))
+    user_books = list(mongo.db.books.find({"uploaded_by": user_id}, ADMIN_BOOK_PROJECTION))
     for book in user_books:
         book['_id'] = str(book['_id'])
+    # Every book here was uploaded by this user, whose name is already loaded
+    g.setdefault('user_names', {})[user_id] = user.get('name', 'Unknown User')
+    load_user_names(book.get('uploaded_by') for book in user_books)
     print(f"📚 User {user.get('name')} has uploaded {len(user_books)} books")
     return render_template("admin_user_detail.html", user=user, books=user_books, is_admin=(session.get('role') == 'admin'))
 
+@app.route("/admin/user/<user_id>/groups", methods=["POST"])
+@admin_required
+def admin_set_user_groups(user_id):
+    groups = sorted({group.strip() for group in request.form.get("groups", "").split(",") if group.strip()})
+    print(f"👥 Admin setting groups for user {user_id}: {groups}")
+    mongo.db.users.update_one({"_id": ObjectId(user_id)}, {"$set": {"groups": groups}})
+    result_cache.bump_version()
+    return redirect(url_for('admin_user_detail', user_id=user_id))
+
 @app.route("/admin/user/delete/<user_id>")
 @admin_required
 def admin_delete_user(user_id):
@@ -632,6 +1535,9 @@ def admin_delete_user(user_id):
     user = mongo.db.users.find_one({"_id": ObjectId(user_id)})
     if user and user.get('role') != 'admin':
         result = mongo.db.users.delete_one({"_id": ObjectId(user_id)})
+        grants.drop_principal_grants(mongo.db, grants.user_principal(user_id))
+        user_name_cache.forget(user_id)
+        result_cache.bump_version()
         print(f"✅ Deleted {result.deleted_count} user(s)")
     else:
         print("❌ Cannot delete admin user")
@@ -651,28 +1557,68 @@ def admin_toggle_user_role(user_id):
         print(f"✅ Changed user role to: {new_role}")
     return redirect(url_for('admin_users'))
 
+@app.route("/admin/cache-stats")
+@admin_required
+def cache_stats():
+    stats = result_cache.stats()
+    if download_counter is not None:
+        stats["download_counter"] = download_counter.stats()
+    if event_log is not None:
+        stats["event_log"] = event_log.stats()
+    stats["file_stats"] = file_stat_cache.stats()
+    stats["small_files"] = small_file_cache.stats()
+    for name, store in (("book_blob_cache", book_store), ("cover_blob_cache", cover_store)):
+        if hasattr(store.backend, "cache"):
+            stats[name] = store.backend.cache.stats()
+    return jsonify(stats)
+
 @app.route('/book/<book_id>')
 def book_detail(book_id):
     print(f"📖 Book detail requested: {book_id}")
-    book = mongo.db.books.find_one({'_id': ObjectId(book_id)})
+    cache_key = ("book", book_id)
+    hit, book = result_cache.get(cache_key)
+    if not hit:
+        cache_version = result_cache.version
+        book = mongo.db.books.find_one({'_id': ObjectId(book_id)}, max_time_ms=app.config["CATALOG_MAX_TIME_MS"])
+        if book:
+            book['_id'] = str(book['_id'])  # Convert ObjectId to string
+            result_cache.set(cache_key, book, cache_version)
     if not book:
         print("❌ Book not found for detail view")
         return render_template('book_detail.html', error='Book not found', book=None, is_admin=(session.get('role') == 'admin'))
     
-    book['_id'] = str(book['_id'])  # Convert ObjectId to string
     can_download = session.get('role') == 'admin'
     print(f"⬇️ Can download: {can_download}")
     
+    similar_key = ("similar", book_id)
+    hit, similar = result_cache.get(similar_key)
+    if not hit:
+        cache_version = result_cache.version
+        try:
+            similar = recommend.similar_books(mongo.db, book_id)
+            result_cache.set(similar_key, similar, cache_version)
+        except Exception as e:
+            print(f"❌ Failed to load similar books: {e}")
+            similar = []
+
     file_size = None
     if book.get('filename'):
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], book['filename'])
-        if os.path.exists(file_path):
-            file_size = os.path.getsize(file_path)
+        stat = book_file_stat(book)
+        if stat is not None:
+            file_size = stat.size
             print(f"📁 File size: {file_size} bytes")
     
-    return render_template('book_detail.html', book=book, file_size=file_size, can_download=can_download, is_admin=(session.get('role') == 'admin'))
+    return render_template('book_detail.html', book=book, file_size=file_size, can_download=can_download, similar=similar, is_admin=(session.get('role') == 'admin'))
 
 if __name__ == "__main__":
+    ensure_app_indexes()
+    try:
+        get_search_index()
+        get_facet_index()
+        get_suggest_index()
+        get_fuzzy_index()
+    except Exception as e:
+        print(f"⚠️ Catalog indexes will be built on first use: {e}")
     print("🚀 Starting Flask server...")
     print(f"🔧 Debug mode: True")
     print(f"📡 MongoDB URI: {app.config['MONGO_URI']}")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Write-behind counters.
+Downloads increment an in-process buffer instead of the book document; the
+buffer merges increments per book and a background thread flushes them with
+one unordered bulk_write. At most `interval` seconds or `max_pending`
+increments can be lost if the process dies without running its shutdown hook.
+PeriodicFlusher holds the shared flusher thread for other write-behind buffers.
+"""
+
+import abc
+import threading
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+
+class PeriodicFlusher(abc.ABC):
+    """
+    Base for write-behind buffers: calls flush() from a daemon thread every
+    `interval` seconds, or sooner when woken, and once more on close().
+    """
+
+    def __init__(self, name, interval):
+        self.name = name
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _start(self):
+        """Start the flusher thread on first use. Call with self._lock held."""
+        if self._thread is None and not self._stopped.is_set():
+            self._thread = threading.Thread(target=self._loop, name=f"{self.name}-flusher", daemon=True)
+            self._thread.start()
+
+    @abc.abstractmethod
+    def flush(self):
+        """Write whatever is buffered; returns the number of items written."""
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break   # close() does the final flush
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Failed to flush {self.name}: {e}")
+
+    def close(self):
+        """Stop the flusher thread and write whatever is still buffered."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+        return self.flush()
+
+
+class WriteBehindCounter(PeriodicFlusher):
+    """Buffers $inc updates per document id and flushes them in batches."""
+
+    def __init__(self, collection, field="downloads", interval=5.0, max_pending=1000, on_flush=None):
+        super().__init__(f"{field} counts", interval)
+        self.collection = collection
+        self.field = field
+        self.max_pending = max_pending
+        self.on_flush = on_flush
+        self._pending = {}
+        self._pending_total = 0
+        self._flushed = 0
+
+    def incr(self, doc_id, amount=1):
+        """Buffer an increment; wakes the flusher early once max_pending is reached."""
+        doc_id = str(doc_id)
+        with self._lock:
+            self._pending[doc_id] = self._pending.get(doc_id, 0) + amount
+            self._pending_total += amount
+            full = self._pending_total >= self.max_pending
+            self._start()
+        if full:
+            self._wake.set()
+
+    def pending(self, doc_id=None):
+        """Return the unflushed increments for one id (or in total)."""
+        with self._lock:
+            if doc_id is None:
+                return self._pending_total
+            return self._pending.get(str(doc_id), 0)
+
+    def flush(self):
+        """Write every buffered increment with one unordered bulk_write. Returns the number of documents updated."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._pending_total = 0
+            ops = [UpdateOne({"_id": ObjectId(doc_id)}, {"$inc": {self.field: amount}})
+                   for doc_id, amount in batch.items() if ObjectId.is_valid(doc_id)]
+            if not ops:
+                return 0
+            try:
+                self.collection.bulk_write(ops, ordered=False)
+            except Exception:
+                # Put the batch back so the next flush retries it
+                with self._lock:
+                    for doc_id, amount in batch.items():
+                        self._pending[doc_id] = self._pending.get(doc_id, 0) + amount
+                        self._pending_total += amount
+                raise
+            self._flushed += len(ops)
+        if self.on_flush:
+            self.on_flush(batch)
+        return len(ops)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending_increments": self._pending_total,
+                "pending_documents": len(self._pending),
+                "documents_flushed": self._flushed,
+                "flush_interval_seconds": self.interval,
+                "max_pending": self.max_pending,
+            }
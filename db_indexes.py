@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Declarative index registry for the library database.
+The app reconciles these indexes at startup; run this script directly to
+reconcile a database by hand or to verify with explain() that every
+registered query shape is served by an index.
+
+Usage:
+    python db_indexes.py [--uri URI] [--explain] [--prune]
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, MongoClient
+from pymongo.errors import OperationFailure
+
+# collection -> list of IndexModel. Names are explicit so reconciliation is idempotent.
+INDEXES = {
+    "books": [
+        # Catalog sort orders, with the _id tiebreaker used by keyset pagination
+        IndexModel([("upload_date", DESCENDING), ("_id", DESCENDING)], name="upload_date_id"),
+        IndexModel([("title", ASCENDING), ("_id", ASCENDING)], name="title_id"),
+        IndexModel([("year", DESCENDING), ("_id", DESCENDING)], name="year_id"),
+        IndexModel([("downloads", DESCENDING), ("_id", DESCENDING)], name="downloads_id"),
+        # Dropdown filter + sort combinations issued by index()
+        IndexModel([("subject", ASCENDING), ("upload_date", DESCENDING), ("_id", DESCENDING)], name="subject_upload_date_id"),
+        IndexModel([("subject", ASCENDING), ("downloads", DESCENDING), ("_id", DESCENDING)], name="subject_downloads_id"),
+        IndexModel([("language", ASCENDING), ("upload_date", DESCENDING), ("_id", DESCENDING)], name="language_upload_date_id"),
+        IndexModel([("language", ASCENDING), ("downloads", DESCENDING), ("_id", DESCENDING)], name="language_downloads_id"),
+        IndexModel([("author", ASCENDING), ("upload_date", DESCENDING), ("_id", DESCENDING)], name="author_upload_date_id"),
+        IndexModel([("tags", ASCENDING)], name="tags"),
+        # Ownership, access control and file lookups
+        IndexModel([("uploaded_by", ASCENDING)], name="uploaded_by"),
+        # Only used to find legacy allowed_users arrays still awaiting migration
+        IndexModel([("allowed_users", ASCENDING)], name="allowed_users"),
+        IndexModel([("filename", ASCENDING)], name="filename"),
+    ],
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("role", ASCENDING)], name="role"),
+    ],
+    "grants": [
+        IndexModel([("principal", ASCENDING), ("book_id", ASCENDING)], name="principal_book_id", unique=True),
+        IndexModel([("book_id", ASCENDING)], name="book_id"),
+    ],
+    "book_pages": [
+        IndexModel([("text", TEXT)], name="text", default_language="english"),
+        IndexModel([("book_id", ASCENDING), ("page", ASCENDING)], name="book_id_page"),
+    ],
+    "usage_events": [
+        IndexModel([("book_id", ASCENDING), ("hour", ASCENDING), ("n", ASCENDING)], name="book_id_hour_n"),
+        IndexModel([("hour", ASCENDING)], name="hour"),
+    ],
+    "usage_hourly": [
+        IndexModel([("book_id", ASCENDING), ("start", ASCENDING)], name="book_id_start", unique=True),
+        IndexModel([("start", ASCENDING)], name="start"),
+    ],
+    "usage_daily": [
+        IndexModel([("book_id", ASCENDING), ("start", ASCENDING)], name="book_id_start", unique=True),
+        IndexModel([("start", ASCENDING)], name="start"),
+    ],
+    "usage_subject_daily": [
+        IndexModel([("subject", ASCENDING), ("start", ASCENDING)], name="subject_start", unique=True),
+        IndexModel([("start", ASCENDING)], name="start"),
+    ],
+    "book_neighbours": [
+        # Finds the lists that mention a deleted or re-folded book
+        IndexModel([("neighbours.book_id", ASCENDING)], name="neighbours_book_id"),
+    ],
+    "upload_sessions": [
+        # Idle resumable uploads found by the reaper
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+}
+
+# Query shapes the app issues: (name, collection, filter, sort)
+QUERY_SHAPES = [
+    ("catalog newest", "books", {}, [("upload_date", -1), ("_id", -1)]),
+    ("catalog by title", "books", {}, [("title", 1), ("_id", 1)]),
+    ("catalog by year", "books", {}, [("year", -1), ("_id", -1)]),
+    ("catalog by downloads", "books", {}, [("downloads", -1), ("_id", -1)]),
+    ("subject newest", "books", {"subject": "Fiction"}, [("upload_date", -1), ("_id", -1)]),
+    ("subject by downloads", "books", {"subject": "Fiction"}, [("downloads", -1), ("_id", -1)]),
+    ("language newest", "books", {"language": "English"}, [("upload_date", -1), ("_id", -1)]),
+    ("language by downloads", "books", {"language": "English"}, [("downloads", -1), ("_id", -1)]),
+    ("author qualifier", "books", {"author": {"$in": ["George Orwell"]}}, [("upload_date", -1), ("_id", -1)]),
+    ("year qualifier", "books", {"year": {"$gte": 1940, "$lte": 1950}}, [("year", -1), ("_id", -1)]),
+    ("books by uploader", "books", {"uploaded_by": "000000000000000000000000"}, None),
+    ("grants of a user", "grants", {"principal": {"$in": ["user:000000000000000000000000", "role:user"]}}, None),
+    ("books by filename", "books", {"filename": "book.pdf"}, None),
+    ("login by email", "users", {"email": "someone@example.com"}, None),
+    ("pages of a book", "book_pages", {"book_id": "000000000000000000000000"}, None),
+    ("usage buckets to roll up", "usage_events", {"hour": {"$gte": datetime(2024, 1, 1)}}, None),
+    ("downloads this week", "usage_daily", {"start": {"$gte": datetime(2024, 1, 1)}}, None),
+    ("stale upload sessions", "upload_sessions", {"updated_at": {"$lt": datetime(2024, 1, 1)}}, None),
+]
+
+
+def ensure_indexes(db, prune=False):
+    """
+    Create every registered index that is missing. Returns a list of
+    (collection, index name, status) tuples. With prune=True, indexes that
+    are no longer registered are dropped.
+    """
+    report = []
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        existing = {index["name"]: index for index in collection.list_indexes()}
+        for model in models:
+            name = model.document["name"]
+            if name in existing:
+                report.append((collection_name, name, "ok"))
+                continue
+            try:
+                collection.create_indexes([model])
+                report.append((collection_name, name, "created"))
+            except OperationFailure as e:
+                # e.g. duplicate emails block the unique index, or an equivalent index exists under another name
+                report.append((collection_name, name, f"failed: {e.details.get('errmsg', e) if e.details else e}"))
+        if prune:
+            registered = {model.document["name"] for model in models} | {"_id_"}
+            for name in existing:
+                if name not in registered:
+                    collection.drop_index(name)
+                    report.append((collection_name, name, "dropped"))
+    return report
+
+
+def plan_stages(plan):
+    """Yield every stage name in an explain() plan tree."""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from plan_stages(child)
+
+
+def explain_shapes(db):
+    """Return (name, stages, uses_collscan) for every registered query shape."""
+    results = []
+    for name, collection_name, query, sort in QUERY_SHAPES:
+        cursor = db[collection_name].find(query).limit(24)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        stages = list(plan_stages(plan))
+        results.append((name, stages, "COLLSCAN" in stages))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile and verify library database indexes")
+    parser.add_argument("--uri", default=os.getenv('MONGO_URI_LOCAL', 'mongodb://localhost:27017/library'))
+    parser.add_argument("--explain", action="store_true", help="fail if any registered query shape uses COLLSCAN")
+    parser.add_argument("--prune", action="store_true", help="drop indexes that are not registered")
+    args = parser.parse_args(argv)
+
+    client = MongoClient(args.uri)
+    db = client.get_default_database("library")
+
+    print(f"📊 Reconciling indexes on {db.name}...")
+    for collection_name, name, status in ensure_indexes(db, prune=args.prune):
+        print(f"   {collection_name}.{name}: {status}")
+
+    failed = False
+    if args.explain:
+        print("🔍 Explaining registered query shapes...")
+        for name, stages, collscan in explain_shapes(db):
+            marker = "❌" if collscan else "✅"
+            print(f"   {marker} {name}: {' <- '.join(stages)}")
+            failed = failed or collscan
+
+    client.close()
+    if failed:
+        print("❌ Some query shapes fall back to COLLSCAN")
+        return 1
+    print("✅ Indexes are in place")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Materialized facet counts for the catalog filter dropdowns.
+Keeps per-value book sets for author, year, subject and language in memory;
+each worker rebuilds its copy from the books collection when another worker
+changes the catalog.
+"""
+
+import threading
+from collections import defaultdict
+
+FACET_FIELDS = ("author", "year", "subject", "language")
+
+# Projection used when loading books into the facet index
+FACET_PROJECTION = {field: 1 for field in FACET_FIELDS}
+
+
+def facet_values(book):
+    """Return the non-empty facet values of a book document."""
+    values = {}
+    for field in FACET_FIELDS:
+        value = book.get(field)
+        if value not in (None, "", 0):
+            values[field] = value
+    return values
+
+
+class FacetIndex:
+    """In-memory facet index: field -> value -> set of book ids."""
+
+    def __init__(self):
+        self.loaded = False
+        self._values = {field: defaultdict(set) for field in FACET_FIELDS}
+        self._books = {}   # book_id -> {field: value}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._books)
+
+    def build(self, books):
+        """Rebuild the index from an iterable of book documents."""
+        with self._lock:
+            self._values = {field: defaultdict(set) for field in FACET_FIELDS}
+            self._books = {}
+            for book in books:
+                self._add(str(book["_id"]), facet_values(book), defaultdict(int))
+            self.loaded = True
+
+    def add(self, book):
+        """
+        Index (or re-index) a book and return the count deltas it caused
+        as {(field, value): delta}.
+        """
+        deltas = defaultdict(int)
+        with self._lock:
+            book_id = str(book["_id"])
+            self._remove(book_id, deltas)
+            self._add(book_id, facet_values(book), deltas)
+        return {key: delta for key, delta in deltas.items() if delta}
+
+    def remove(self, book_id):
+        """Drop a book and return the count deltas it caused."""
+        deltas = defaultdict(int)
+        with self._lock:
+            self._remove(str(book_id), deltas)
+        return dict(deltas)
+
+    def _add(self, book_id, values, deltas):
+        for field, value in values.items():
+            self._values[field][value].add(book_id)
+            deltas[(field, value)] += 1
+        self._books[book_id] = values
+
+    def _remove(self, book_id, deltas):
+        values = self._books.pop(book_id, None)
+        if not values:
+            return
+        for field, value in values.items():
+            ids = self._values[field].get(value)
+            if ids is None:
+                continue
+            ids.discard(book_id)
+            if not ids:
+                del self._values[field][value]
+            deltas[(field, value)] -= 1
+
+    def matching(self, filters):
+        """Return the set of book ids matching every active filter, or None if none are active."""
+        with self._lock:
+            result = None
+            for field, value in filters.items():
+                if field not in FACET_FIELDS or value in (None, ""):
+                    continue
+                ids = self._values[field].get(value, set())
+                result = set(ids) if result is None else result & ids
+            return result
+
+    def resolve(self, field, matcher):
+        """Return the stored values of field accepted by matcher."""
+        with self._lock:
+            return [value for value in self._values[field] if matcher(value)]
+
+    def ids_for(self, field, values):
+        """Return the ids of books whose field holds any of values."""
+        with self._lock:
+            ids = set()
+            for value in values:
+                ids |= self._values[field].get(value, set())
+            return ids
+
+    def counts(self, filters=None, restrict_to=None):
+        """
+        Return {field: [(value, count), ...]} sorted by value.
+
+        Counts for each field respect every other active filter (and the
+        optional restrict_to set of book ids), so a selected subject still
+        lists its sibling subjects.
+        """
+        filters = {field: value for field, value in (filters or {}).items()
+                   if field in FACET_FIELDS and value not in (None, "")}
+        with self._lock:
+            result = {}
+            for field in FACET_FIELDS:
+                base = None if restrict_to is None else set(restrict_to)
+                for other, value in filters.items():
+                    if other == field:
+                        continue
+                    ids = self._values[other].get(value, set())
+                    base = set(ids) if base is None else base & ids
+                counts = []
+                for value, ids in self._values[field].items():
+                    count = len(ids) if base is None else len(ids & base)
+                    if count or filters.get(field) == value:
+                        counts.append((value, count))
+                result[field] = sorted(counts, key=lambda item: (str(type(item[0])), item[0]))
+            return result
+
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Book file metadata recorded at ingest.
+Size, mtime, sha256, MIME type and PDF page count are stored on the book
+document when its file is written, so pages that describe a book never touch
+the filesystem. Books uploaded before that go through StatCache, which keeps
+stat results in memory and only re-stats a file once its entry is `ttl`
+seconds old.
+
+Record the metadata of existing books with:
+    python file_metadata.py --backfill [--uri URI] [--workers N]
+"""
+
+import argparse
+import mimetypes
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from pymongo import UpdateOne
+
+from pdf_text import file_fingerprint
+
+PDF_MIME = "application/pdf"
+
+FileStat = namedtuple("FileStat", "size mtime")
+
+
+def sniff_mime(path, name=None):
+    """MIME type from the file's magic bytes, falling back to its name."""
+    with open(path, "rb") as f:
+        if f.read(5) == b"%PDF-":
+            return PDF_MIME
+    return mimetypes.guess_type(name or path)[0] or "application/octet-stream"
+
+
+def pdf_page_count(path):
+    """Number of pages in a PDF, or None when it cannot be parsed."""
+    from pypdf import PdfReader
+
+    try:
+        return len(PdfReader(path, strict=False).pages)
+    except Exception:
+        return None
+
+
+def describe_file(path, name=None, digest=None):
+    """
+    Return the book fields describing a stored file. Pass `digest` when the
+    sha256 is already known (e.g. it was computed while the file streamed in).
+    """
+    stat = os.stat(path)
+    mime = sniff_mime(path, name)
+    return {
+        "file_size": stat.st_size,
+        "file_mtime": int(stat.st_mtime),
+        "file_sha256": digest or file_fingerprint(path),
+        "file_mime": mime,
+        "file_pages": pdf_page_count(path) if mime == PDF_MIME else None,
+    }
+
+
+class StatCache:
+    """
+    Thread-safe LRU of FileStat per path (None for missing files). Entries
+    older than `ttl` seconds are revalidated with one stat; an unchanged
+    mtime and size just renews the entry.
+    """
+
+    def __init__(self, max_entries=4096, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # path -> (FileStat or None, checked_at)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._revalidated = 0
+        self._changed = 0
+        self._misses = 0
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return FileStat(stat.st_size, int(stat.st_mtime))
+
+    def stat(self, path):
+        """Return the FileStat of a path, or None if it does not exist."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._entries.move_to_end(path)
+                self._hits += 1
+                return entry[0]
+
+        current = self._stat(path)
+        with self._lock:
+            if entry is None:
+                self._misses += 1
+            elif entry[0] == current:
+                self._revalidated += 1
+            else:
+                self._changed += 1
+            self._entries[path] = (current, now)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return current
+
+    def discard(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self._hits, "misses": self._misses,
+                    "revalidated": self._revalidated, "changed": self._changed}
+
+
+def _describe(job):
+    book_id, path, name = job
+    try:
+        return book_id, describe_file(path, name)
+    except OSError:
+        return book_id, None
+
+
+def backfill(db, folder, workers=2, force=False, batch_size=200):
+    """
+    Record file metadata for every book missing it (every book with
+    force=True), hashing and parsing files in a process pool. Returns
+    (books updated, files missing).
+    """
+    query = {"filename": {"$nin": [None, ""]}}
+    if not force:
+        query["file_mime"] = {"$exists": False}
+    jobs = [(book["_id"], os.path.join(folder, book["filename"]), book.get("original_filename") or book["filename"])
+            for book in db.books.find(query, {"filename": 1, "original_filename": 1})]
+
+    updated = missing = 0
+    ops = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for book_id, fields in pool.map(_describe, jobs, chunksize=8):
+            if fields is None:
+                missing += 1
+                continue
+            ops.append(UpdateOne({"_id": book_id}, {"$set": fields}))
+            if len(ops) >= batch_size:
+                updated += db.books.bulk_write(ops, ordered=False).modified_count
+                ops = []
+    if ops:
+        updated += db.books.bulk_write(ops, ordered=False).modified_count
+    return updated, missing
+
+
+def main(argv=None):
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Record size, hash, MIME type and page count of book files")
+    parser.add_argument("--uri", default=os.getenv('MONGO_URI_LOCAL', 'mongodb://localhost:27017/library'))
+    parser.add_argument("--folder", default=os.path.join('static', 'books'))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--backfill", action="store_true", help="describe every book missing metadata")
+    parser.add_argument("--force", action="store_true", help="describe every book again")
+    args = parser.parse_args(argv)
+
+    if not args.backfill:
+        parser.print_help()
+        return 1
+
+    client = MongoClient(args.uri)
+    db = client.get_default_database("library")
+    updated, missing = backfill(db, args.folder, workers=args.workers, force=args.force)
+    print(f"✅ Recorded file metadata for {updated} book(s), {missing} file(s) missing")
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
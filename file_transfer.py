@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Range-aware file responses for book downloads and previews.
+Supports conditional requests (strong ETags from the stored sha256 of the
+file, Last-Modified), single and multiple byte ranges with If-Range, and
+zero-copy sendfile through the server's wsgi.file_wrapper. In "x-accel" or
+"x-sendfile" mode the bytes (and range handling) are left to the front
+proxy, so no worker is held for the length of a transfer.
+"""
+
+import io
+import mimetypes
+import os
+import secrets
+from collections import namedtuple
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from flask import Response, request
+from werkzeug.http import http_date, is_resource_modified, quote_etag
+from werkzeug.wsgi import wrap_file
+
+from pdf_text import file_fingerprint
+
+TRANSFER_MODES = ("direct", "x-accel", "x-sendfile")
+
+# More ranges than this in one request are answered with the whole file
+MAX_RANGES = 16
+
+CHUNK_SIZE = 256 * 1024
+
+# The parts of os.stat_result send_book_file uses, for files without a local path
+FileTransferStat = namedtuple("FileTransferStat", "st_size st_mtime")
+
+
+def stored_file_hash(db, book, path, stat=None):
+    """
+    Return the sha256 of a book's file, taken from the book document while
+    its recorded size and mtime still match the file, recomputed (and stored)
+    otherwise.
+    """
+    stat = stat or os.stat(path)
+    if (book.get("file_sha256") and book.get("file_size") == stat.st_size
+            and book.get("file_mtime") == int(stat.st_mtime)):
+        return book["file_sha256"]
+    digest = file_fingerprint(path)
+    db.books.update_one({"_id": book["_id"]}, {"$set": {
+        "file_sha256": digest, "file_size": stat.st_size, "file_mtime": int(stat.st_mtime)}})
+    return digest
+
+
+class BoundedFile:
+    """
+    A file positioned at `start` that reads at most `length` bytes. It keeps
+    fileno() so sendfile-capable servers (which send Content-Length bytes
+    from the current offset) still avoid copying through Python.
+    """
+
+    def __init__(self, f, start, length):
+        self._f = f
+        self._f.seek(start)
+        self._remaining = length
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._f.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        # Servers probe for sendfile support with fileno() and expect
+        # AttributeError from streams that have no descriptor (e.g. GridFS)
+        try:
+            return self._f.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            raise AttributeError("fileno")
+
+    def tell(self):
+        return self._f.tell()
+
+    def close(self):
+        self._f.close()
+
+
+def satisfiable_ranges(range_header, size):
+    """Resolve a parsed Range header to [(start, stop)] byte offsets within the file."""
+    ranges = []
+    for start, stop in range_header.ranges:
+        if start < 0:   # suffix range: the last -start bytes
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+
+def _range_applies(etag, modified):
+    """If-Range: only honour Range when the client's validator still matches."""
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag   # strong comparison
+    if if_range.date:
+        return if_range.date == modified
+    return True
+
+
+def _part_header(boundary, content_type, start, stop, size):
+    return (f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n").encode()
+
+
+def _multipart(opener, ranges, size, content_type, boundary):
+    with opener() as f:
+        for start, stop in ranges:
+            yield _part_header(boundary, content_type, start, stop, size)
+            f.seek(start)
+            remaining = stop - start
+            while remaining:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+
+def send_book_file(path, etag, download_name, as_attachment=False, mode="direct",
+                   internal_prefix="/protected-books/", internal_name=None, stat=None, opener=None):
+    """
+    Build the response for a stored book file. `etag` must identify the
+    exact bytes (the file's sha256). In x-accel mode the proxy is sent to
+    internal_prefix + internal_name (the path relative to the upload folder,
+    default the file name). A file with no local path is read through
+    `opener` (returning a seekable binary stream) and `stat` (with st_size
+    and st_mtime), always in direct mode. Pass the response to bytes_sent()
+    for usage logging and to starts_download() for download counting.
+    """
+    if opener is None:
+        opener = lambda: open(path, "rb")
+    else:
+        mode = "direct"
+    stat = stat or os.stat(path)
+    size = stat.st_size
+    modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+    content_type = mimetypes.guess_type(download_name)[0] or "application/octet-stream"
+    headers = {
+        "ETag": quote_etag(etag),
+        "Last-Modified": http_date(modified),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=0, must-revalidate",
+    }
+    disposition = "attachment" if as_attachment else "inline"
+    headers["Content-Disposition"] = f"{disposition}; filename*=UTF-8''{quote(download_name, safe='')}"
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=modified):
+        return Response(status=304, headers=headers)
+
+    if mode == "x-accel":
+        # nginx serves the internal location, including Range/If-Range
+        headers["X-Accel-Redirect"] = internal_prefix.rstrip("/") + "/" + quote(internal_name or os.path.basename(path))
+        return Response(status=200, headers=headers, content_type=content_type)
+    if mode == "x-sendfile":
+        headers["X-Sendfile"] = os.path.abspath(path)
+        return Response(status=200, headers=headers, content_type=content_type)
+
+    ranges = None
+    if request.range is not None and request.range.units == "bytes" and _range_applies(etag, modified):
+        ranges = satisfiable_ranges(request.range, size)
+        if not ranges:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+        if len(ranges) > MAX_RANGES:
+            ranges = None
+
+    if ranges and len(ranges) > 1:
+        boundary = secrets.token_hex(12)
+        body = _multipart(opener, ranges, size, content_type, boundary)
+        response = Response(body, status=206, headers=headers,
+                            content_type=f"multipart/byteranges; boundary={boundary}", direct_passthrough=True)
+        response.content_length = sum(len(_part_header(boundary, content_type, start, stop, size)) + stop - start
+                                      for start, stop in ranges) + len(f"\r\n--{boundary}--\r\n")
+        return response
+
+    start, stop = ranges[0] if ranges else (0, size)
+    if ranges:
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    body = wrap_file(request.environ, BoundedFile(opener(), start, stop - start), buffer_size=CHUNK_SIZE)
+    response = Response(body, status=206 if ranges else 200, headers=headers,
+                        content_type=content_type, direct_passthrough=True)
+    response.content_length = stop - start
+    return response
+
+
+def _proxied(response):
+    return "X-Accel-Redirect" in response.headers or "X-Sendfile" in response.headers
+
+
+def _requested_ranges(size):
+    """Byte ranges the request asks for, or None for the whole file."""
+    if request.range is None or request.range.units != "bytes":
+        return None
+    return satisfiable_ranges(request.range, size)
+
+
+def bytes_sent(response, size):
+    """Bytes the response will carry (the requested ranges when a proxy sends them)."""
+    if response.status_code == 304:
+        return 0
+    if _proxied(response):
+        ranges = _requested_ranges(size)
+        return size if ranges is None else sum(stop - start for start, stop in ranges)
+    return response.content_length or 0
+
+
+def starts_download(response, size):
+    """
+    Whether the response begins a download of the file: no Range, or a Range
+    that includes the first byte. Resumed or parallel range requests for the
+    rest of the file are part of the same download. Proxied responses are
+    always 200, so this goes by the request rather than the status.
+    """
+    if response.status_code not in (200, 206):
+        return False
+    if response.status_code == 200 and not _proxied(response):
+        return True   # the whole file, e.g. after an If-Range mismatch
+    ranges = _requested_ranges(size)
+    return ranges is None or any(start == 0 for start, _ in ranges)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Typo-tolerant catalog search.
+Title, author and subject values are broken into word trigrams; a query
+collects candidate values from its rarest trigram postings (q-gram filter),
+drops those whose length is out of the edit budget, and re-ranks at most
+MAX_CANDIDATES of them with a bounded, diacritic-insensitive edit distance.
+"""
+
+import re
+import threading
+from collections import Counter, defaultdict
+
+from search_engine import fold
+
+FUZZY_FIELDS = ("title", "author", "subject")
+
+# Projection used when loading books into the fuzzy index
+FUZZY_PROJECTION = {field: 1 for field in FUZZY_FIELDS}
+
+# Lower rank wins when two values match equally well
+FIELD_PRIORITY = {"title": 0, "author": 1, "subject": 2}
+
+WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+# Most values re-ranked with the edit distance per query, best trigram overlap first
+MAX_CANDIDATES = 200
+
+
+def words(text):
+    """Fold text and split it into alphanumeric words."""
+    return WORD_RE.findall(fold(text))
+
+
+def trigrams(word_list):
+    """Return the set of padded trigrams for a list of words."""
+    grams = set()
+    for word in word_list:
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def max_edits(query):
+    """Edit budget for a query: one typo per four characters, at least one."""
+    return max(1, len(query) // 4)
+
+
+def bounded_levenshtein(a, b, limit):
+    """Edit distance between a and b, or limit + 1 once it exceeds limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            row_min = min(row_min, current[j])
+        if row_min > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+def window_distance(query_words, value_words, limit):
+    """Best bounded distance between the query and any same-length run of words in a value."""
+    query = " ".join(query_words)
+    size = len(query_words)
+    best = limit + 1
+    for start in range(max(1, len(value_words) - size + 1)):
+        candidate = " ".join(value_words[start:start + size])
+        best = min(best, bounded_levenshtein(query, candidate, limit))
+        if best == 0:
+            break
+    return best
+
+
+def window_lengths(value_words, size):
+    """Lengths of the word runs window_distance compares a `size`-word query against."""
+    return {len(" ".join(value_words[start:start + size])) for start in range(max(1, len(value_words) - size + 1))}
+
+
+class TrigramIndex:
+    """Trigram postings over distinct field values, each mapped to its books."""
+
+    def __init__(self):
+        self.loaded = False
+        self._values = {}                    # (field, text) -> folded words
+        self._refs = defaultdict(set)        # (field, text) -> book ids
+        self._postings = defaultdict(set)    # trigram -> (field, text) values
+        self._books = {}                     # book_id -> set of (field, text)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._books)
+
+    def build(self, books):
+        """Rebuild the index from an iterable of book documents."""
+        with self._lock:
+            self._values = {}
+            self._refs = defaultdict(set)
+            self._postings = defaultdict(set)
+            self._books = {}
+            for book in books:
+                self._add(book)
+            self.loaded = True
+
+    def add(self, book):
+        """Index (or re-index) a single book document."""
+        with self._lock:
+            self._remove(str(book["_id"]))
+            self._add(book)
+
+    def remove(self, book_id):
+        """Drop a book from the index."""
+        with self._lock:
+            self._remove(str(book_id))
+
+    def _add(self, book):
+        book_id = str(book["_id"])
+        keys = set()
+        for field in FUZZY_FIELDS:
+            text = book.get(field)
+            if not text or not str(text).strip():
+                continue
+            key = (field, str(text).strip())
+            if key not in self._values:
+                value_words = words(key[1])
+                self._values[key] = value_words
+                for gram in trigrams(value_words):
+                    self._postings[gram].add(key)
+            self._refs[key].add(book_id)
+            keys.add(key)
+        self._books[book_id] = keys
+
+    def _remove(self, book_id):
+        for key in self._books.pop(book_id, ()):
+            refs = self._refs.get(key)
+            if refs is None:
+                continue
+            refs.discard(book_id)
+            if refs:
+                continue
+            del self._refs[key]
+            for gram in trigrams(self._values.pop(key)):
+                postings = self._postings.get(gram)
+                if postings is not None:
+                    postings.discard(key)
+                    if not postings:
+                        del self._postings[gram]
+
+    def search(self, text, limit=None):
+        """Return book ids whose title, author or subject approximately match text."""
+        query_words = words(text)
+        if not query_words:
+            return []
+        limit_edits = max_edits(" ".join(query_words))
+        query_grams = trigrams(query_words)
+        # Each edit can destroy at most three trigrams of the query
+        needed = max(1, len(query_grams) - 3 * limit_edits)
+
+        query_length = len(" ".join(query_words))
+
+        with self._lock:
+            # A value missing from all of the len - needed + 1 rarest postings can share at
+            # most needed - 1 trigrams, so only those are walked; the common ones are probed
+            postings = sorted((self._postings.get(gram, ()) for gram in query_grams), key=len)
+            walked = len(postings) - needed + 1
+            shared = Counter()
+            for keys in postings[:walked]:
+                shared.update(keys)
+            for keys in postings[walked:]:
+                for key in shared:
+                    if key in keys:
+                        shared[key] += 1
+
+            candidates = sorted(
+                (-count, key) for key, count in shared.items()
+                if count >= needed and any(abs(length - query_length) <= limit_edits
+                                           for length in window_lengths(self._values[key], len(query_words)))
+            )
+            matches = []
+            for negative_count, key in candidates[:MAX_CANDIDATES]:
+                distance = window_distance(query_words, self._values[key], limit_edits)
+                if distance <= limit_edits:
+                    matches.append((distance, FIELD_PRIORITY[key[0]], negative_count, key))
+
+            ranked = []
+            seen = set()
+            for _, _, _, key in sorted(matches):
+                for book_id in sorted(self._refs[key]):
+                    if book_id not in seen:
+                        seen.add(book_id)
+                        ranked.append(book_id)
+        return ranked[:limit] if limit else ranked
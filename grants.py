@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Download access grants.
+Grants live in their own collection, one {principal, book_id} document
+each, instead of an ever-growing allowed_users array on every book. A
+principal is "user:<id>", "group:<name>" or "role:<role>", so a whole class
+can be granted a book with a single document.
+
+Copy legacy allowed_users arrays into the collection with:
+    python grants.py --migrate [--uri URI]
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+from pymongo import DeleteMany, UpdateOne
+
+GRANTS_COLLECTION = "grants"
+
+
+def user_principal(user_id):
+    return f"user:{user_id}"
+
+
+def group_principal(group):
+    return f"group:{group}"
+
+
+def role_principal(role):
+    return f"role:{role}"
+
+
+def principals_for(user):
+    """Return every principal a user document acts as."""
+    principals = [user_principal(user["_id"])]
+    if user.get("role"):
+        principals.append(role_principal(user["role"]))
+    principals.extend(group_principal(group) for group in user.get("groups", []) if group)
+    return principals
+
+
+def granted_book_ids(db, principals):
+    """Return the set of book ids granted to any of the principals (one covered index query)."""
+    cursor = db[GRANTS_COLLECTION].find({"principal": {"$in": list(principals)}}, {"_id": 0, "book_id": 1})
+    return {grant["book_id"] for grant in cursor}
+
+
+def grant_ops(principal, book_ids):
+    """Idempotent upserts granting books to a principal."""
+    now = datetime.now()
+    return [
+        UpdateOne({"principal": principal, "book_id": str(book_id)},
+                  {"$setOnInsert": {"granted_at": now}}, upsert=True)
+        for book_id in book_ids
+    ]
+
+
+def grant(db, principal, book_id):
+    db[GRANTS_COLLECTION].bulk_write(grant_ops(principal, [book_id]))
+
+
+def revoke(db, principal, book_id):
+    db[GRANTS_COLLECTION].delete_one({"principal": principal, "book_id": str(book_id)})
+
+
+def set_grants(db, principal, book_ids, scope=None):
+    """
+    Make the principal's grants equal book_ids, only touching books in scope
+    (all of the principal's grants when scope is None).
+
+    The change is computed as a diff against the current grants and applied
+    with one bulk_write. Returns (added, removed) counts.
+    """
+    wanted = {str(book_id) for book_id in book_ids}
+    query = {"principal": principal}
+    if scope is not None:
+        scope = {str(book_id) for book_id in scope}
+        wanted &= scope
+        query["book_id"] = {"$in": list(scope)}
+    current = {doc["book_id"] for doc in db[GRANTS_COLLECTION].find(query, {"_id": 0, "book_id": 1})}
+
+    to_add = wanted - current
+    to_remove = current - wanted
+    ops = grant_ops(principal, sorted(to_add))
+    if to_remove:
+        ops.append(DeleteMany({"principal": principal, "book_id": {"$in": sorted(to_remove)}}))
+    if ops:
+        db[GRANTS_COLLECTION].bulk_write(ops, ordered=False)
+    return len(to_add), len(to_remove)
+
+
+def drop_book_grants(db, book_id):
+    db[GRANTS_COLLECTION].delete_many({"book_id": str(book_id)})
+
+
+def drop_principal_grants(db, principal):
+    db[GRANTS_COLLECTION].delete_many({"principal": principal})
+
+
+def migrate_embedded_grants(db, batch_size=500):
+    """
+    Move legacy books.allowed_users arrays into the grants collection and
+    unset them. Safe to run repeatedly. Returns the number of grants written.
+    """
+    written = 0
+    ops = []
+    migrated = []
+    for book in db.books.find({"allowed_users.0": {"$exists": True}}, {"allowed_users": 1}):
+        book_id = str(book["_id"])
+        for user_id in book.get("allowed_users", []):
+            ops.extend(grant_ops(user_principal(user_id), [book_id]))
+        migrated.append(book["_id"])
+        if len(ops) >= batch_size:
+            db[GRANTS_COLLECTION].bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops = []
+    if ops:
+        db[GRANTS_COLLECTION].bulk_write(ops, ordered=False)
+        written += len(ops)
+    if migrated:
+        db.books.update_many({"_id": {"$in": migrated}}, {"$unset": {"allowed_users": ""}})
+    return written
+
+
+def main(argv=None):
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Manage download access grants")
+    parser.add_argument("--uri", default=os.getenv('MONGO_URI_LOCAL', 'mongodb://localhost:27017/library'))
+    parser.add_argument("--migrate", action="store_true", help="move books.allowed_users into the grants collection")
+    args = parser.parse_args(argv)
+
+    if not args.migrate:
+        parser.print_help()
+        return 1
+
+    client = MongoClient(args.uri)
+    db = client.get_default_database("library")
+    written = migrate_embedded_grants(db)
+    print(f"✅ Migrated {written} grant(s) into {GRANTS_COLLECTION}")
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Keyset (cursor-based) pagination helpers.
+Pages are addressed by opaque continuation tokens holding the sort key and
+_id of the last row seen, so every page costs one indexed range scan no
+matter how deep into the listing it is.
+"""
+
+import base64
+import binascii
+import json
+
+from bson import json_util
+
+PAGE_SIZE = 24
+
+
+class InvalidCursor(ValueError):
+    """Raised when a continuation token cannot be decoded."""
+
+
+def encode_cursor(sort_value, doc_id, direction):
+    """Build an opaque token pointing just past (or before) a row."""
+    payload = json_util.dumps({"v": sort_value, "id": doc_id, "d": direction})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """Return (sort_value, doc_id, direction) from a token."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        if data["d"] not in ("next", "prev"):
+            raise InvalidCursor(token)
+        return data["v"], data["id"], data["d"]
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError, ValueError):
+        raise InvalidCursor(token)
+
+
+def keyset_filter(sort_field, sort_dir, sort_value, doc_id):
+    """
+    Return the predicate selecting rows strictly after (sort_value, doc_id).
+    Null and missing values sort before everything else but never match
+    $gt/$lt, so they get their own branches: in ascending order every
+    non-null row follows a null cursor, in descending order the null rows
+    follow every non-null cursor.
+    """
+    op = "$gt" if sort_dir > 0 else "$lt"
+    if sort_field == "_id":
+        return {"_id": {op: doc_id}}
+    same_value = {sort_field: sort_value, "_id": {op: doc_id}}
+    if sort_value is None:
+        if sort_dir > 0:
+            return {"$or": [same_value, {sort_field: {"$ne": None}}]}
+        return same_value
+    branches = [{sort_field: {op: sort_value}}, same_value]
+    if sort_dir < 0:
+        branches.append({sort_field: None})
+    return {"$or": branches}
+
+
+def paginate(collection, query, sort_field, sort_dir, cursor=None, page_size=PAGE_SIZE, projection=None, max_time_ms=None):
+    """
+    Fetch one page of collection.find(query) ordered by (sort_field, _id).
+
+    Returns (docs, next_cursor, prev_cursor); a cursor is None when there is
+    nothing further in that direction. Invalid cursors restart at page one.
+    max_time_ms bounds the server-side execution time of the page query.
+    """
+    direction = "next"
+    page_query = dict(query)
+    if cursor:
+        try:
+            sort_value, doc_id, direction = decode_cursor(cursor)
+            scan_dir = sort_dir if direction == "next" else -sort_dir
+            page_query = {"$and": [query, keyset_filter(sort_field, scan_dir, sort_value, doc_id)]} if query else \
+                keyset_filter(sort_field, scan_dir, sort_value, doc_id)
+        except InvalidCursor:
+            print(f"⚠️ Ignoring invalid page cursor: {cursor}")
+            cursor = None
+            direction = "next"
+
+    scan_dir = sort_dir if direction == "next" else -sort_dir
+    sort_spec = [(sort_field, scan_dir)] if sort_field == "_id" else [(sort_field, scan_dir), ("_id", scan_dir)]
+    find = collection.find(page_query, projection).sort(sort_spec).limit(page_size + 1)
+    if max_time_ms:
+        find = find.max_time_ms(max_time_ms)
+    docs = list(find)
+
+    has_more = len(docs) > page_size
+    docs = docs[:page_size]
+    if direction == "prev":
+        docs.reverse()
+
+    next_cursor = prev_cursor = None
+    if docs:
+        first, last = docs[0], docs[-1]
+        if direction == "next":
+            if has_more:
+                next_cursor = encode_cursor(last.get(sort_field), last["_id"], "next")
+            if cursor:
+                prev_cursor = encode_cursor(first.get(sort_field), first["_id"], "prev")
+        else:
+            next_cursor = encode_cursor(last.get(sort_field), last["_id"], "next")
+            if has_more:
+                prev_cursor = encode_cursor(first.get(sort_field), first["_id"], "prev")
+    return docs, next_cursor, prev_cursor
+
+
+def paginate_ids(ranked_ids, cursor=None, page_size=PAGE_SIZE):
+    """
+    Page through an already ranked list of ids (e.g. search results).
+    Returns (page_ids, next_cursor, prev_cursor) using offset tokens.
+    """
+    offset = 0
+    if cursor:
+        try:
+            offset, _, _ = decode_cursor(cursor)
+            offset = max(0, int(offset))
+        except (InvalidCursor, TypeError, ValueError):
+            offset = 0
+    page = ranked_ids[offset:offset + page_size]
+    next_cursor = encode_cursor(offset + page_size, None, "next") if offset + page_size < len(ranked_ids) else None
+    prev_cursor = encode_cursor(max(0, offset - page_size), None, "prev") if offset > 0 else None
+    return page, next_cursor, prev_cursor
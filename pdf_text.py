@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Background PDF text extraction for searching inside book contents.
+Uploaded PDFs are queued to a worker pool; each worker fingerprints the
+file (reusing the sha256 recorded on the book while its size and mtime still
+match), skips it when the stored text is already current, and otherwise
+stores one document per page in the book_pages collection (searched via a
+MongoDB text index).
+
+Backfill the existing library with:
+    python pdf_text.py --backfill [--uri URI] [--workers N]
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+PAGES_COLLECTION = "book_pages"
+STATE_COLLECTION = "book_text_state"
+
+# Longest page text stored (characters); keeps page documents well under the BSON limit
+MAX_PAGE_CHARS = 100_000
+
+
+def file_fingerprint(path, chunk_size=1024 * 1024):
+    """Return the sha256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def recorded_fingerprint(book, path):
+    """The sha256 recorded on the book while its recorded size and mtime still match the file, else None."""
+    stat = os.stat(path)
+    if (book.get("file_sha256") and book.get("file_size") == stat.st_size
+            and book.get("file_mtime") == int(stat.st_mtime)):
+        return book["file_sha256"]
+    return None
+
+
+def copy_to_temp(source, chunk_size=1024 * 1024):
+    """Copy a readable stream to a temp file, hashing it on the way. Returns (path, sha256)."""
+    digest = hashlib.sha256()
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: source.read(chunk_size), b""):
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, digest.hexdigest()
+
+
+def extract_pages(path):
+    """Return the text of every page in a PDF (runs in a worker process)."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    return [(page.extract_text() or "")[:MAX_PAGE_CHARS] for page in reader.pages]
+
+
+def process_book(db, folder, book_id, extract=extract_pages, force=False, resolve=None, open_blob=None):
+    """
+    Extract and store the page text of one book if its file changed.
+    `resolve` maps a stored filename to a local path (default: under folder);
+    when it returns None, `open_blob` (if given) streams the file into a temp
+    copy, e.g. GridFS blobs too large for the local cache.
+    Returns "extracted", "unchanged", "missing" or "failed".
+    """
+    from bson.objectid import ObjectId
+
+    book = db.books.find_one({"_id": ObjectId(book_id)},
+                             {"filename": 1, "file_size": 1, "file_mtime": 1, "file_sha256": 1})
+    if not book or not book.get("filename"):
+        return "missing"
+    path = resolve(book["filename"]) if resolve else os.path.join(folder, book["filename"])
+    if not path and open_blob is not None:
+        try:
+            with open_blob(book["filename"]) as source:
+                path, fingerprint = copy_to_temp(source)
+        except FileNotFoundError:
+            return "missing"
+        try:
+            return store_pages(db, book, path, fingerprint, extract, force)
+        finally:
+            os.unlink(path)
+    if not path or not os.path.exists(path):
+        return "missing"
+    fingerprint = recorded_fingerprint(book, path) or file_fingerprint(path)
+    return store_pages(db, book, path, fingerprint, extract, force)
+
+
+def store_pages(db, book, path, fingerprint, extract, force):
+    """Extract a book's file at `path` unless text for the same fingerprint is already stored."""
+    book_id = str(book["_id"])
+    state = db[STATE_COLLECTION].find_one({"_id": book_id})
+    if not force and state and state.get("sha256") == fingerprint and state.get("status") == "extracted":
+        return "unchanged"
+
+    try:
+        pages = extract(path)
+    except Exception as e:
+        db[STATE_COLLECTION].replace_one({"_id": book_id}, {
+            "filename": book["filename"],
+            "sha256": fingerprint,
+            "status": "failed",
+            "error": str(e)[:500],
+            "updated": datetime.now(),
+        }, upsert=True)
+        return "failed"
+
+    db[PAGES_COLLECTION].delete_many({"book_id": book_id})
+    docs = [{"book_id": book_id, "page": number, "text": text}
+            for number, text in enumerate(pages, 1) if text.strip()]
+    if docs:
+        db[PAGES_COLLECTION].insert_many(docs, ordered=False)
+    db[STATE_COLLECTION].replace_one({"_id": book_id}, {
+        "filename": book["filename"],
+        "sha256": fingerprint,
+        "status": "extracted",
+        "pages": len(pages),
+        "updated": datetime.now(),
+    }, upsert=True)
+    return "extracted"
+
+
+def drop_book_text(db, book_id):
+    """Forget the stored text of a deleted book."""
+    db[PAGES_COLLECTION].delete_many({"book_id": str(book_id)})
+    db[STATE_COLLECTION].delete_one({"_id": str(book_id)})
+
+
+def search_pages(db, text, limit=500, max_time_ms=None):
+    """
+    Full-text search over stored page text.
+    Returns (ranked book ids, {book_id: [page numbers]}), best match first.
+    """
+    cursor = db[PAGES_COLLECTION].find(
+        {"$text": {"$search": text}},
+        {"book_id": 1, "page": 1, "score": {"$meta": "textScore"}},
+    ).sort([("score", {"$meta": "textScore"})]).limit(limit)
+    if max_time_ms:
+        cursor = cursor.max_time_ms(max_time_ms)
+
+    pages = OrderedDict()
+    for hit in cursor:
+        pages.setdefault(hit["book_id"], []).append(hit["page"])
+    for numbers in pages.values():
+        numbers.sort()
+    return list(pages), dict(pages)
+
+
+class TextExtractionPipeline:
+    """
+    Queues books for extraction off the request thread. Coordination runs in
+    a small thread pool; the CPU-heavy PDF parsing runs in a process pool.
+    """
+
+    def __init__(self, db, folder, max_workers=2, resolve=None, open_blob=None):
+        self.db = db
+        self.folder = folder
+        self.max_workers = max_workers
+        self.resolve = resolve
+        self.open_blob = open_blob
+        self._threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdf-text")
+        self._processes = None
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def _extract(self, path):
+        with self._lock:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._processes.submit(extract_pages, path).result()
+
+    def submit(self, book_id, force=False):
+        """Queue a book; repeated submissions while it is queued are merged."""
+        book_id = str(book_id)
+        with self._lock:
+            if book_id in self._pending:
+                return None
+            self._pending.add(book_id)
+        return self._threads.submit(self._run, book_id, force)
+
+    def _run(self, book_id, force):
+        with self._lock:
+            self._pending.discard(book_id)
+        try:
+            status = process_book(self.db, self.folder, book_id, extract=self._extract, force=force,
+                                  resolve=self.resolve, open_blob=self.open_blob)
+            print(f"📄 Text extraction for book {book_id}: {status}")
+            return status
+        except Exception as e:
+            print(f"❌ Text extraction failed for book {book_id}: {e}")
+            return "failed"
+
+    def shutdown(self, wait=True):
+        self._threads.shutdown(wait=wait)
+        if self._processes is not None:
+            self._processes.shutdown(wait=wait)
+
+
+def backfill(db, folder, workers=2, force=False):
+    """Queue every book with a file and wait for the pool to finish. Returns status counts."""
+    pipeline = TextExtractionPipeline(db, folder, max_workers=workers)
+    futures = [pipeline.submit(book["_id"], force=force)
+               for book in db.books.find({"filename": {"$nin": [None, ""]}}, {"_id": 1})]
+    counts = {}
+    for future in futures:
+        if future is not None:
+            status = future.result()
+            counts[status] = counts.get(status, 0) + 1
+    pipeline.shutdown()
+    return counts
+
+
+def main(argv=None):
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Extract searchable page text from library PDFs")
+    parser.add_argument("--uri", default=os.getenv('MONGO_URI_LOCAL', 'mongodb://localhost:27017/library'))
+    parser.add_argument("--folder", default=os.path.join('static', 'books'))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--backfill", action="store_true", help="process every book in the library")
+    parser.add_argument("--force", action="store_true", help="re-extract even when the file is unchanged")
+    args = parser.parse_args(argv)
+
+    if not args.backfill:
+        parser.print_help()
+        return 1
+
+    client = MongoClient(args.uri)
+    db = client.get_default_database("library")
+    print(f"📄 Backfilling page text for {db.name} with {args.workers} workers...")
+    counts = backfill(db, args.folder, workers=args.workers, force=args.force)
+    for status, count in sorted(counts.items()):
+        print(f"   {status}: {count}")
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+List-view projections for rendering catalog and admin tables.
+Listings only fetch the fields their templates display: descriptions are
+truncated server-side and the allowed_users ACL array is never shipped.
+"""
+
+# Characters of description sent to the catalog grid (one extra so the
+# template can tell whether to add an ellipsis)
+DESCRIPTION_PREVIEW_CHARS = 200
+
+# Fields shown in the admin book tables
+ADMIN_BOOK_PROJECTION = {
+    "title": 1,
+    "author": 1,
+    "year": 1,
+    "language": 1,
+    "subject": 1,
+    "cover_filename": 1,
+    "uploaded_by": 1,
+    "downloads": 1,
+    "upload_date": 1,
+}
+
+# Fields needed to label a book in pickers such as the access form
+BOOK_LABEL_PROJECTION = {"title": 1, "author": 1}
+
+# User fields shown in admin tables (never the password hash)
+USER_LIST_PROJECTION = {"name": 1, "email": 1, "role": 1}
+
+
+# Fields rendered by the catalog grid. Download permission is resolved per
+# request from the caller's grant set, so allowed_users is never fetched.
+CATALOG_PROJECTION = {
+    "title": 1,
+    "author": 1,
+    "year": 1,
+    "subject": 1,
+    "language": 1,
+    "cover_filename": 1,
+    "upload_date": 1,
+    "downloads": 1,
+    "description": {"$substrCP": [{"$ifNull": ["$description", ""]}, 0, DESCRIPTION_PREVIEW_CHARS + 1]},
+}
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Query compiler for the catalog search box.
+Parses user input into a small AST (terms, prefixes, phrases and
+author:/subject:/year: qualifiers) and compiles it into search-engine terms
+plus escaped, index-friendly MongoDB predicates. User text never reaches
+$regex unescaped.
+"""
+
+import re
+from collections import namedtuple
+
+from search_engine import fold, tokenize
+
+QUALIFIERS = ("author", "subject", "year")
+
+# AST nodes
+Term = namedtuple("Term", "text prefix")
+Phrase = namedtuple("Phrase", "text")
+Qualifier = namedtuple("Qualifier", "field value prefix")
+
+# Compiled form of a query
+CompiledQuery = namedtuple("CompiledQuery", "terms phrases mongo values")
+
+TOKEN_RE = re.compile(r'(?:([A-Za-z]+):)?(?:"([^"]*)"?|(\S+))')
+YEAR_RE = re.compile(r"^(\d{1,4})(?:-(\d{1,4}))?$")
+
+# Fields a phrase is matched against
+PHRASE_FIELDS = ("title", "author", "subject", "tags")
+
+
+def parse_query(text):
+    """Parse search box input into a list of Term, Phrase and Qualifier nodes."""
+    nodes = []
+    for match in TOKEN_RE.finditer(text or ""):
+        field, quoted, bare = match.groups()
+        value = quoted if quoted is not None else bare
+        if field and field.lower() in QUALIFIERS:
+            value = value.strip()
+            prefix = value.endswith("*")
+            value = value.rstrip("*").strip()
+            if value:
+                nodes.append(Qualifier(field.lower(), value, prefix))
+            continue
+        if field:
+            # Unknown qualifier: treat "foo:bar" as plain words
+            value = f"{field} {value}"
+        if quoted is not None and not field:
+            if tokenize(value):
+                nodes.append(Phrase(value.strip()))
+            continue
+        prefix = value.endswith("*")
+        tokens = tokenize(value)
+        for i, token in enumerate(tokens):
+            nodes.append(Term(token, prefix and i == len(tokens) - 1))
+    return nodes
+
+
+def qualifier_matcher(qualifier):
+    """Return a predicate deciding whether a stored field value satisfies a qualifier."""
+    if qualifier.field == "year":
+        match = YEAR_RE.match(qualifier.value)
+        if not match:
+            return lambda value: False
+        low = int(match.group(1))
+        high = int(match.group(2)) if match.group(2) else low
+        return lambda value: isinstance(value, int) and low <= value <= high
+
+    # Match whole words (or word prefixes) anywhere in the value, ignoring case and accents
+    wanted = re.compile(
+        r"(?<![^\W_])" + re.escape(fold(qualifier.value)) + ("" if qualifier.prefix else r"(?![^\W_])")
+    )
+    return lambda value: bool(wanted.search(fold(value)))
+
+
+def qualifier_predicate(qualifier):
+    """Index-usable predicate for a qualifier when its values cannot be resolved in memory."""
+    if qualifier.field == "year":
+        match = YEAR_RE.match(qualifier.value)
+        if not match:
+            return {"year": {"$in": []}}
+        low = int(match.group(1))
+        high = int(match.group(2)) if match.group(2) else low
+        return {"year": low} if low == high else {"year": {"$gte": low, "$lte": high}}
+    if qualifier.prefix:
+        return {qualifier.field: {"$regex": "^" + re.escape(qualifier.value)}}
+    return {qualifier.field: qualifier.value}
+
+
+def phrase_predicate(phrase):
+    """Escaped substring predicate for a phrase (only ever run against search hits)."""
+    pattern = re.escape(phrase.text)
+    return {"$or": [{field: {"$regex": pattern, "$options": "i"}} for field in PHRASE_FIELDS]}
+
+
+def compile_query(text, resolve=None, prefix_last=True):
+    """
+    Compile search box input.
+
+    resolve(field, matcher) may return the exact stored values satisfying a
+    qualifier (e.g. from the facet index); those become equality $in
+    predicates on the field's index. Without it qualifiers compile to
+    equality, range or left-anchored prefix predicates.
+
+    Returns CompiledQuery(terms, phrases, mongo, values):
+      terms   - [(token, is_prefix)] for the search engine, phrase words included
+      phrases - Mongo predicates to confirm phrase hits
+      mongo   - predicate for the qualifiers
+      values  - {field: [exact values]} for resolved qualifiers
+    """
+    nodes = parse_query(text)
+    terms = []
+    phrases = []
+    clauses = []
+    values = {}
+
+    last_term = max((i for i, node in enumerate(nodes) if isinstance(node, Term)), default=None)
+    for i, node in enumerate(nodes):
+        if isinstance(node, Term):
+            terms.append((node.text, node.prefix or (prefix_last and i == last_term)))
+        elif isinstance(node, Phrase):
+            terms.extend((token, False) for token in tokenize(node.text))
+            phrases.append(phrase_predicate(node))
+        else:
+            resolved = resolve(node.field, qualifier_matcher(node)) if resolve else None
+            if resolved is None:
+                clauses.append(qualifier_predicate(node))
+                continue
+            if node.field in values:
+                resolved = [value for value in values[node.field] if value in set(resolved)]
+            values[node.field] = resolved
+            clauses.append({node.field: {"$in": resolved}})
+
+    if not clauses:
+        mongo = {}
+    elif len(clauses) == 1:
+        mongo = clauses[0]
+    else:
+        mongo = {"$and": clauses}
+    return CompiledQuery(terms, phrases, mongo, values)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Precomputed "similar books".
+Each book is a sparse vector of IDF-weighted subject, author and tag
+features plus the users who downloaded it. Cosine similarity is computed in
+NumPy row blocks and the top neighbours of every book are stored in the
+book_neighbours collection, so the detail page only does one _id lookup.
+
+Rebuild the whole table (e.g. nightly from cron) with:
+    python recommend.py --rebuild [--uri URI]
+
+New or edited books are folded in by fold_in() without a full recompute.
+"""
+
+import argparse
+import math
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+from bson.objectid import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+
+from usage_events import EVENTS_COLLECTION, KIND_CODES, DOWNLOAD
+
+NEIGHBOURS_COLLECTION = "book_neighbours"
+NEIGHBOURS_PER_BOOK = 8
+
+RECOMMEND_PROJECTION = {"title": 1, "author": 1, "subject": 1, "tags": 1, "cover_filename": 1}
+
+# Relative weight of each kind of shared feature
+FEATURE_WEIGHTS = {"author": 2.0, "subject": 1.0, "tag": 1.5, "user": 1.0}
+
+# Rows of the similarity matrix computed at once (bounds memory to BLOCK_ROWS x books
+# plus the nonzero feature weights)
+BLOCK_ROWS = 256
+
+
+def feature_queries(book):
+    """Return [(feature, filter)] for the subject, author and tags of a book."""
+    pairs = []
+    if book.get("subject"):
+        pairs.append((("subject", book["subject"].strip().lower()), {"subject": book["subject"]}))
+    if book.get("author"):
+        pairs.append((("author", book["author"].strip().lower()), {"author": book["author"]}))
+    for tag in book.get("tags") or []:
+        if tag and tag.strip():
+            pairs.append((("tag", tag.strip().lower()), {"tags": tag}))
+    return pairs
+
+
+def content_features(book):
+    """Return the subject, author and tag feature keys of a book."""
+    return {feature for feature, _ in feature_queries(book)}
+
+
+def co_downloads(db, days=180):
+    """Return {book_id: set(user_id)} from the download events of the last `days` days."""
+    since = datetime.now() - timedelta(days=days)
+    readers = {}
+    for bucket in db[EVENTS_COLLECTION].find({"hour": {"$gte": since}}, {"book_id": 1, "events.u": 1, "events.k": 1}):
+        users = {event["u"] for event in bucket.get("events", []) if event.get("u") and event.get("k") == KIND_CODES[DOWNLOAD]}
+        if users:
+            readers.setdefault(bucket["book_id"], set()).update(users)
+    return readers
+
+
+class SparseRows:
+    """
+    Row-normalized book x feature matrix in CSR form: the features of row i
+    are indices[indptr[i]:indptr[i + 1]] with weights in data. A column
+    index (rows per feature) is built on first use for similarity products.
+    """
+
+    def __init__(self, indptr, indices, data, n_columns):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = (len(indptr) - 1, n_columns)
+        self._columns = None
+
+    def toarray(self, start=0, stop=None):
+        """Dense copy of rows [start, stop)."""
+        stop = self.shape[0] if stop is None else stop
+        dense = np.zeros((stop - start, self.shape[1]), dtype=np.float32)
+        lo, hi = self.indptr[start], self.indptr[stop]
+        rows = np.repeat(np.arange(stop - start), np.diff(self.indptr[start:stop + 1]))
+        dense[rows, self.indices[lo:hi]] = self.data[lo:hi]
+        return dense
+
+    def columns(self):
+        """(colptr, rows, data): the same matrix in CSC form."""
+        if self._columns is None:
+            rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+            order = np.argsort(self.indices, kind="stable")
+            colptr = np.zeros(self.shape[1] + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=self.shape[1]), out=colptr[1:])
+            self._columns = (colptr, rows[order], self.data[order])
+        return self._columns
+
+    def similarities(self, start, stop):
+        """
+        Cosine similarities of rows [start, stop) with every row, as a dense
+        (stop - start) x books block. Only the features present in the block
+        are visited, so memory is the block plus the nonzero weights.
+        """
+        colptr, col_rows, col_data = self.columns()
+        sims = np.zeros((stop - start, self.shape[0]), dtype=np.float32)
+        lo, hi = self.indptr[start], self.indptr[stop]
+        block_rows = np.repeat(np.arange(stop - start), np.diff(self.indptr[start:stop + 1]))
+        block_cols = self.indices[lo:hi]
+        block_data = self.data[lo:hi]
+        order = np.argsort(block_cols, kind="stable")
+        block_cols, block_rows, block_data = block_cols[order], block_rows[order], block_data[order]
+        bounds = np.flatnonzero(np.diff(block_cols)) + 1
+        for rows, weights, cols in zip(np.split(block_rows, bounds), np.split(block_data, bounds),
+                                       np.split(block_cols, bounds)):
+            if not len(cols):
+                continue
+            column = cols[0]
+            others = slice(colptr[column], colptr[column + 1])
+            sims[rows[:, None], col_rows[others][None, :]] += weights[:, None] * col_data[others][None, :]
+        return sims
+
+
+def feature_matrix(books, readers=None, df=None, total=None):
+    """
+    Build the row-normalized book x feature matrix as SparseRows. Features
+    shared by fewer than two books cannot make two books similar, so they
+    are dropped. Document frequencies are counted over `books` unless given
+    in `df` (with `total` books in the catalog).
+    """
+    readers = readers or {}
+    rows = []
+    counted = {}
+    for book in books:
+        features = content_features(book) | {("user", user) for user in readers.get(str(book["_id"]), ())}
+        rows.append(features)
+        for feature in features:
+            counted[feature] = counted.get(feature, 0) + 1
+    df = {**counted, **(df or {})}
+    total = total or len(rows)
+
+    vocabulary = {feature: column for column, feature in enumerate(f for f, count in df.items() if count >= 2)}
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indices, data = [], []
+    for row, features in enumerate(rows):
+        weights = {vocabulary[feature]: FEATURE_WEIGHTS[feature[0]] * math.log(1 + total / df[feature])
+                   for feature in features if feature in vocabulary}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        for column, weight in sorted(weights.items()):
+            indices.append(column)
+            data.append(weight / norm)
+        indptr[row + 1] = len(indices)
+    return SparseRows(indptr, np.array(indices, dtype=np.int64), np.array(data, dtype=np.float32), len(vocabulary))
+
+
+def top_neighbours(matrix, limit=NEIGHBOURS_PER_BOOK, block_rows=BLOCK_ROWS):
+    """Yield (row, [(other_row, score)]) with the `limit` most similar rows of every row."""
+    n = matrix.shape[0]
+    limit = min(limit, n - 1)
+    if limit <= 0:
+        return
+    for start in range(0, n, block_rows):
+        sims = matrix.similarities(start, min(start + block_rows, n))
+        block = np.arange(sims.shape[0])
+        sims[block, start + block] = -1.0   # never recommend a book to itself
+        best = np.argpartition(-sims, limit - 1, axis=1)[:, :limit]
+        best_scores = np.take_along_axis(sims, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best = np.take_along_axis(best, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        for offset in range(sims.shape[0]):
+            yield start + offset, [(int(col), float(score)) for col, score in zip(best[offset], best_scores[offset]) if score > 0]
+
+
+def neighbour_entry(book, score):
+    """The denormalized fields the detail page shows for a recommendation."""
+    return {"book_id": str(book["_id"]), "title": book.get("title", ""), "author": book.get("author", ""),
+            "cover_filename": book.get("cover_filename"), "score": round(score, 4)}
+
+
+def rebuild(db, limit=NEIGHBOURS_PER_BOOK, days=180):
+    """Recompute the whole neighbour table. Returns the number of books written."""
+    books = list(db.books.find({}, RECOMMEND_PROJECTION))
+    matrix = feature_matrix(books, co_downloads(db, days))
+    now = datetime.now()
+    ops = []
+    for row, neighbours in top_neighbours(matrix, limit):
+        ops.append(ReplaceOne(
+            {"_id": str(books[row]["_id"])},
+            {"neighbours": [neighbour_entry(books[col], score) for col, score in neighbours], "updated_at": now},
+            upsert=True,
+        ))
+        if len(ops) >= 500:
+            db[NEIGHBOURS_COLLECTION].bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db[NEIGHBOURS_COLLECTION].bulk_write(ops, ordered=False)
+    db[NEIGHBOURS_COLLECTION].delete_many({"_id": {"$nin": [str(book["_id"]) for book in books]}})
+    return len(books)
+
+
+def fold_in(db, book_id, limit=NEIGHBOURS_PER_BOOK):
+    """
+    Add a new or edited book to the table without a full recompute: only
+    books sharing one of its features are scored (content features only, as
+    a new book has no downloads yet), its own list is replaced and it is
+    pushed into the lists of candidates it now outranks. Returns the number
+    of neighbours stored for the book.
+    """
+    book = db.books.find_one({"_id": ObjectId(book_id)}, RECOMMEND_PROJECTION)
+    if not book:
+        return 0
+    queries = feature_queries(book)
+    candidates = []
+    if queries:
+        candidates = list(db.books.find({"$or": [query for _, query in queries], "_id": {"$ne": book["_id"]}},
+                                        RECOMMEND_PROJECTION))
+
+    neighbours = []
+    if candidates:
+        # Global document frequencies of the book's own features (a few indexed counts);
+        # the candidates' other features are only counted within the candidate set
+        df = {feature: max(db.books.count_documents(query), 1) for feature, query in queries}
+        matrix = feature_matrix([book] + candidates, df=df, total=db.books.estimated_document_count())
+        sims = matrix.similarities(0, 1)[0, 1:]
+        best = np.argsort(-sims, kind="stable")[:limit]
+        neighbours = [(int(row), float(sims[row])) for row in best if sims[row] > 0]
+
+    key = str(book["_id"])
+    db[NEIGHBOURS_COLLECTION].update_many({"neighbours.book_id": key}, {"$pull": {"neighbours": {"book_id": key}}})
+    db[NEIGHBOURS_COLLECTION].replace_one(
+        {"_id": key},
+        {"neighbours": [neighbour_entry(candidates[row], score) for row, score in neighbours], "updated_at": datetime.now()},
+        upsert=True,
+    )
+    entry = neighbour_entry(book, 0.0)
+    ops = [UpdateOne({"_id": str(candidates[row]["_id"])},
+                     {"$push": {"neighbours": {"$each": [dict(entry, score=round(score, 4))],
+                                               "$sort": {"score": -1}, "$slice": limit}}})
+           for row, score in neighbours]
+    if ops:
+        db[NEIGHBOURS_COLLECTION].bulk_write(ops, ordered=False)
+    return len(neighbours)
+
+
+def drop_book(db, book_id):
+    """Remove a deleted book's neighbour list and every reference to it."""
+    key = str(book_id)
+    db[NEIGHBOURS_COLLECTION].delete_one({"_id": key})
+    db[NEIGHBOURS_COLLECTION].update_many({"neighbours.book_id": key}, {"$pull": {"neighbours": {"book_id": key}}})
+
+
+def similar_books(db, book_id):
+    """Return the stored recommendations for a book (one _id lookup)."""
+    doc = db[NEIGHBOURS_COLLECTION].find_one({"_id": str(book_id)}, {"neighbours": 1})
+    return doc.get("neighbours", []) if doc else []
+
+
+def main(argv=None):
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Rebuild the similar-books table")
+    parser.add_argument("--uri", default=os.getenv('MONGO_URI_LOCAL', 'mongodb://localhost:27017/library'))
+    parser.add_argument("--rebuild", action="store_true", help="recompute every book's neighbours")
+    parser.add_argument("--days", type=int, default=180, help="download history to use (default 180)")
+    args = parser.parse_args(argv)
+
+    if not args.rebuild:
+        parser.print_help()
+        return 1
+
+    client = MongoClient(args.uri)
+    db = client.get_default_database("library")
+    written = rebuild(db, days=args.days)
+    print(f"✅ Stored similar books for {written} book(s)")
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Query-result cache for catalog pages.
+Entries are evicted LRU-first once the cache is full, expire after a TTL,
+and are invalidated wholesale whenever a write bumps the catalog version.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Thread-safe LRU + TTL cache keyed on normalized request parameters."""
+
+    def __init__(self, max_entries=512, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (version, expires_at, value)
+        self._version = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self._version
+
+    def bump_version(self):
+        """Invalidate every cached result after a catalog write."""
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def discard(self, key):
+        """Drop a single cached entry."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get(self, key):
+        """Return (True, value) on a fresh hit, (False, None) otherwise."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                version, expires_at, value = entry
+                if version == self._version and expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return True, value
+                del self._entries[key]
+            self._misses += 1
+            return False, None
+
+    def set(self, key, value, version=None):
+        """
+        Store a value. Pass the version read before computing it so a result
+        computed across a concurrent write is not cached as current.
+        """
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            self._entries[key] = (self._version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def stats(self):
+        """Return hit/miss counters for monitoring."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "evictions": self._evictions,
+                "ttl_seconds": self.ttl,
+                "catalog_version": self._version,
+            }
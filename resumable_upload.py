@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Resumable, chunked uploads for large book files.
+A client creates a session with the file's name and size, then PUTs chunks
+at any offsets, in any order and as often as needed. Each chunk is streamed
+straight into a preallocated part file with positioned writes (never held
+in memory), hashed on the way and recorded in the session only when its
+sha256 matches the one the client sent. Once every byte is covered the
+commit step moves the part file into the book BlobStore.
+
+Sessions not touched for `max_age` are reaped by the app on a schedule, or
+from cron with:
+    python resumable_upload.py --reap [--hours 24] [--uri URI]
+"""
+
+import argparse
+import hashlib
+import os
+import secrets
+import sys
+import time
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from werkzeug.utils import secure_filename
+
+SESSIONS_COLLECTION = "upload_sessions"
+
+# Suggested and largest accepted chunk sizes
+CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024
+
+# Bytes read from the request per write
+READ_SIZE = 1024 * 1024
+
+# A chunk writer that has not finished after this long is assumed dead and no longer blocks commit
+WRITER_TIMEOUT = timedelta(minutes=15)
+
+
+class UploadError(Exception):
+    """A rejected upload request; `status` is the HTTP status to answer with."""
+
+    def __init__(self, status, message, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def part_path(store, upload_id):
+    return os.path.join(store.incoming_dir(), f"{upload_id}.part")
+
+
+def received_ranges(session):
+    """Merge the session's verified chunks into sorted [start, end) ranges."""
+    chunks = sorted((int(offset), chunk["length"]) for offset, chunk in (session.get("chunks") or {}).items())
+    ranges = []
+    for start, length in chunks:
+        end = start + length
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def missing_ranges(session):
+    """Return the [start, end) ranges of the file not received yet."""
+    missing = []
+    position = 0
+    for start, end in received_ranges(session):
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < session["size"]:
+        missing.append([position, session["size"]])
+    return missing
+
+
+def session_status(session):
+    """The JSON view of a session a client resumes from."""
+    received = received_ranges(session)
+    return {
+        "upload_id": session["_id"],
+        "filename": session["filename"],
+        "size": session["size"],
+        "chunk_size": CHUNK_SIZE,
+        "received": received,
+        "received_bytes": sum(end - start for start, end in received),
+        "missing": missing_ranges(session),
+    }
+
+
+def create_session(db, store, user_id, filename, size, sha256=None):
+    """Open a session and preallocate its part file (sparse where supported)."""
+    filename = secure_filename(filename or "")
+    if not filename.lower().endswith(".pdf"):
+        raise UploadError(400, "Please upload a valid PDF file")
+    if not isinstance(size, int) or size <= 0 or size > MAX_FILE_SIZE:
+        raise UploadError(400, f"size must be between 1 and {MAX_FILE_SIZE} bytes")
+    if sha256 is not None and (len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256.lower())):
+        raise UploadError(400, "sha256 must be 64 hex digits")
+
+    now = datetime.now()
+    session = {"_id": secrets.token_urlsafe(16), "user_id": user_id, "filename": filename, "size": size,
+               "sha256": sha256.lower() if sha256 else None, "chunks": {}, "status": "open", "writers": 0,
+               "created_at": now, "updated_at": now}
+    with open(part_path(store, session["_id"]), "wb") as f:
+        f.truncate(size)
+    db[SESSIONS_COLLECTION].insert_one(session)
+    return session
+
+
+def get_session(db, upload_id, user_id):
+    session = db[SESSIONS_COLLECTION].find_one({"_id": upload_id})
+    if session is None or session["user_id"] != user_id:
+        raise UploadError(404, "Upload not found")
+    return session
+
+
+def write_chunk(db, store, session, offset, length, stream, checksum=None):
+    """
+    Write `length` bytes from `stream` at `offset` of the part file and
+    record the chunk. Re-sending a chunk overwrites it. A chunk whose sha256
+    differs from `checksum` is not recorded. The session counts the chunks
+    being written, and commit waits for that count to drop to zero, so a
+    chunk can never land in a file that is being hashed or moved. Returns
+    the updated session.
+    """
+    if length is None:
+        raise UploadError(411, "Content-Length is required")
+    if offset < 0 or length <= 0 or offset + length > session["size"]:
+        raise UploadError(416, "Chunk is outside the file", size=session["size"])
+    if length > MAX_CHUNK_SIZE:
+        raise UploadError(413, f"Chunks may be at most {MAX_CHUNK_SIZE} bytes")
+
+    session = db[SESSIONS_COLLECTION].find_one_and_update(
+        {"_id": session["_id"], "status": "open"},
+        {"$inc": {"writers": 1}, "$set": {"updated_at": datetime.now()}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if session is None:
+        raise UploadError(409, "Upload is already being committed")
+
+    released = False
+    try:
+        try:
+            fd = os.open(part_path(store, session["_id"]), os.O_WRONLY)
+        except FileNotFoundError:
+            raise UploadError(409, "Upload is no longer open")
+        digest = hashlib.sha256()
+        written = 0
+        try:
+            while written < length:
+                data = stream.read(min(READ_SIZE, length - written))
+                if not data:
+                    break
+                digest.update(data)
+                while data:
+                    count = os.pwrite(fd, data, offset + written)
+                    written += count
+                    data = data[count:]
+        finally:
+            os.close(fd)
+
+        chunk_sha256 = digest.hexdigest()
+        if written != length or (checksum and checksum.lower() != chunk_sha256):
+            # The bytes on disk may have overwritten chunks received earlier
+            _forget_overlapping(db, session, offset, offset + written)
+            if written != length:
+                raise UploadError(400, f"Chunk ended after {written} of {length} bytes")
+            raise UploadError(422, "Chunk checksum mismatch", offset=offset, sha256=chunk_sha256)
+
+        released = True
+        session = db[SESSIONS_COLLECTION].find_one_and_update(
+            {"_id": session["_id"]},
+            {"$set": {f"chunks.{offset}": {"length": length, "sha256": chunk_sha256}, "updated_at": datetime.now()},
+             "$inc": {"writers": -1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if session is None:
+            raise UploadError(409, "Upload is no longer open")
+        return session
+    finally:
+        if not released:
+            db[SESSIONS_COLLECTION].update_one({"_id": session["_id"]}, {"$inc": {"writers": -1}})
+
+
+def _forget_overlapping(db, session, start, end):
+    stale = {f"chunks.{key}": "" for key, chunk in (session.get("chunks") or {}).items()
+             if int(key) < end and int(key) + chunk["length"] > start}
+    if stale:
+        db[SESSIONS_COLLECTION].update_one({"_id": session["_id"]}, {"$unset": stale})
+
+
+def commit(db, store, session):
+    """
+    Check that every byte arrived (and the whole-file sha256, when one was
+    given), then move the part file into the store. Returns the StoredBlob;
+    the caller creates the book record.
+    """
+    missing = missing_ranges(session)
+    if missing:
+        raise UploadError(409, "Upload is incomplete", missing=missing)
+    now = datetime.now()
+    session = db[SESSIONS_COLLECTION].find_one_and_update(
+        {"_id": session["_id"], "status": "open",
+         "$or": [{"writers": {"$not": {"$gt": 0}}}, {"updated_at": {"$lt": now - WRITER_TIMEOUT}}]},
+        {"$set": {"status": "committing", "updated_at": now}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if session is None:
+        raise UploadError(409, "Upload has chunks being written or is already being committed")
+    # Chunks written since the caller read the session may have replaced verified ones
+    missing = missing_ranges(session)
+    if missing:
+        db[SESSIONS_COLLECTION].update_one({"_id": session["_id"]}, {"$set": {"status": "open"}})
+        raise UploadError(409, "Upload is incomplete", missing=missing)
+
+    path = part_path(store, session["_id"])
+    try:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(READ_SIZE), b""):
+                digest.update(chunk)
+        if session.get("sha256") and digest.hexdigest() != session["sha256"]:
+            raise UploadError(422, "File checksum mismatch", sha256=digest.hexdigest())
+        stored = store.adopt(db, path, session["filename"], digest.hexdigest(), session["size"])
+    except Exception:
+        # Reopen so the client can resend chunks or retry the commit (a disk or GridFS
+        # error would otherwise leave the session refusing everything until it is reaped)
+        db[SESSIONS_COLLECTION].update_one({"_id": session["_id"]}, {"$set": {"status": "open"}})
+        raise
+    db[SESSIONS_COLLECTION].delete_one({"_id": session["_id"]})
+    return stored
+
+
+def abort(db, store, session):
+    """Drop a session and its part file."""
+    db[SESSIONS_COLLECTION].delete_one({"_id": session["_id"]})
+    try:
+        os.unlink(part_path(store, session["_id"]))
+    except FileNotFoundError:
+        pass
+
+
+def reap_stale(db, store, max_age=timedelta(hours=24)):
+    """
+    Delete sessions not written to within `max_age`, and part files left
+    without a session. Returns the number of sessions removed.
+    """
+    cutoff = datetime.now() - max_age
+    reaped = 0
+    for session in db[SESSIONS_COLLECTION].find({"updated_at": {"$lt": cutoff}}, {"_id": 1}):
+        abort(db, store, session)
+        reaped += 1
+
+    incoming = store.incoming_dir()
+    oldest = time.time() - max_age.total_seconds()
+    for name in os.listdir(incoming):
+        path = os.path.join(incoming, name)
+        if not name.endswith(".part"):
+            continue
+        try:
+            if os.path.getmtime(path) < oldest and not db[SESSIONS_COLLECTION].find_one({"_id": name[:-5]}, {"_id": 1}):
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+    return reaped
+
+
+def main(argv=None):
+    from pymongo import MongoClient
+    from storage import BlobStore
+
+    parser = argparse.ArgumentParser(description="Manage resumable upload sessions")
+    parser.add_argument("--uri", default=os.getenv('MONGO_URI_LOCAL', 'mongodb://localhost:27017/library'))
+    parser.add_argument("--books", default=os.path.join("static", "books"), help="book upload folder")
+    parser.add_argument("--reap", action="store_true", help="delete stale partial uploads")
+    parser.add_argument("--hours", type=int, default=24, help="idle time before a session is stale (default 24)")
+    args = parser.parse_args(argv)
+
+    if not args.reap:
+        parser.print_help()
+        return 1
+
+    client = MongoClient(args.uri)
+    db = client.get_default_database("library")
+    reaped = reap_stale(db, BlobStore(args.books, "book"), timedelta(hours=args.hours))
+    print(f"🧹 Reaped {reaped} stale upload session(s)")
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
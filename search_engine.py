@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+In-process full-text search engine for the library catalog.
+Books are tokenized on title, author, subject and tags into an inverted
+index (term -> postings) and queries are ranked with BM25.
+"""
+
+import bisect
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+# Fields that are indexed and how much a match in each one counts
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "author": 2.0,
+    "subject": 1.5,
+    "tags": 1.0,
+}
+
+# Projection used when loading books into the index
+INDEX_PROJECTION = {field: 1 for field in FIELD_WEIGHTS}
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold(text):
+    """Lowercase and strip diacritics so 'Exupéry' matches 'exupery'."""
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens."""
+    if not text:
+        return []
+    return TOKEN_RE.findall(str(text).lower())
+
+
+def book_terms(book):
+    """Return a Counter of weighted term frequencies for a book document."""
+    terms = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        value = book.get(field)
+        if isinstance(value, (list, tuple)):
+            value = " ".join(str(v) for v in value)
+        for token in tokenize(value):
+            terms[token] += weight
+    return terms
+
+
+class SearchIndex:
+    """Inverted index over the books collection with BM25 ranking."""
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.loaded = False
+        self._postings = defaultdict(dict)   # term -> {book_id: weighted tf}
+        self._doc_terms = {}                 # book_id -> Counter of terms
+        self._doc_len = {}                   # book_id -> weighted length
+        self._total_len = 0.0
+        self._vocab = []                     # sorted terms for prefix lookups
+        self._vocab_dirty = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def build(self, books):
+        """Rebuild the whole index from an iterable of book documents."""
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._doc_terms = {}
+            self._doc_len = {}
+            self._total_len = 0.0
+            for book in books:
+                self._add(book)
+            self._vocab_dirty = True
+            self.loaded = True
+
+    def add(self, book):
+        """Index (or re-index) a single book document."""
+        with self._lock:
+            self._remove(str(book["_id"]))
+            self._add(book)
+            self._vocab_dirty = True
+
+    def remove(self, book_id):
+        """Drop a book from the index."""
+        with self._lock:
+            self._remove(str(book_id))
+            self._vocab_dirty = True
+
+    def _add(self, book):
+        book_id = str(book["_id"])
+        terms = book_terms(book)
+        if not terms:
+            return
+        for term, tf in terms.items():
+            self._postings[term][book_id] = tf
+        self._doc_terms[book_id] = terms
+        self._doc_len[book_id] = sum(terms.values())
+        self._total_len += self._doc_len[book_id]
+
+    def _remove(self, book_id):
+        terms = self._doc_terms.pop(book_id, None)
+        if not terms:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(book_id, None)
+            if not postings:
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(book_id, 0.0)
+
+    def _expand_prefix(self, prefix):
+        """Return all indexed terms starting with prefix."""
+        if self._vocab_dirty:
+            self._vocab = sorted(self._postings)
+            self._vocab_dirty = False
+        start = bisect.bisect_left(self._vocab, prefix)
+        matches = []
+        for i in range(start, len(self._vocab)):
+            term = self._vocab[i]
+            if not term.startswith(prefix):
+                break
+            matches.append(term)
+        return matches
+
+    def search(self, text, limit=None, prefix_last=True):
+        """
+        Return book ids matching every query token, best match first.
+        The last token is treated as a prefix so partially typed words match.
+        """
+        tokens = tokenize(text)
+        terms = [(token, prefix_last and i == len(tokens) - 1) for i, token in enumerate(tokens)]
+        return self.search_terms(terms, limit)
+
+    def search_terms(self, terms, limit=None):
+        """Return book ids matching every (token, is_prefix) term, best match first."""
+        if not terms:
+            return []
+
+        with self._lock:
+            doc_count = len(self._doc_terms)
+            if doc_count == 0:
+                return []
+            avg_len = self._total_len / doc_count
+
+            scores = None
+            for token, is_prefix in terms:
+                if is_prefix:
+                    expanded = self._expand_prefix(token)
+                else:
+                    expanded = [token] if token in self._postings else []
+
+                token_scores = defaultdict(float)
+                for term in expanded:
+                    postings = self._postings[term]
+                    idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for book_id, tf in postings.items():
+                        norm = self.k1 * (1 - self.b + self.b * self._doc_len[book_id] / avg_len)
+                        token_scores[book_id] = max(token_scores[book_id], idf * tf * (self.k1 + 1) / (tf + norm))
+
+                if scores is None:
+                    scores = dict(token_scores)
+                else:
+                    scores = {book_id: score + token_scores[book_id]
+                              for book_id, score in scores.items() if book_id in token_scores}
+                if not scores:
+                    return []
+
+        ranked = sorted(scores, key=lambda book_id: (-scores[book_id], book_id))
+        return ranked[:limit] if limit else ranked
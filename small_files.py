@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+In-memory cache of small, hot files.
+Most sample PDFs and cover variants are a few hundred bytes to a few KB, so
+an open/stat/read per request costs more than the bytes themselves. File
+contents up to `max_file_bytes` are kept in a byte-budgeted LRU keyed by
+something that changes with the content (the sha256 of a content-addressed
+blob, or path + mtime + size); larger files keep going through the
+sendfile path.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class SmallFileCache:
+    """Thread-safe LRU of file contents, bounded by total bytes."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_file_bytes=256 * 1024):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self._entries = OrderedDict()   # key -> bytes
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._too_large = 0
+
+    def fits(self, size):
+        """Whether a file of `size` bytes is served from memory."""
+        return size is not None and size <= self.max_file_bytes and size <= self.max_bytes
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return data
+
+    def put(self, key, data):
+        """Cache `data` unless it is too large. Returns True if it was stored."""
+        if not self.fits(len(data)):
+            with self._lock:
+                self._too_large += 1
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._evictions += 1
+        return True
+
+    def read(self, key, path):
+        """Return a file's contents from memory, reading (and caching) it on a miss."""
+        data = self.get(key)
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+            self.put(key, data)
+        return data
+
+    def discard(self, key):
+        with self._lock:
+            data = self._entries.pop(key, None)
+            if data is not None:
+                self._bytes -= len(data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "resident_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_file_bytes": self.max_file_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else None,
+                "evictions": self._evictions,
+                "too_large": self._too_large,
+            }
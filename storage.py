@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Content-addressed, deduplicating file storage.
+Uploads are hashed while they stream into a temp file, then atomically
+renamed to sha256/aa/bb/<digest><ext> under the store's root (or uploaded
+to GridFS under that name, see storage_backends). Identical
+content maps to the same path, so a second copy costs no disk and the temp
+file is simply dropped. Each blob has a reference count in the blobs
+collection; releasing the last reference deletes the file.
+
+Move files stored under their upload names into the store with:
+    python storage.py --migrate [--uri URI] [--backend gridfs]
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+from collections import namedtuple
+from datetime import datetime
+
+from pymongo import ReturnDocument
+from werkzeug.utils import secure_filename
+
+from storage_backends import BACKENDS, LocalDiskBackend, make_backend
+
+BLOBS_COLLECTION = "blobs"
+BLOB_PREFIX = "sha256"
+CHUNK_SIZE = 1024 * 1024
+
+StoredBlob = namedtuple("StoredBlob", "path digest size created")
+
+
+def blob_path(digest, ext=""):
+    """Relative path of a blob: sha256/aa/bb/<digest><ext>."""
+    return f"{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def is_blob_path(path):
+    return bool(path) and path.startswith(BLOB_PREFIX + "/")
+
+
+class BlobStore:
+    """
+    Content-addressed files, reference-counted per kind. The bytes live in
+    `backend` (local files under `root` by default, see storage_backends);
+    legacy upload names and the incoming temp files stay under `root`.
+    """
+
+    def __init__(self, root, kind, backend=None):
+        self.root = root
+        self.kind = kind
+        self.backend = backend or LocalDiskBackend(root)
+
+    def full_path(self, path):
+        """
+        Local path of a stored file, which may not exist. A remote backend
+        fetches the blob into its cache first, and returns None when the blob
+        is missing or too large to cache (read it with open() instead).
+        """
+        if not is_blob_path(path):
+            return os.path.join(self.root, path)
+        return self.backend.local_path(path)
+
+    def stat(self, path):
+        """BlobStat(size, mtime) of a stored file, or None if it is missing."""
+        if not is_blob_path(path):
+            return LocalDiskBackend(self.root).stat(path)
+        return self.backend.stat(path)
+
+    def open(self, path):
+        """A seekable binary stream of a stored file."""
+        if not is_blob_path(path):
+            return open(os.path.join(self.root, path), "rb")
+        return self.backend.open(path)
+
+    def _key(self, path):
+        return f"{self.kind}:{path}"
+
+    def put(self, db, stream, original_name):
+        """
+        Store a stream and take one reference to it. Returns a StoredBlob;
+        `created` is False when identical content was already stored.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.incoming_dir())
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, "wb") as temp:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+                temp.flush()
+                os.fsync(temp.fileno())
+            return self.adopt(db, temp_path, original_name, digest.hexdigest(), size)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def incoming_dir(self):
+        """Folder for files being written; on the store's filesystem so renames are atomic."""
+        incoming = os.path.join(self.root, ".incoming")
+        os.makedirs(incoming, exist_ok=True)
+        return incoming
+
+    def adopt(self, db, temp_path, original_name, digest=None, size=None):
+        """
+        Move a finished file from incoming_dir() into the store (or drop it if
+        the content is already stored) and take one reference to it.
+        """
+        if digest is None:
+            hasher = hashlib.sha256()
+            with open(temp_path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+            digest = hasher.hexdigest()
+        size = os.path.getsize(temp_path) if size is None else size
+        ext = os.path.splitext(secure_filename(original_name or ""))[1].lower()
+        path = blob_path(digest, ext)
+        self.acquire(db, path, size)
+        created = self.backend.store(temp_path, path)
+        return StoredBlob(path, digest, size, created)
+
+    def acquire(self, db, path, size=None):
+        """Add a reference to a stored blob."""
+        now = datetime.now()
+        db[BLOBS_COLLECTION].update_one(
+            {"_id": self._key(path)},
+            {"$inc": {"refs": 1},
+             # A new reference to an old file must not look orphaned before its book is saved
+             "$set": {"acquired_at": now},
+             "$setOnInsert": {"kind": self.kind, "path": path, "size": size, "created_at": now}},
+            upsert=True,
+        )
+
+    def record(self, db, path):
+        """The reference record of a blob, or None."""
+        return db[BLOBS_COLLECTION].find_one({"_id": self._key(path)})
+
+    def set_refs(self, db, path, refs):
+        """Reset a blob's reference count (e.g. after the reconciler restores it)."""
+        db[BLOBS_COLLECTION].update_one(
+            {"_id": self._key(path)},
+            {"$set": {"refs": refs, "acquired_at": datetime.now()},
+             "$setOnInsert": {"kind": self.kind, "path": path, "created_at": datetime.now()}},
+            upsert=True,
+        )
+
+    def forget(self, db, path):
+        """Drop the reference record of a blob whose file was removed outside release()."""
+        db[BLOBS_COLLECTION].delete_one({"_id": self._key(path)})
+
+    def release(self, db, path):
+        """
+        Drop a reference; the file is deleted with its last reference. Paths
+        outside the store (legacy upload names) are ignored. Returns True if
+        the file was deleted.
+        """
+        if not is_blob_path(path):
+            return False
+        blob = db[BLOBS_COLLECTION].find_one_and_update(
+            {"_id": self._key(path)}, {"$inc": {"refs": -1}}, return_document=ReturnDocument.AFTER)
+        if blob is None or blob["refs"] > 0:
+            return False
+        if not db[BLOBS_COLLECTION].delete_one({"_id": self._key(path), "refs": {"$lte": 0}}).deleted_count:
+            return False
+        self.backend.delete(path)
+        return True
+
+
+def migrate_legacy_files(db, book_store, cover_store):
+    """
+    Copy files still stored under their upload names into the blob stores
+    and point the books at them. The old files are left in place. Returns
+    the number of books updated.
+    """
+    updated = 0
+    query = {"$or": [{"filename": {"$nin": [None, ""], "$not": {"$regex": f"^{BLOB_PREFIX}/"}}},
+                     {"cover_filename": {"$nin": [None, ""], "$not": {"$regex": f"^{BLOB_PREFIX}/"}}}]}
+    for book in db.books.find(query, {"filename": 1, "cover_filename": 1}):
+        changes = {}
+        filename = book.get("filename")
+        if filename and not is_blob_path(filename) and os.path.exists(book_store.full_path(filename)):
+            with open(book_store.full_path(filename), "rb") as f:
+                stored = book_store.put(db, f, filename)
+            stat = os.stat(book_store.full_path(stored.path))
+            changes.update({"filename": stored.path, "original_filename": filename, "file_sha256": stored.digest,
+                            "file_size": stored.size, "file_mtime": int(stat.st_mtime)})
+        cover = book.get("cover_filename")
+        if cover and not is_blob_path(cover) and os.path.exists(cover_store.full_path(cover)):
+            with open(cover_store.full_path(cover), "rb") as f:
+                changes["cover_filename"] = cover_store.put(db, f, cover).path
+        if changes:
+            db.books.update_one({"_id": book["_id"]}, {"$set": changes})
+            updated += 1
+    return updated
+
+
+def main(argv=None):
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Manage content-addressed book and cover storage")
+    parser.add_argument("--uri", default=os.getenv('MONGO_URI_LOCAL', 'mongodb://localhost:27017/library'))
+    parser.add_argument("--books", default=os.path.join("static", "books"), help="book upload folder")
+    parser.add_argument("--covers", default=os.path.join("static", "covers"), help="cover upload folder")
+    parser.add_argument("--backend", choices=BACKENDS, default=os.getenv('STORAGE_BACKEND', 'local'))
+    parser.add_argument("--cache", default=os.getenv('BLOB_CACHE_DIR', 'blob_cache'), help="GridFS read cache folder")
+    parser.add_argument("--migrate", action="store_true", help="move legacy upload names into the store")
+    args = parser.parse_args(argv)
+
+    if not args.migrate:
+        parser.print_help()
+        return 1
+
+    client = MongoClient(args.uri)
+    db = client.get_default_database("library")
+    book_store = BlobStore(args.books, "book", make_backend(args.backend, args.books, "book_files", lambda: db, args.cache))
+    cover_store = BlobStore(args.covers, "cover", make_backend(args.backend, args.covers, "cover_files", lambda: db, args.cache))
+    updated = migrate_legacy_files(db, book_store, cover_store)
+    print(f"✅ Moved files of {updated} book(s) into content-addressed storage")
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
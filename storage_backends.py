@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Where BlobStore keeps file bytes.
+LocalDiskBackend stores blobs under the store's root folder. GridFSBackend
+stores them in a GridFS bucket so every app node sees the whole library
+without shared disk; each node keeps a read-through copy of recently used
+blobs in a size-bounded LRU DiskCache, so the serving code (Range requests,
+sendfile, text extraction, thumbnails) keeps working on local paths. Files
+too large to cache are streamed from GridFS with seekable, chunked reads.
+
+Legacy files stored under their upload names (not content-addressed) never
+reach a backend; BlobStore reads them from its root folder.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import timezone
+
+BACKENDS = ("local", "gridfs")
+
+BlobStat = namedtuple("BlobStat", "size mtime")
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class LocalDiskBackend:
+    """Blobs as files under `root` (the default)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, path):
+        """Local path of a blob; it may not exist."""
+        return os.path.join(self.root, path)
+
+    def store(self, temp_path, path):
+        """Move a finished temp file into place. Returns False when the blob already existed."""
+        final_path = self.local_path(path)
+        if os.path.exists(final_path):
+            os.unlink(temp_path)
+            return False
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(temp_path, final_path)
+        return True
+
+    def delete(self, path):
+        try:
+            os.unlink(self.local_path(path))
+        except FileNotFoundError:
+            pass
+
+    def stat(self, path):
+        try:
+            stat = os.stat(self.local_path(path))
+        except OSError:
+            return None
+        return BlobStat(stat.st_size, int(stat.st_mtime))
+
+    def open(self, path):
+        return open(self.local_path(path), "rb")
+
+
+class DiskCache:
+    """
+    Size-bounded LRU of files under `root`. The index is in memory and
+    rebuilt from the folder (oldest access first) on start; each process
+    evicts against its own view, so several workers sharing a folder can
+    overshoot max_bytes until their next eviction pass, and an entry another
+    worker evicted is dropped (and refilled by the caller) on its next get().
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # path -> size
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        os.makedirs(self._temp_dir(), exist_ok=True)
+        self._load()
+
+    def _temp_dir(self):
+        return os.path.join(self.root, ".tmp")
+
+    def _load(self):
+        found = []
+        for folder, dirs, files in os.walk(self.root):
+            dirs[:] = [name for name in dirs if name != ".tmp"]
+            for name in files:
+                full = os.path.join(folder, name)
+                try:
+                    stat = os.stat(full)
+                except FileNotFoundError:   # evicted by another worker mid-walk
+                    continue
+                found.append((stat.st_atime, os.path.relpath(full, self.root), stat.st_size))
+        for _, path, size in sorted(found):
+            self._entries[path] = size
+            self._bytes += size
+
+    def path_for(self, path):
+        return os.path.join(self.root, path)
+
+    def get(self, path):
+        """Return the cached file's path, or None."""
+        full_path = self.path_for(path)
+        with self._lock:
+            if path in self._entries:
+                if os.path.exists(full_path):
+                    self._entries.move_to_end(path)
+                    self._hits += 1
+                    return full_path
+                # Another worker sharing the folder evicted it
+                self._bytes -= self._entries.pop(path)
+            self._misses += 1
+            return None
+
+    def fill(self, path, source):
+        """Copy a readable stream into the cache and return the cached path."""
+        fd, temp_path = tempfile.mkstemp(dir=self._temp_dir())
+        try:
+            with os.fdopen(fd, "wb") as temp:
+                shutil.copyfileobj(source, temp, CHUNK_SIZE)
+            return self.adopt(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def adopt(self, temp_path, path):
+        """Move a finished file into the cache and evict older entries over budget."""
+        final_path = self.path_for(path)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        shutil.move(temp_path, final_path)
+        size = os.path.getsize(final_path)
+        with self._lock:
+            self._bytes += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+            victims = []
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                victim, victim_size = self._entries.popitem(last=False)
+                self._bytes -= victim_size
+                self._evictions += 1
+                victims.append(victim)
+        for victim in victims:
+            self._unlink(victim)
+        return final_path
+
+    def discard(self, path):
+        with self._lock:
+            size = self._entries.pop(path, None)
+            if size is not None:
+                self._bytes -= size
+        self._unlink(path)
+
+    def _unlink(self, path):
+        # A reader that already opened the file keeps it until it closes
+        try:
+            os.unlink(self.path_for(path))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self._hits, "misses": self._misses, "evictions": self._evictions,
+                    "hit_ratio": round(self._hits / lookups, 4) if lookups else None}
+
+
+class GridFSBackend:
+    """
+    Blobs in a GridFS bucket, named by their store path, with a local
+    read-through DiskCache. `get_db` returns the database (resolved lazily so
+    the backend can be built before the app's client is).
+    """
+
+    def __init__(self, get_db, bucket_name, cache):
+        self.get_db = get_db
+        self.bucket_name = bucket_name
+        self.cache = cache
+        # Files larger than this are streamed on a miss instead of pushing everything else out of the cache
+        self.max_cached_file = cache.max_bytes // 4
+
+    def _bucket(self):
+        import gridfs
+        return gridfs.GridFSBucket(self.get_db(), bucket_name=self.bucket_name)
+
+    def _file_doc(self, path):
+        return self.get_db()[f"{self.bucket_name}.files"].find_one(
+            {"filename": path}, {"length": 1, "uploadDate": 1}, sort=[("uploadDate", -1)])
+
+    def local_path(self, path):
+        """
+        Local path of a blob, fetched into the cache on a miss. None when the
+        blob is not in GridFS or is too large to cache (use open() instead).
+        """
+        cached = self.cache.get(path)
+        if cached is not None:
+            return cached
+        doc = self._file_doc(path)
+        if doc is None or doc["length"] > self.max_cached_file:
+            return None
+        with self._bucket().open_download_stream(doc["_id"]) as source:
+            return self.cache.fill(path, source)
+
+    def store(self, temp_path, path):
+        """Upload a finished temp file (unless the blob exists) and keep it in the cache."""
+        created = self._file_doc(path) is None
+        if created:
+            with open(temp_path, "rb") as f:
+                self._bucket().upload_from_stream(path, f, chunk_size_bytes=255 * 1024)
+        # Fresh uploads are read back right away (metadata, thumbnails, text extraction)
+        self.cache.adopt(temp_path, path)
+        return created
+
+    def delete(self, path):
+        bucket = self._bucket()
+        for grid_file in bucket.find({"filename": path}):
+            bucket.delete(grid_file._id)
+        self.cache.discard(path)
+
+    def stat(self, path):
+        doc = self._file_doc(path)
+        if doc is None:
+            return None
+        # uploadDate comes back as naive UTC
+        return BlobStat(doc["length"], int(doc["uploadDate"].replace(tzinfo=timezone.utc).timestamp()))
+
+    def open(self, path):
+        """A seekable stream of the blob, read from GridFS chunk by chunk."""
+        import gridfs
+        try:
+            return self._bucket().open_download_stream_by_name(path)
+        except gridfs.errors.NoFile:
+            raise FileNotFoundError(path)
+
+
+def make_backend(name, root, bucket_name, get_db, cache_dir="blob_cache", cache_max_bytes=2 * 1024 ** 3):
+    """Build the backend called `name` for a store rooted at `root`."""
+    if name == "gridfs":
+        return GridFSBackend(get_db, bucket_name, DiskCache(os.path.join(cache_dir, bucket_name), cache_max_bytes))
+    return LocalDiskBackend(root)
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Orphan file collector and storage reconciler.
+Reference counts clean up blobs released through the app, but legacy upload
+names replaced or deleted by admins, references leaked between storing a
+file and saving its book, temp files of crashed uploads and variants of
+deleted covers still pile up under static/books and static/covers. A pass
+walks a store's folder in batches, sleeping between batches so it never
+saturates disk I/O on a live node, and compares it with the paths books
+reference (read in one streaming projection query):
+
+- unreferenced files older than the grace period are moved to
+  <quarantine>/<kind>/<date>/ and their blob records dropped;
+- referenced files that are missing are reported, and moved back when they
+  are found in quarantine;
+- quarantine folders older than `purge_days` are deleted.
+
+With --max-files a pass stops after about that many files and the next one
+resumes behind the last folder it finished (kept in storage_gc_state), so a
+large tree is covered by several short passes; the checks above that need
+the whole tree run on the pass that completes the walk.
+
+With the GridFS backend only the files on local disk (legacy names, cover
+variants) are collected; blobs in GridFS are checked for missing ones only.
+
+Run a pass with:
+    python storage_gc.py [--uri URI] [--dry-run] [--max-files N] [--grace-hours 24] [--purge-days 30]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timedelta
+
+from storage import BlobStore, is_blob_path
+from storage_backends import BACKENDS, LocalDiskBackend, make_backend
+from thumbnails import ALL_VARIANTS, is_image, variant_path
+
+# Folders under a store's root that belong to the store itself
+INCOMING_DIR = ".incoming"
+
+# Where each store's walk stopped (one document per store kind)
+STATE_COLLECTION = "storage_gc_state"
+
+
+def referenced_files(db):
+    """
+    Paths referenced by books, read in one streaming projection query.
+    Returns ({book file: [book ids]}, {cover: [book ids]}).
+    """
+    files, covers = {}, {}
+    for book in db.books.find({}, {"filename": 1, "cover_filename": 1}, batch_size=1000):
+        if book.get("filename"):
+            files.setdefault(book["filename"], []).append(book["_id"])
+        if book.get("cover_filename"):
+            covers.setdefault(book["cover_filename"], []).append(book["_id"])
+    return files, covers
+
+
+def cover_variants(covers):
+    """Variant paths of every referenced cover (they are kept with it)."""
+    return {variant_path(cover, width, fmt) for cover in covers if is_image(cover) for width, fmt in ALL_VARIANTS}
+
+
+def _folder_key(folder):
+    return tuple(folder.split("/")) if folder else ()
+
+
+def walk_files(root, skip=(), after=None):
+    """
+    Yield (folder, relative path, DirEntry) for the files under root, one
+    folder at a time in sorted depth-first order, streaming each folder with
+    os.scandir so huge folders are never listed in memory. Top-level folders
+    named in `skip` are left out. With `after` (a folder yielded by an
+    earlier walk) the walk resumes right behind that folder: subtrees that
+    come before it are not listed at all.
+    """
+    after_key = None if after is None else _folder_key(after)
+    folders = [""]
+    while folders:
+        folder = folders.pop()
+        key = _folder_key(folder)
+        walked = after_key is not None and key <= after_key
+        subfolders = []
+        try:
+            with os.scandir(os.path.join(root, folder)) as entries:
+                for entry in entries:
+                    path = f"{folder}/{entry.name}" if folder else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if path not in skip:
+                            subfolders.append(path)
+                    elif not walked and entry.is_file(follow_symlinks=False):
+                        yield folder, path, entry
+        except FileNotFoundError:
+            continue
+        for subfolder in sorted(subfolders, key=_folder_key, reverse=True):
+            subkey = _folder_key(subfolder)
+            # Only folders on the way down to `after` are revisited
+            if after_key is not None and subkey < after_key and after_key[:len(subkey)] != subkey:
+                continue
+            folders.append(subfolder)
+
+
+class Reconciler:
+    """
+    One store's reconciliation pass. `referenced` maps paths to the books
+    using them; `derived` are files kept because a referenced file owns
+    them (cover variants).
+    """
+
+    def __init__(self, db, store, quarantine_root, grace=timedelta(hours=24), batch_size=500, pause=0.05,
+                 dry_run=False):
+        self.db = db
+        self.store = store
+        self.quarantine = os.path.join(quarantine_root, store.kind)
+        self.grace = grace
+        self.batch_size = batch_size
+        self.pause = pause
+        self.dry_run = dry_run
+        self._touched = 0
+
+    def _throttle(self):
+        """Sleep after every batch of files touched."""
+        self._touched += 1
+        if self.pause and self._touched % self.batch_size == 0:
+            time.sleep(self.pause)
+
+    def run(self, referenced, derived=frozenset(), purge_days=30, max_files=None):
+        """
+        Walk the store from where the previous pass stopped. A pass ends after
+        the folder in which it reached `max_files` files; the walk position
+        is kept in STATE_COLLECTION. The pass that finishes the walk also
+        checks referenced files, removes stale temp files and purges old
+        quarantine folders, then starts the next walk from the top.
+        """
+        now = datetime.now()
+        cutoff = now - self.grace
+        state = self.db[STATE_COLLECTION].find_one({"_id": self.store.kind}) or {}
+        report = {"kind": self.store.kind, "resumed_after": state.get("after"), "complete": False, "scanned": 0,
+                  "quarantined": 0, "quarantined_bytes": 0, "recent": 0, "temp_removed": 0, "missing": [],
+                  "restored": 0, "purged": 0}
+        seen = set()
+
+        skip = {INCOMING_DIR}
+        quarantine_rel = os.path.relpath(self.quarantine, self.store.root)
+        if not quarantine_rel.startswith(".."):
+            skip.add(quarantine_rel.split(os.sep)[0])
+        walked = state.get("after")
+        current = None
+        saved_at = 0
+        for folder, path, entry in walk_files(self.store.root, skip, after=walked):
+            if folder != current:
+                if current is not None:
+                    walked = current
+                    if max_files and report["scanned"] >= max_files:
+                        break
+                    if report["scanned"] - saved_at >= self.batch_size:
+                        self._save_position(walked)
+                        saved_at = report["scanned"]
+                current = folder
+            self._throttle()
+            report["scanned"] += 1
+            if path in referenced:
+                seen.add(path)
+                continue
+            if path in derived:
+                continue
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime > cutoff.timestamp() or self._recently_acquired(path, cutoff):
+                report["recent"] += 1
+                continue
+            if self._quarantine(path, now):
+                report["quarantined"] += 1
+                report["quarantined_bytes"] += stat.st_size
+        else:
+            report["complete"] = True
+
+        if not report["complete"]:
+            self._save_position(walked)
+            return report
+
+        self._check_referenced(referenced, seen, report)
+        report["temp_removed"] = self._remove_stale_temp_files(cutoff)
+        report["purged"] = self._purge(now - timedelta(days=purge_days))
+        self._save_position(None)
+        return report
+
+    def _save_position(self, after):
+        if not self.dry_run:
+            self.db[STATE_COLLECTION].update_one(
+                {"_id": self.store.kind}, {"$set": {"after": after, "updated_at": datetime.now()}}, upsert=True)
+
+    def _check_referenced(self, referenced, seen, report):
+        """Report referenced files that are gone, restoring those found in quarantine."""
+        local = isinstance(self.store.backend, LocalDiskBackend)
+        for path, book_ids in referenced.items():
+            if path in seen:
+                continue
+            self._throttle()
+            if is_blob_path(path) and not local:
+                if self.store.stat(path) is not None:
+                    continue
+            elif os.path.isfile(os.path.join(self.store.root, path)):
+                continue
+            if self._restore(path, len(book_ids)):
+                report["restored"] += 1
+            else:
+                report["missing"].append((path, [str(book_id) for book_id in book_ids]))
+
+    def _recently_acquired(self, path, cutoff):
+        """A blob that just gained a reference may belong to a book not saved yet."""
+        if not is_blob_path(path):
+            return False
+        record = self.store.record(self.db, path)
+        acquired_at = record and (record.get("acquired_at") or record.get("created_at"))
+        return bool(acquired_at) and acquired_at > cutoff
+
+    def _quarantine(self, path, now):
+        if self.dry_run:
+            print(f"🗑️ Would quarantine {self.store.kind} file {path}")
+            return True
+        dest = os.path.join(self.quarantine, now.strftime("%Y-%m-%d"), path)
+        try:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.move(os.path.join(self.store.root, path), dest)
+        except OSError as e:
+            print(f"❌ Failed to quarantine {path}: {e}")
+            return False
+        if is_blob_path(path):
+            self.store.forget(self.db, path)
+        return True
+
+    def _restore(self, path, refs):
+        """Move a referenced file back from the newest quarantine folder holding it."""
+        try:
+            days = sorted(os.listdir(self.quarantine), reverse=True)
+        except FileNotFoundError:
+            return False
+        for day in days:
+            source = os.path.join(self.quarantine, day, path)
+            if not os.path.isfile(source):
+                continue
+            if self.dry_run:
+                print(f"♻️ Would restore {self.store.kind} file {path} from quarantine ({day})")
+                return True
+            if is_blob_path(path):
+                temp_path = os.path.join(self.store.incoming_dir(), f"restore-{os.path.basename(path)}")
+                shutil.move(source, temp_path)
+                self.store.backend.store(temp_path, path)
+                self.store.set_refs(self.db, path, refs)
+            else:
+                dest = os.path.join(self.store.root, path)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.move(source, dest)
+            print(f"♻️ Restored {self.store.kind} file {path} from quarantine ({day})")
+            return True
+        return False
+
+    def _remove_stale_temp_files(self, cutoff):
+        """Delete temp files of uploads that crashed (resumable .part files have their own reaper)."""
+        removed = 0
+        for _, path, entry in walk_files(os.path.join(self.store.root, INCOMING_DIR)):
+            self._throttle()
+            if path.endswith(".part"):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff.timestamp():
+                    if not self.dry_run:
+                        os.unlink(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def _purge(self, before):
+        """Delete quarantine folders from before `before`."""
+        purged = 0
+        try:
+            days = os.listdir(self.quarantine)
+        except FileNotFoundError:
+            return 0
+        for day in days:
+            try:
+                quarantined_on = datetime.strptime(day, "%Y-%m-%d")
+            except ValueError:
+                continue
+            if quarantined_on < before:
+                if not self.dry_run:
+                    shutil.rmtree(os.path.join(self.quarantine, day), ignore_errors=True)
+                purged += 1
+        return purged
+
+
+def reconcile(db, book_store, cover_store, quarantine_root="quarantine", grace=timedelta(hours=24),
+              purge_days=30, batch_size=500, pause=0.05, dry_run=False, max_files=None):
+    """
+    Run one pass over the book and cover stores, each walking at most about
+    `max_files` files. Returns a report per store.
+    """
+    files, covers = referenced_files(db)
+    reports = []
+    for store, referenced, derived in ((book_store, files, frozenset()),
+                                       (cover_store, covers, cover_variants(covers))):
+        reconciler = Reconciler(db, store, quarantine_root, grace=grace, batch_size=batch_size, pause=pause,
+                                dry_run=dry_run)
+        reports.append(reconciler.run(referenced, derived, purge_days=purge_days, max_files=max_files))
+    return reports
+
+
+def main(argv=None):
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Quarantine unreferenced book and cover files, report missing ones")
+    parser.add_argument("--uri", default=os.getenv('MONGO_URI_LOCAL', 'mongodb://localhost:27017/library'))
+    parser.add_argument("--books", default=os.path.join("static", "books"), help="book upload folder")
+    parser.add_argument("--covers", default=os.path.join("static", "covers"), help="cover upload folder")
+    parser.add_argument("--backend", choices=BACKENDS, default=os.getenv('STORAGE_BACKEND', 'local'))
+    parser.add_argument("--cache", default=os.getenv('BLOB_CACHE_DIR', 'blob_cache'), help="GridFS read cache folder")
+    parser.add_argument("--quarantine", default=os.getenv('STORAGE_QUARANTINE_DIR', 'quarantine'),
+                        help="where unreferenced files are moved (default ./quarantine)")
+    parser.add_argument("--grace-hours", type=float, default=24, help="minimum age of a file to collect (default 24)")
+    parser.add_argument("--purge-days", type=int, default=30, help="delete quarantined files after this many days")
+    parser.add_argument("--batch-size", type=int, default=500, help="files per batch (default 500)")
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to sleep between batches (default 0.05)")
+    parser.add_argument("--max-files", type=int, default=0,
+                        help="stop after about this many files per store and resume there next run (default: all)")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+    args = parser.parse_args(argv)
+
+    client = MongoClient(args.uri)
+    db = client.get_default_database("library")
+    book_store = BlobStore(args.books, "book", make_backend(args.backend, args.books, "book_files", lambda: db, args.cache))
+    cover_store = BlobStore(args.covers, "cover", make_backend(args.backend, args.covers, "cover_files", lambda: db, args.cache))
+    reports = reconcile(db, book_store, cover_store, args.quarantine, grace=timedelta(hours=args.grace_hours),
+                        purge_days=args.purge_days, batch_size=args.batch_size, pause=args.pause, dry_run=args.dry_run,
+                        max_files=args.max_files or None)
+    for report in reports:
+        print(f"🧹 {report['kind']}: scanned {report['scanned']}, quarantined {report['quarantined']} "
+              f"({report['quarantined_bytes']} bytes), kept {report['recent']} recent, "
+              f"removed {report['temp_removed']} temp file(s), restored {report['restored']}, "
+              f"purged {report['purged']} old quarantine folder(s)")
+        if not report["complete"]:
+            print(f"⏸️ {report['kind']}: walk paused, the next run resumes where this one stopped")
+        for path, book_ids in report["missing"]:
+            print(f"❌ Missing {report['kind']} file {path} (books: {', '.join(book_ids)})")
+    client.close()
+    return 1 if any(report["missing"] for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
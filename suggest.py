@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Prefix autocomplete over titles, authors, subjects and tags.
+Completions live in a sorted array of folded keys (one per word start) so a
+prefix lookup is a binary search; each completion is ranked by the total
+downloads of the books behind it.
+"""
+
+import bisect
+import heapq
+import threading
+from collections import defaultdict
+
+from search_engine import fold
+
+SUGGEST_FIELDS = ("title", "author", "subject", "tags")
+
+# Projection used when loading books into the suggester
+SUGGEST_PROJECTION = {"title": 1, "author": 1, "subject": 1, "tags": 1, "downloads": 1}
+
+# Prefixes up to this length match so many keys that their answers are memoized
+CACHED_PREFIX_LEN = 2
+
+
+def word_starts(text):
+    """Yield every suffix of text that begins at a word boundary."""
+    folded = " ".join(fold(text).split())
+    for i, ch in enumerate(folded):
+        if ch.isalnum() and (i == 0 or not folded[i - 1].isalnum()):
+            yield folded[i:]
+
+
+def book_completions(book):
+    """Return the (kind, text) completions a book contributes."""
+    completions = set()
+    for field in SUGGEST_FIELDS:
+        value = book.get(field)
+        values = value if isinstance(value, (list, tuple)) else [value]
+        kind = "tag" if field == "tags" else field
+        for item in values:
+            if item and str(item).strip():
+                completions.add((kind, str(item).strip()))
+    return completions
+
+
+class SuggestIndex:
+    """Sorted-array prefix index with download-ranked completions."""
+
+    def __init__(self):
+        self.loaded = False
+        self._keys = []                      # sorted (folded key, kind, text)
+        self._scores = defaultdict(int)      # (kind, text) -> total downloads
+        self._refs = defaultdict(set)        # (kind, text) -> book ids
+        self._books = {}                     # book_id -> (completions, downloads)
+        self._cache = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._refs)
+
+    def build(self, books):
+        """Rebuild the index from an iterable of book documents."""
+        with self._lock:
+            self._scores = defaultdict(int)
+            self._refs = defaultdict(set)
+            self._books = {}
+            for book in books:
+                self._add(book, new_keys=None)
+            self._keys = sorted(
+                (key, kind, text)
+                for kind, text in self._refs
+                for key in word_starts(text)
+            )
+            self._cache = {}
+            self.loaded = True
+
+    def add(self, book):
+        """Index (or re-index) a single book document."""
+        with self._lock:
+            self._remove(str(book["_id"]))
+            self._add(book, new_keys=True)
+            self._cache = {}
+
+    def remove(self, book_id):
+        """Drop a book from the index."""
+        with self._lock:
+            self._remove(str(book_id))
+            self._cache = {}
+
+    def bump(self, book_id, downloads=1):
+        """Add downloads to a book's completions without re-reading it."""
+        with self._lock:
+            entry = self._books.get(str(book_id))
+            if not entry:
+                return
+            completions, count = entry
+            self._books[str(book_id)] = (completions, count + downloads)
+            for completion in completions:
+                self._scores[completion] += downloads
+            self._cache = {}
+
+    def _add(self, book, new_keys):
+        book_id = str(book["_id"])
+        downloads = book.get("downloads") or 0
+        completions = book_completions(book)
+        for completion in completions:
+            if new_keys and not self._refs[completion]:
+                kind, text = completion
+                for key in word_starts(text):
+                    bisect.insort(self._keys, (key, kind, text))
+            self._refs[completion].add(book_id)
+            self._scores[completion] += downloads
+        self._books[book_id] = (completions, downloads)
+
+    def _remove(self, book_id):
+        entry = self._books.pop(book_id, None)
+        if not entry:
+            return
+        completions, downloads = entry
+        for completion in completions:
+            self._scores[completion] -= downloads
+            self._refs[completion].discard(book_id)
+            if not self._refs[completion]:
+                del self._refs[completion]
+                del self._scores[completion]
+                kind, text = completion
+                for key in word_starts(text):
+                    i = bisect.bisect_left(self._keys, (key, kind, text))
+                    if i < len(self._keys) and self._keys[i] == (key, kind, text):
+                        del self._keys[i]
+
+    def suggest(self, prefix, limit=10):
+        """
+        Return up to limit completions for prefix, most downloaded first,
+        as dicts with text, type and (for unique titles) book_id.
+        """
+        folded = " ".join(fold(prefix).split())
+        if not folded:
+            return []
+        with self._lock:
+            cache_key = (folded, limit)
+            if len(folded) <= CACHED_PREFIX_LEN and cache_key in self._cache:
+                return self._cache[cache_key]
+
+            start = bisect.bisect_left(self._keys, (folded,))
+            seen = set()
+            candidates = []
+            for i in range(start, len(self._keys)):
+                key, kind, text = self._keys[i]
+                if not key.startswith(folded):
+                    break
+                if (kind, text) not in seen:
+                    seen.add((kind, text))
+                    candidates.append((kind, text))
+
+            best = heapq.nsmallest(
+                limit, candidates,
+                key=lambda c: (-self._scores[c], len(c[1]), c[1].casefold(), c[0]),
+            )
+            results = []
+            for kind, text in best:
+                result = {"text": text, "type": kind}
+                refs = self._refs[(kind, text)]
+                if kind == "title" and len(refs) == 1:
+                    result["book_id"] = next(iter(refs))
+                results.append(result)
+
+            if len(folded) <= CACHED_PREFIX_LEN:
+                self._cache[cache_key] = results
+            return results
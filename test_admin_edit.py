@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for releasing stored files when an admin edits a book
+"""
+
+import io
+import tempfile
+from types import SimpleNamespace
+
+from bson.objectid import ObjectId
+
+import app_local
+from storage import BlobStore
+
+class FakeBlobs:
+    def __init__(self):
+        self.docs = {}
+
+    def update_one(self, query, update, upsert=False):
+        doc = self.docs.setdefault(query["_id"], {"_id": query["_id"], "refs": 0, **update.get("$setOnInsert", {})})
+        doc["refs"] += update["$inc"]["refs"]
+
+    def find_one_and_update(self, query, update, return_document=None):
+        doc = self.docs.get(query["_id"])
+        if doc is not None:
+            doc["refs"] += update["$inc"]["refs"]
+        return doc
+
+    def delete_one(self, query):
+        class Result:
+            deleted_count = 0
+        doc = self.docs.get(query["_id"])
+        if doc is not None and doc["refs"] <= query["refs"]["$lte"]:
+            del self.docs[query["_id"]]
+            Result.deleted_count = 1
+        return Result
+
+class FakeBooks:
+    def __init__(self, book):
+        self.book = book
+
+    def find_one(self, query, projection=None):
+        return dict(self.book) if query["_id"] == self.book["_id"] else None
+
+    def update_one(self, query, update):
+        self.book.update(update["$set"])
+
+class FakeDB(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+class FakeThumbnails:
+    def submit(self, cover_filename):
+        return None
+
+    def remove(self, cover_filename):
+        pass
+
+def test_identical_cover_reupload_keeps_one_reference(monkeypatch):
+    db = {"blobs": FakeBlobs()}
+    store = BlobStore(tempfile.mkdtemp(), "cover")
+    cover = store.put(db, io.BytesIO(b"cover bytes"), "cover.jpg")
+    book = {"_id": ObjectId(), "title": "T", "author": "A", "subject": "S", "cover_filename": cover.path}
+    db["books"] = FakeBooks(book)
+    monkeypatch.setattr(app_local, "mongo", SimpleNamespace(db=FakeDB(db)))
+    monkeypatch.setattr(app_local, "cover_store", store)
+    monkeypatch.setattr(app_local, "thumbnail_pipeline", FakeThumbnails())
+    monkeypatch.setattr(app_local, "ensure_app_indexes", lambda: None)
+    monkeypatch.setattr(app_local, "migrate_legacy_grants", lambda: None)
+    monkeypatch.setattr(app_local, "sync_book_indexes", lambda book_id: None)
+
+    client = app_local.app.test_client()
+    with client.session_transaction() as session:
+        session["role"] = "admin"
+    response = client.post(f"/admin/edit/{book['_id']}", content_type="multipart/form-data", data={
+        "title": "T", "author": "A", "subject": "S", "cover": (io.BytesIO(b"cover bytes"), "again.jpg")})
+    assert response.status_code == 302
+    assert book["cover_filename"] == cover.path
+    assert db["blobs"].docs[f"cover:{cover.path}"]["refs"] == 1
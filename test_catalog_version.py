@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Tests for keeping each worker's catalog indexes in step with other workers' writes
+"""
+
+import threading
+from types import SimpleNamespace
+
+import app_local
+
+class FakeBooks:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query=None, projection=None):
+        return [dict(doc) for doc in self.docs]
+
+class FakeState:
+    def __init__(self):
+        self.docs = {}
+
+    def find_one(self, query, projection=None):
+        return self.docs.get(query["_id"])
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        doc = self.docs.setdefault(query["_id"], {"_id": query["_id"], "version": 0})
+        doc["version"] += update["$inc"]["version"]
+        return doc
+
+class InlineThread:
+    def __init__(self, target, args=(), daemon=None):
+        self.target, self.args = target, args
+
+    def start(self):
+        self.target(*self.args)
+
+def book(book_id, title):
+    return {"_id": book_id, "title": title, "author": "Ann Author", "subject": "Fiction", "tags": [], "language": "English"}
+
+def test_worker_rebuilds_indexes_after_another_workers_write(monkeypatch):
+    books = [book("a1", "Winter Garden")]
+    state = FakeState()
+    monkeypatch.setattr(app_local, "mongo", SimpleNamespace(db=SimpleNamespace(books=FakeBooks(books), catalog_state=state)))
+    monkeypatch.setattr(threading, "Thread", InlineThread)
+    monkeypatch.setenv("CATALOG_VERSION_CHECK_SECONDS", "0")
+    for name in ("search_index", "facet_index", "suggest_index", "fuzzy_index"):
+        monkeypatch.setattr(app_local, name, type(getattr(app_local, name))())
+    monkeypatch.setattr(app_local, "catalog_version_seen", None)
+    monkeypatch.setattr(app_local, "catalog_version_checked", 0.0)
+
+    assert app_local.get_search_index().search("summer") == []
+    app_local.get_fuzzy_index()
+    app_local.get_suggest_index()
+
+    # Another worker adds a book and bumps the shared version
+    books.append(book("b2", "Summer House"))
+    state.find_one_and_update({"_id": app_local.CATALOG_STATE_ID}, {"$inc": {"version": 1}})
+    assert app_local.get_search_index().search("summer") == ["b2"]
+    assert "b2" in app_local.get_fuzzy_index().search("Sumer House")
+    assert any(hit["text"] == "Summer House" for hit in app_local.get_suggest_index().suggest("summ"))
+    assert len(app_local.get_facet_index()) == 2
+
+    # This worker's own write is already applied in place, so it does not trigger a rebuild
+    rebuilt_index = app_local.search_index
+    app_local.bump_catalog_version()
+    app_local.get_search_index()
+    assert app_local.search_index is rebuilt_index
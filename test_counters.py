@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests for the write-behind download counter
+"""
+
+import time
+
+from bson.objectid import ObjectId
+
+from counters import WriteBehindCounter
+
+class FakeBooks:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def bulk_write(self, ops, ordered=True):
+        if self.fail:
+            raise RuntimeError("primary unavailable")
+        self.batches.append({op._filter["_id"]: op._doc["$inc"]["downloads"] for op in ops})
+
+def test_increments_merge_into_one_bulk_write():
+    a, b = ObjectId(), ObjectId()
+    books = FakeBooks()
+    flushed = []
+    counter = WriteBehindCounter(books, interval=60, on_flush=flushed.append)
+    for book_id in (a, a, b, a):
+        counter.incr(book_id)
+    assert counter.pending(a) == 3
+    assert counter.flush() == 2
+    assert books.batches == [{a: 3, b: 1}]
+    assert flushed == [{str(a): 3, str(b): 1}]
+    assert counter.pending() == 0
+    assert counter.flush() == 0
+    counter.close()
+
+def test_failed_flush_keeps_increments():
+    a = ObjectId()
+    books = FakeBooks(fail=True)
+    counter = WriteBehindCounter(books, interval=60)
+    counter.incr(a, 2)
+    try:
+        counter.flush()
+    except RuntimeError:
+        pass
+    assert counter.pending(a) == 2
+    books.fail = False
+    counter.incr(a)
+    assert counter.close() == 1
+    assert books.batches == [{a: 3}]
+
+def test_max_pending_wakes_flusher():
+    a = ObjectId()
+    books = FakeBooks()
+    counter = WriteBehindCounter(books, interval=60, max_pending=3)
+    for _ in range(3):
+        counter.incr(a)
+    deadline = time.time() + 2
+    while not books.batches and time.time() < deadline:
+        time.sleep(0.01)
+    assert books.batches == [{a: 3}]
+    counter.close()
+
+if __name__ == "__main__":
+    test_increments_merge_into_one_bulk_write()
+    test_failed_flush_keeps_increments()
+    test_max_pending_wakes_flusher()
+    print("✅ Counter tests passed")
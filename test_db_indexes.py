@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Tests for the index registry helpers
+"""
+
+from db_indexes import INDEXES, QUERY_SHAPES, plan_stages
+
+def test_plan_stages_walks_nested_plans():
+    plan = {"stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}
+    assert list(plan_stages(plan)) == ["LIMIT", "FETCH", "IXSCAN"]
+    plan = {"stage": "SUBPLAN", "inputStage": {"stage": "OR", "inputStages": [{"stage": "COLLSCAN"}, {"stage": "IXSCAN"}]}}
+    assert "COLLSCAN" in list(plan_stages(plan))
+
+def test_registry_names_are_unique():
+    for collection_name, models in INDEXES.items():
+        names = [model.document["name"] for model in models]
+        assert len(names) == len(set(names)), collection_name
+
+def test_query_shapes_target_registered_collections():
+    for name, collection_name, _, _ in QUERY_SHAPES:
+        assert collection_name in INDEXES, name
+
+if __name__ == "__main__":
+    test_plan_stages_walks_nested_plans()
+    test_registry_names_are_unique()
+    test_query_shapes_target_registered_collections()
+    print("✅ Index registry tests passed")
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Tests for the materialized facet counts
+"""
+
+from facets import FacetIndex
+
+BOOKS = [
+    {"_id": "b1", "author": "George Orwell", "year": 1945, "subject": "Fiction", "language": "English"},
+    {"_id": "b2", "author": "George Orwell", "year": 1949, "subject": "Dystopian", "language": "English"},
+    {"_id": "b3", "author": "Paulo Coelho", "year": 1988, "subject": "Fiction", "language": "Portuguese"},
+    {"_id": "b4", "author": "Unknown", "year": 0, "subject": "", "language": "English"},
+]
+
+def test_unfiltered_counts():
+    index = FacetIndex()
+    index.build(BOOKS)
+    counts = index.counts()
+    assert counts["author"] == [("George Orwell", 2), ("Paulo Coelho", 1), ("Unknown", 1)]
+    assert counts["year"] == [(1945, 1), (1949, 1), (1988, 1)]
+    assert counts["subject"] == [("Dystopian", 1), ("Fiction", 2)]
+
+def test_counts_respect_other_filters():
+    index = FacetIndex()
+    index.build(BOOKS)
+    counts = index.counts({"subject": "Fiction"})
+    assert counts["author"] == [("George Orwell", 1), ("Paulo Coelho", 1)]
+    # The selected field still lists its siblings
+    assert counts["subject"] == [("Dystopian", 1), ("Fiction", 2)]
+    counts = index.counts({}, restrict_to=["b2"])
+    assert counts["language"] == [("English", 1)]
+
+def test_incremental_deltas():
+    index = FacetIndex()
+    index.build(BOOKS)
+    deltas = index.add({"_id": "b1", "author": "George Orwell", "year": 1945, "subject": "Satire", "language": "English"})
+    assert deltas == {("subject", "Fiction"): -1, ("subject", "Satire"): 1}
+    deltas = index.remove("b3")
+    assert deltas[("author", "Paulo Coelho")] == -1
+    assert ("Paulo Coelho", 1) not in index.counts()["author"]
+    assert len(index) == 3
+
+if __name__ == "__main__":
+    test_unfiltered_counts()
+    test_counts_respect_other_filters()
+    test_incremental_deltas()
+    print("✅ Facet tests passed")
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Tests for ingest-time file metadata and the stat cache
+"""
+
+import hashlib
+import os
+import tempfile
+
+from pypdf import PdfWriter
+
+from file_metadata import FileStat, StatCache, describe_file
+
+def make_pdf(pages):
+    path = os.path.join(tempfile.mkdtemp(), "book.pdf")
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return path
+
+def test_describe_pdf():
+    path = make_pdf(3)
+    fields = describe_file(path)
+    with open(path, "rb") as f:
+        assert fields["file_sha256"] == hashlib.sha256(f.read()).hexdigest()
+    assert fields["file_size"] == os.path.getsize(path)
+    assert fields["file_mime"] == "application/pdf" and fields["file_pages"] == 3
+    assert describe_file(path, digest="abc")["file_sha256"] == "abc"
+
+def test_describe_non_pdf_uses_name():
+    path = os.path.join(tempfile.mkdtemp(), "notes")
+    with open(path, "w") as f:
+        f.write("plain text")
+    fields = describe_file(path, name="notes.txt")
+    assert fields["file_mime"] == "text/plain" and fields["file_pages"] is None
+
+def test_stat_cache_revalidates_after_ttl():
+    path = make_pdf(1)
+    cache = StatCache(ttl=3600)
+    first = cache.stat(path)
+    assert first == FileStat(os.path.getsize(path), int(os.path.getmtime(path)))
+    os.unlink(path)
+    assert cache.stat(path) == first          # served from memory
+    cache.ttl = 0
+    assert cache.stat(path) is None           # revalidated: the file is gone
+    assert cache.stat(os.path.join(os.path.dirname(path), "missing.pdf")) is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["changed"] == 1 and stats["misses"] == 2
+
+if __name__ == "__main__":
+    test_describe_pdf()
+    test_describe_non_pdf_uses_name()
+    test_stat_cache_revalidates_after_ttl()
+    print("✅ File metadata tests passed")
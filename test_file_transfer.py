@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests for Range-aware book file responses
+"""
+
+import os
+import tempfile
+
+from flask import Flask
+
+from file_transfer import bytes_sent, send_book_file, starts_download
+
+DATA = bytes(range(256)) * 4
+
+def make_client(mode="direct"):
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "book.pdf")
+    with open(path, "wb") as f:
+        f.write(DATA)
+    app = Flask(__name__)
+
+    @app.route("/file")
+    def serve():
+        return send_book_file(path, "abc123", "book.pdf", as_attachment=True, mode=mode)
+
+    @app.route("/usage")
+    def usage():
+        response = send_book_file(path, "abc123", "book.pdf", as_attachment=True, mode=mode)
+        return {"counted": starts_download(response, len(DATA)), "bytes": bytes_sent(response, len(DATA))}
+
+    return app.test_client()
+
+def test_full_and_conditional():
+    client = make_client()
+    response = client.get("/file")
+    assert response.status_code == 200 and response.data == DATA
+    assert response.headers["ETag"] == '"abc123"' and response.headers["Accept-Ranges"] == "bytes"
+    assert client.get("/file", headers={"If-None-Match": '"abc123"'}).status_code == 304
+
+def test_single_and_suffix_ranges():
+    client = make_client()
+    response = client.get("/file", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 100-199/{len(DATA)}"
+    assert response.data == DATA[100:200]
+    response = client.get("/file", headers={"Range": "bytes=-10"})
+    assert response.data == DATA[-10:]
+    response = client.get("/file", headers={"Range": f"bytes={len(DATA) + 1}-"})
+    assert response.status_code == 416 and response.headers["Content-Range"] == f"bytes */{len(DATA)}"
+
+def test_multiple_ranges():
+    response = make_client().get("/file", headers={"Range": "bytes=0-1,10-12"})
+    assert response.status_code == 206
+    assert response.headers["Content-Type"].startswith("multipart/byteranges; boundary=")
+    assert len(response.data) == int(response.headers["Content-Length"])
+    assert b"Content-Range: bytes 0-1/1024\r\n\r\n" + DATA[0:2] in response.data
+    assert b"Content-Range: bytes 10-12/1024\r\n\r\n" + DATA[10:13] in response.data
+
+def test_if_range_mismatch_sends_whole_file():
+    client = make_client()
+    response = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+    assert response.status_code == 200 and response.data == DATA
+    response = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": '"abc123"'})
+    assert response.status_code == 206
+
+def test_proxy_modes():
+    response = make_client("x-accel").get("/file")
+    assert response.headers["X-Accel-Redirect"] == "/protected-books/book.pdf"
+    assert response.data == b""
+    response = make_client("x-sendfile").get("/file")
+    assert response.headers["X-Sendfile"].endswith("book.pdf")
+
+def test_ranges_count_once_in_every_mode():
+    for mode in ("direct", "x-accel", "x-sendfile"):
+        client = make_client(mode)
+        assert client.get("/usage").json == {"counted": True, "bytes": len(DATA)}
+        assert client.get("/usage", headers={"Range": "bytes=0-99"}).json == {"counted": True, "bytes": 100}
+        assert client.get("/usage", headers={"Range": "bytes=100-"}).json == {"counted": False, "bytes": len(DATA) - 100}
+        assert client.get("/usage", headers={"Range": "bytes=-10"}).json == {"counted": False, "bytes": 10}
+        assert client.get("/usage", headers={"If-None-Match": '"abc123"'}).json == {"counted": False, "bytes": 0}
+
+if __name__ == "__main__":
+    test_full_and_conditional()
+    test_single_and_suffix_ranges()
+    test_multiple_ranges()
+    test_if_range_mismatch_sends_whole_file()
+    test_proxy_modes()
+    test_ranges_count_once_in_every_mode()
+    print("✅ File transfer tests passed")
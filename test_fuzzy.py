@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Tests for typo-tolerant trigram search
+"""
+
+import fuzzy
+from fuzzy import TrigramIndex, bounded_levenshtein
+
+BOOKS = [
+    {"_id": "d1", "title": "Animal Farm", "author": "George Orwell", "subject": "Fiction"},
+    {"_id": "d2", "title": "The Little Prince", "author": "Antoine de Saint-Exupéry", "subject": "Fiction"},
+    {"_id": "d3", "title": "The Hobbit", "author": "J.R.R. Tolkien", "subject": "Fantasy"},
+]
+
+def build_index():
+    index = TrigramIndex()
+    index.build(BOOKS)
+    return index
+
+def test_bounded_levenshtein():
+    assert bounded_levenshtein("orwel", "orwell", 1) == 1
+    assert bounded_levenshtein("kitten", "sitting", 3) == 3
+    assert bounded_levenshtein("kitten", "sitting", 1) == 2
+
+def test_misspellings_match():
+    index = build_index()
+    assert index.search("Orwel") == ["d1"]
+    assert index.search("Saint Exupery") == ["d2"]
+    assert index.search("hobit") == ["d3"]
+    assert index.search("fantsy") == ["d3"]
+    assert index.search("zzzzzz") == []
+
+def test_incremental_updates():
+    index = build_index()
+    index.remove("d1")
+    assert index.search("Orwel") == []
+    index.add({"_id": "d4", "title": "Homage to Catalonia", "author": "George Orwell", "subject": "Memoir"})
+    assert index.search("orwel") == ["d4"]
+
+def test_rerank_skips_wrong_lengths_and_is_capped(monkeypatch):
+    ranked = []
+    distance = fuzzy.window_distance
+    monkeypatch.setattr(fuzzy, "window_distance", lambda q, v, limit: ranked.append(v) or distance(q, v, limit))
+    index = TrigramIndex()
+    # Every title shares the query's trigrams, but only one word has a length within the edit budget
+    index.build([{"_id": f"b{i}", "title": f"Orwellianism{i}", "author": "", "subject": ""} for i in range(50)] +
+                [{"_id": "d1", "title": "Animal Farm", "author": "George Orwell", "subject": ""}])
+    assert index.search("Orwel") == ["d1"] and ranked == [["george", "orwell"]]
+
+    ranked.clear()
+    monkeypatch.setattr(fuzzy, "MAX_CANDIDATES", 5)
+    index.build([{"_id": f"b{i}", "title": f"Orwel{i}", "author": "", "subject": ""} for i in range(50)])
+    assert len(index.search("Orwel")) == 5 and len(ranked) == 5
+
+if __name__ == "__main__":
+    test_bounded_levenshtein()
+    test_misspellings_match()
+    test_incremental_updates()
+    print("✅ Fuzzy search tests passed")
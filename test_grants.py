@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Tests for the grants collection helpers
+"""
+
+from bson.objectid import ObjectId
+from pymongo import DeleteMany, UpdateOne
+
+import grants
+
+class FakeCollection:
+    def __init__(self, docs=None):
+        self.docs = list(docs or [])
+        self.bulk_calls = 0
+
+    def _matches(self, doc, query):
+        for field, cond in query.items():
+            if field.endswith(".0"):
+                if not doc.get(field[:-2]):
+                    return False
+            elif isinstance(cond, dict) and "$in" in cond:
+                if doc.get(field) not in cond["$in"]:
+                    return False
+            elif doc.get(field) != cond:
+                return False
+        return True
+
+    def find(self, query, projection=None):
+        return [dict(doc) for doc in self.docs if self._matches(doc, query)]
+
+    def delete_one(self, query):
+        for doc in self.docs:
+            if self._matches(doc, query):
+                self.docs.remove(doc)
+                return
+
+    def delete_many(self, query):
+        self.docs = [doc for doc in self.docs if not self._matches(doc, query)]
+
+    def update_many(self, query, update):
+        for doc in self.docs:
+            if self._matches(doc, query):
+                for field in update.get("$unset", {}):
+                    doc.pop(field, None)
+
+    def bulk_write(self, ops, ordered=True):
+        self.bulk_calls += 1
+        for op in ops:
+            if isinstance(op, UpdateOne):
+                if not self.find(op._filter):
+                    self.docs.append(dict(op._filter))
+            elif isinstance(op, DeleteMany):
+                self.delete_many(op._filter)
+
+class FakeDB(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+    def __getattr__(self, name):
+        return self[name]
+
+def held(db, principal):
+    return {doc["book_id"] for doc in db.grants.docs if doc["principal"] == principal}
+
+def test_principals_for_user():
+    user_id = ObjectId()
+    user = {"_id": user_id, "role": "user", "groups": ["class-a", ""]}
+    assert grants.principals_for(user) == [f"user:{user_id}", "role:user", "group:class-a"]
+
+def test_set_grants_applies_diff_in_one_bulk_write():
+    db = FakeDB()
+    grants.set_grants(db, "user:1", ["a", "b"])
+    db.grants.bulk_calls = 0
+    assert grants.set_grants(db, "user:1", ["b", "c"]) == (1, 1)
+    assert held(db, "user:1") == {"b", "c"}
+    assert db.grants.bulk_calls == 1
+    assert grants.set_grants(db, "user:1", ["b", "c"]) == (0, 0)
+    assert db.grants.bulk_calls == 1
+
+def test_set_grants_only_touches_scope():
+    db = FakeDB()
+    grants.set_grants(db, "user:1", ["a", "b", "x"])
+    # Submitting a page that shows a and b leaves x alone
+    assert grants.set_grants(db, "user:1", ["b", "z"], scope=["a", "b"]) == (0, 1)
+    assert held(db, "user:1") == {"b", "x"}
+
+def test_group_and_role_grants_resolve():
+    db = FakeDB()
+    grants.grant(db, "user:1", "a")
+    grants.grant(db, "group:class-a", "b")
+    grants.grant(db, "role:admin", "c")
+    assert grants.granted_book_ids(db, ["user:1", "group:class-a", "role:user"]) == {"a", "b"}
+    grants.revoke(db, "group:class-a", "b")
+    grants.drop_book_grants(db, "a")
+    assert grants.granted_book_ids(db, ["user:1", "group:class-a"]) == set()
+
+def test_migrate_embedded_grants():
+    book_id = ObjectId()
+    db = FakeDB()
+    db.books.docs = [{"_id": book_id, "allowed_users": ["u1", "u2"]}, {"_id": ObjectId()}]
+    assert grants.migrate_embedded_grants(db) == 2
+    assert held(db, "user:u1") == {str(book_id)}
+    assert "allowed_users" not in db.books.docs[0]
+    assert grants.migrate_embedded_grants(db) == 0
+
+if __name__ == "__main__":
+    test_principals_for_user()
+    test_set_grants_applies_diff_in_one_bulk_write()
+    test_set_grants_only_touches_scope()
+    test_group_and_role_grants_resolve()
+    test_migrate_embedded_grants()
+    print("✅ Grant tests passed")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Tests for keyset pagination tokens
+"""
+
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+from pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_filter, paginate, paginate_ids
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, spec):
+        # Null and missing values sort first, like MongoDB
+        for field, direction in reversed(spec):
+            self.docs.sort(key=lambda doc: (doc.get(field) is not None, doc.get(field) or 0), reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def _matches(self, doc, query):
+        for field, cond in query.items():
+            if field in ("$or", "$and"):
+                found = [self._matches(doc, branch) for branch in cond]
+                if not (any(found) if field == "$or" else all(found)):
+                    return False
+                continue
+            value = doc.get(field)
+            if not isinstance(cond, dict):
+                if value != cond:
+                    return False
+                continue
+            # Range operators never match across types (null included)
+            if "$gt" in cond and (value is None or not value > cond["$gt"]):
+                return False
+            if "$lt" in cond and (value is None or not value < cond["$lt"]):
+                return False
+            if "$ne" in cond and value == cond["$ne"]:
+                return False
+        return True
+
+    def find(self, query, projection=None):
+        return FakeCursor([doc for doc in self.docs if self._matches(doc, query)])
+
+def test_cursor_round_trip():
+    doc_id = ObjectId()
+    when = datetime(2024, 1, 2, 3, 4, 5)
+    token = encode_cursor(when, doc_id, "next")
+    assert "=" not in token
+    assert decode_cursor(token) == (when, doc_id, "next")
+
+def test_invalid_cursor():
+    with pytest.raises(InvalidCursor):
+        decode_cursor("not-a-cursor")
+
+def test_keyset_filter_uses_id_tiebreaker():
+    doc_id = ObjectId()
+    assert keyset_filter("year", -1, 1999, doc_id) == {"$or": [
+        {"year": {"$lt": 1999}},
+        {"year": 1999, "_id": {"$lt": doc_id}},
+        {"year": None},
+    ]}
+    assert keyset_filter("_id", 1, None, doc_id) == {"_id": {"$gt": doc_id}}
+
+@pytest.mark.parametrize("sort_dir", [1, -1])
+def test_paging_reaches_rows_without_a_sort_value(sort_dir):
+    # A legacy document has no year at all, another an explicit null
+    docs = [{"_id": ObjectId(), "year": year} for year in (2001, 1999, 2001, 1984)]
+    docs += [{"_id": ObjectId()}, {"_id": ObjectId(), "year": None}]
+    collection = FakeCollection(docs)
+    seen, cursor = [], None
+    while True:
+        page, cursor, _ = paginate(collection, {}, "year", sort_dir, cursor, page_size=1)
+        seen += page
+        if cursor is None:
+            break
+    assert sorted(doc["_id"] for doc in seen) == sorted(doc["_id"] for doc in docs)
+    assert len(seen) == len(docs)
+
+    # And back again from the last page
+    back, cursor = [], encode_cursor(seen[-1].get("year"), seen[-1]["_id"], "prev")
+    while cursor:
+        page, _, cursor = paginate(collection, {}, "year", sort_dir, cursor, page_size=1)
+        back = page + back
+    assert back == seen[:-1]
+
+def test_paginate_ids():
+    ids = [str(i) for i in range(5)]
+    page, next_cursor, prev_cursor = paginate_ids(ids, page_size=2)
+    assert page == ["0", "1"] and prev_cursor is None
+    page, next_cursor, prev_cursor = paginate_ids(ids, next_cursor, page_size=2)
+    assert page == ["2", "3"]
+    page, next_cursor, _ = paginate_ids(ids, next_cursor, page_size=2)
+    assert page == ["4"] and next_cursor is None
+    assert paginate_ids(ids, prev_cursor, page_size=2)[0] == ["0", "1"]
+
+if __name__ == "__main__":
+    test_cursor_round_trip()
+    test_keyset_filter_uses_id_tiebreaker()
+    test_paginate_ids()
+    print("✅ Pagination tests passed")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Tests for PDF text extraction helpers
+"""
+
+import hashlib
+import io
+import os
+
+from bson.objectid import ObjectId
+from pypdf import PdfWriter
+
+import pdf_text
+from pdf_text import STATE_COLLECTION, extract_pages, file_fingerprint, process_book
+
+class FakeCollection:
+    def __init__(self, docs=()):
+        self.docs = {doc["_id"]: doc for doc in docs}
+
+    def find_one(self, query, projection=None):
+        return self.docs.get(query["_id"])
+
+    def replace_one(self, query, doc, upsert=False):
+        self.docs[query["_id"]] = {"_id": query["_id"], **doc}
+
+    def delete_many(self, query):
+        pass
+
+    def insert_many(self, docs, ordered=True):
+        pass
+
+class FakeDB(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+def test_file_fingerprint(tmp_path):
+    path = tmp_path / "book.pdf"
+    path.write_bytes(b"%PDF-1.4 sample")
+    assert file_fingerprint(str(path), chunk_size=4) == hashlib.sha256(b"%PDF-1.4 sample").hexdigest()
+
+def test_extract_pages_returns_one_entry_per_page(tmp_path):
+    path = tmp_path / "blank.pdf"
+    writer = PdfWriter()
+    writer.add_blank_page(width=200, height=200)
+    writer.add_blank_page(width=200, height=200)
+    with open(path, "wb") as f:
+        writer.write(f)
+    assert extract_pages(str(path)) == ["", ""]
+
+def test_recorded_sha256_is_reused_while_the_file_is_unchanged(tmp_path, monkeypatch):
+    path = tmp_path / "book.pdf"
+    path.write_bytes(b"%PDF-1.4 sample")
+    stat = os.stat(path)
+    book_id = ObjectId()
+    db = FakeDB(books=FakeCollection([{"_id": book_id, "filename": "book.pdf", "file_sha256": "recorded",
+                                       "file_size": stat.st_size, "file_mtime": int(stat.st_mtime)}]))
+    hashed = []
+    monkeypatch.setattr(pdf_text, "file_fingerprint", lambda path: hashed.append(path) or "rehashed")
+    extract = lambda path: ["page one"]
+    assert process_book(db, str(tmp_path), book_id, extract=extract) == "extracted"
+    assert process_book(db, str(tmp_path), book_id, extract=extract) == "unchanged"
+    assert hashed == [] and db[STATE_COLLECTION].docs[str(book_id)]["sha256"] == "recorded"
+
+    # A file changed behind the book's back is hashed again
+    db.books.docs[book_id]["file_size"] += 1
+    assert process_book(db, str(tmp_path), book_id, extract=extract) == "extracted"
+    assert hashed == [str(path)]
+
+def test_blob_without_a_local_path_is_streamed_to_a_temp_file(tmp_path):
+    book_id = ObjectId()
+    db = FakeDB(books=FakeCollection([{"_id": book_id, "filename": "sha256/ab/cd/big.pdf"}]))
+    seen = []
+
+    def extract(path):
+        with open(path, "rb") as f:
+            seen.append((path, f.read()))
+        return ["text"]
+    status = process_book(db, str(tmp_path), book_id, extract=extract,
+                          resolve=lambda filename: None, open_blob=lambda filename: io.BytesIO(b"%PDF big"))
+    assert status == "extracted" and seen[0][1] == b"%PDF big"
+    assert not os.path.exists(seen[0][0])
+    assert db[STATE_COLLECTION].docs[str(book_id)]["sha256"] == hashlib.sha256(b"%PDF big").hexdigest()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Tests for the search box query compiler
+"""
+
+from query_parser import Phrase, Qualifier, Term, compile_query, parse_query
+
+def test_parse_nodes():
+    nodes = parse_query('author:"George Orwell" "animal farm" year:1940-1950 subj* foo:bar')
+    assert nodes == [
+        Qualifier("author", "George Orwell", False),
+        Phrase("animal farm"),
+        Qualifier("year", "1940-1950", False),
+        Term("subj", True),
+        Term("foo", False),
+        Term("bar", False),
+    ]
+
+def test_regex_metacharacters_are_inert():
+    compiled = compile_query(".*(a+)+$ [x")
+    assert compiled.terms == [("a", False), ("x", True)]
+    assert compiled.mongo == {}
+
+def test_unresolved_qualifiers_are_index_friendly():
+    compiled = compile_query("author:Orw* year:1949 subject:Fiction")
+    assert compiled.mongo == {"$and": [
+        {"author": {"$regex": "^Orw"}},
+        {"year": 1949},
+        {"subject": "Fiction"},
+    ]}
+    assert compile_query("year:1940-1950").mongo == {"year": {"$gte": 1940, "$lte": 1950}}
+    assert compile_query("year:soon").mongo == {"year": {"$in": []}}
+
+def test_resolved_qualifiers_become_equality():
+    stored = {"author": ["George Orwell", "Georgette Heyer", "Saint-Exupéry"], "year": [1945, 1949, 1988]}
+    resolve = lambda field, matcher: [value for value in stored.get(field, []) if matcher(value)]
+    assert compile_query("author:orwell", resolve).mongo == {"author": {"$in": ["George Orwell"]}}
+    assert compile_query("author:george", resolve).values == {"author": ["George Orwell"]}
+    assert compile_query("author:georg*", resolve).values == {"author": ["George Orwell", "Georgette Heyer"]}
+    assert compile_query("author:exupery", resolve).values == {"author": ["Saint-Exupéry"]}
+    assert compile_query("year:1940-1950", resolve).values == {"year": [1945, 1949]}
+
+def test_phrases_feed_terms_and_escaped_predicate():
+    compiled = compile_query('"c++ primer"')
+    assert compiled.terms == [("c", False), ("primer", False)]
+    assert compiled.phrases[0]["$or"][0] == {"title": {"$regex": r"c\+\+\ primer", "$options": "i"}}
+
+if __name__ == "__main__":
+    test_parse_nodes()
+    test_regex_metacharacters_are_inert()
+    test_unresolved_qualifiers_are_index_friendly()
+    test_resolved_qualifiers_become_equality()
+    test_phrases_feed_terms_and_escaped_predicate()
+    print("✅ Query parser tests passed")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests for the similar-books computation
+"""
+
+import tracemalloc
+
+import numpy as np
+
+from recommend import content_features, feature_matrix, top_neighbours
+
+BOOKS = [
+    {"_id": "a", "author": "George Orwell", "subject": "Dystopian", "tags": ["classic", "politics"]},
+    {"_id": "b", "author": "George Orwell", "subject": "Satire", "tags": ["classic", "politics"]},
+    {"_id": "c", "author": "Aldous Huxley", "subject": "Dystopian", "tags": ["classic"]},
+    {"_id": "d", "author": "Someone Else", "subject": "Cooking", "tags": ["recipes"]},
+    {"_id": "e", "author": "Another Cook", "subject": "Cooking", "tags": ["recipes"]},
+]
+
+def neighbours_of(matrix, limit=3):
+    return {row: [col for col, _ in found] for row, found in top_neighbours(matrix, limit, block_rows=2)}
+
+def test_content_features_normalize():
+    assert content_features({"subject": " Fiction ", "author": "A", "tags": ["X", "", " x "]}) == {
+        ("subject", "fiction"), ("author", "a"), ("tag", "x")}
+
+def test_rows_are_normalized_and_unshared_features_dropped():
+    matrix = feature_matrix(BOOKS)
+    assert np.allclose(np.linalg.norm(matrix.toarray(), axis=1), 1.0)
+    # "Satire" and each author other than Orwell appear once, so they add no columns
+    assert matrix.shape[1] == 6
+
+def test_top_neighbours_rank_shared_features():
+    found = neighbours_of(feature_matrix(BOOKS))
+    assert found[0][0] == 1          # same author and tags beats same subject
+    assert set(found[0]) == {1, 2}   # nothing in common with the cooking books
+    assert found[3] == [4]
+    assert all(row not in cols for row, cols in found.items())
+
+def test_co_downloads_link_unrelated_books():
+    readers = {"a": {"u1", "u2"}, "d": {"u1", "u2"}}
+    found = neighbours_of(feature_matrix(BOOKS, readers))
+    assert 3 in found[0] and 0 in found[3]
+
+def test_block_similarities_match_dense_product():
+    readers = {"a": {"u1"}, "c": {"u1", "u2"}, "e": {"u2"}}
+    matrix = feature_matrix(BOOKS, readers)
+    dense = matrix.toarray()
+    assert np.allclose(matrix.similarities(1, 4), dense[1:4] @ dense.T, atol=1e-6)
+
+def test_memory_does_not_grow_with_vocabulary_times_books():
+    # Every pair of books shares its own tag, so the vocabulary grows with the catalog
+    books = [{"_id": str(i), "tags": [f"t{i // 2}", "common"]} for i in range(4000)]
+    tracemalloc.start()
+    matrix = feature_matrix(books)
+    neighbours = dict(top_neighbours(matrix, limit=2, block_rows=64))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert matrix.shape == (4000, 2001)
+    dense_bytes = matrix.shape[0] * matrix.shape[1] * 4   # 32 MB as a dense float32 matrix
+    assert peak < dense_bytes / 4
+    assert neighbours[0][0][0] == 1 and neighbours[3999][0][0] == 3998
+
+if __name__ == "__main__":
+    test_content_features_normalize()
+    test_rows_are_normalized_and_unshared_features_dropped()
+    test_top_neighbours_rank_shared_features()
+    test_co_downloads_link_unrelated_books()
+    test_block_similarities_match_dense_product()
+    test_memory_does_not_grow_with_vocabulary_times_books()
+    print("✅ Recommendation tests passed")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Tests for the catalog result cache
+"""
+
+import time
+
+from result_cache import ResultCache
+
+def test_hits_and_misses():
+    cache = ResultCache(max_entries=2, ttl=60)
+    assert cache.get("a") == (False, None)
+    cache.set("a", 1)
+    assert cache.get("a") == (True, 1)
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["hit_ratio"] == 0.5
+
+def test_lru_eviction():
+    cache = ResultCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_expiry():
+    cache = ResultCache(ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") == (False, None)
+
+def test_version_bump_invalidates():
+    cache = ResultCache()
+    version = cache.version
+    cache.set("a", 1, version)
+    cache.bump_version()
+    assert cache.get("a") == (False, None)
+    # A result computed before the bump is not stored as current
+    cache.set("a", 1, version)
+    assert cache.get("a") == (False, None)
+
+if __name__ == "__main__":
+    test_hits_and_misses()
+    test_lru_eviction()
+    test_ttl_expiry()
+    test_version_bump_invalidates()
+    print("✅ Result cache tests passed")
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Tests for resumable chunked uploads
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from resumable_upload import UploadError, commit, create_session, missing_ranges, part_path, received_ranges, write_chunk
+from storage import BlobStore
+
+DATA = bytes(range(256)) * 40
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = {}
+
+    def insert_one(self, doc):
+        self.docs[doc["_id"]] = doc
+
+    def find_one(self, query, projection=None):
+        return self.docs.get(query["_id"])
+
+    def _apply(self, doc, update):
+        for path, value in update.get("$set", {}).items():
+            target, *rest = path.split(".")
+            if rest:
+                doc[target][rest[0]] = value
+            else:
+                doc[target] = value
+        for path in update.get("$unset", {}):
+            target, key = path.split(".")
+            doc[target].pop(key, None)
+        for field, amount in update.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + amount
+
+    def _matches(self, doc, query):
+        for field, cond in query.items():
+            if field == "$or":
+                if not any(self._matches(doc, branch) for branch in cond):
+                    return False
+            elif isinstance(cond, dict):
+                value = doc.get(field)
+                if "$not" in cond and (value or 0) > cond["$not"]["$gt"]:
+                    return False
+                if "$lt" in cond and not value < cond["$lt"]:
+                    return False
+            elif doc.get(field) != cond:
+                return False
+        return True
+
+    def find_one_and_update(self, query, update, return_document=None):
+        doc = self.docs.get(query["_id"])
+        if doc is None or not self._matches(doc, query):
+            return None
+        before = {**doc, "chunks": dict(doc.get("chunks", {}))}
+        self._apply(doc, update)
+        return doc if return_document else before
+
+    def update_one(self, query, update, upsert=False):
+        if query["_id"] not in self.docs:
+            self.docs[query["_id"]] = {"_id": query["_id"], **update.get("$setOnInsert", {})}
+        self._apply(self.docs[query["_id"]], update)
+
+    def delete_one(self, query):
+        self.docs.pop(query["_id"], None)
+
+class FakeDB(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+def sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+def put(db, store, upload, start, end, checksum=None):
+    chunk = DATA[start:end]
+    return write_chunk(db, store, upload, start, len(chunk), io.BytesIO(chunk), checksum or sha(chunk))
+
+def test_ranges_merge_and_gaps():
+    upload = {"size": 100, "chunks": {"50": {"length": 25}, "0": {"length": 10}, "10": {"length": 5}}}
+    assert received_ranges(upload) == [[0, 15], [50, 75]]
+    assert missing_ranges(upload) == [[15, 50], [75, 100]]
+
+def test_out_of_order_chunks_commit_into_store():
+    db = FakeDB()
+    store = BlobStore(tempfile.mkdtemp(), "book")
+    upload = create_session(db, store, "u1", "big book.pdf", len(DATA), sha(DATA))
+    assert os.path.getsize(part_path(store, upload["_id"])) == len(DATA)
+    upload = put(db, store, upload, 6000, len(DATA))
+    try:
+        commit(db, store, upload)
+        assert False, "incomplete upload committed"
+    except UploadError as e:
+        assert e.status == 409 and e.details["missing"] == [[0, 6000]]
+    upload = put(db, store, upload, 0, 3000)
+    upload = put(db, store, upload, 3000, 6000)
+    stored = commit(db, store, upload)
+    with open(store.full_path(stored.path), "rb") as f:
+        assert f.read() == DATA
+    assert stored.digest == sha(DATA) and upload["_id"] not in db["upload_sessions"].docs
+    assert not os.path.exists(part_path(store, upload["_id"]))
+
+def test_bad_checksum_is_not_recorded():
+    db = FakeDB()
+    store = BlobStore(tempfile.mkdtemp(), "book")
+    upload = create_session(db, store, "u1", "book.pdf", len(DATA))
+    upload = put(db, store, upload, 0, 1000)
+    try:
+        put(db, store, upload, 0, 1000, checksum="0" * 64)
+        assert False, "corrupt chunk accepted"
+    except UploadError as e:
+        assert e.status == 422
+    assert received_ranges(db["upload_sessions"].docs[upload["_id"]]) == []
+
+def test_rejects_chunks_outside_the_file():
+    db = FakeDB()
+    store = BlobStore(tempfile.mkdtemp(), "book")
+    upload = create_session(db, store, "u1", "book.pdf", 10)
+    try:
+        write_chunk(db, store, upload, 5, 10, io.BytesIO(b"x" * 10))
+        assert False, "chunk past the end accepted"
+    except UploadError as e:
+        assert e.status == 416
+
+class CommitDuringRead(io.BytesIO):
+    """A request body whose first read happens while a commit is attempted."""
+
+    def __init__(self, data, on_first_read):
+        super().__init__(data)
+        self.on_first_read = on_first_read
+
+    def read(self, size=-1):
+        if self.on_first_read:
+            callback, self.on_first_read = self.on_first_read, None
+            callback()
+        return super().read(size)
+
+def test_commit_waits_for_chunks_in_flight():
+    db = FakeDB()
+    store = BlobStore(tempfile.mkdtemp(), "book")
+    upload = create_session(db, store, "u1", "book.pdf", len(DATA), sha(DATA))
+    upload = put(db, store, upload, 0, 1000)
+    upload = put(db, store, upload, 1000, len(DATA))
+    refused = []
+
+    def commit_now():
+        try:
+            commit(db, store, upload)
+        except UploadError as e:
+            refused.append(e.status)
+
+    # A resend of the first chunk is being written while the client commits
+    chunk = DATA[:1000]
+    write_chunk(db, store, upload, 0, len(chunk), CommitDuringRead(chunk, commit_now), sha(chunk))
+    assert refused == [409]
+    upload = db["upload_sessions"].docs[upload["_id"]]
+    assert upload["status"] == "open" and upload["writers"] == 0
+    stored = commit(db, store, upload)
+    assert stored.digest == sha(DATA)
+
+    # A chunk arriving after the commit is refused, not a server error
+    try:
+        put(db, store, upload, 0, 1000)
+        assert False, "chunk written after commit"
+    except UploadError as e:
+        assert e.status == 409
+
+def test_missing_part_file_is_a_conflict():
+    db = FakeDB()
+    store = BlobStore(tempfile.mkdtemp(), "book")
+    upload = create_session(db, store, "u1", "book.pdf", len(DATA))
+    os.unlink(part_path(store, upload["_id"]))
+    try:
+        put(db, store, upload, 0, 1000)
+        assert False, "chunk written without a part file"
+    except UploadError as e:
+        assert e.status == 409
+    assert db["upload_sessions"].docs[upload["_id"]]["writers"] == 0
+
+def test_dead_writer_stops_blocking_commit_after_timeout():
+    db = FakeDB()
+    store = BlobStore(tempfile.mkdtemp(), "book")
+    upload = put(db, store, create_session(db, store, "u1", "book.pdf", len(DATA)), 0, len(DATA))
+    upload["writers"] = 1
+    try:
+        commit(db, store, upload)
+        assert False, "committed with a writer in flight"
+    except UploadError as e:
+        assert e.status == 409
+    upload["updated_at"] = datetime.now() - timedelta(hours=1)
+    assert commit(db, store, upload).size == len(DATA)
+
+def test_failed_commit_reopens_the_session(monkeypatch):
+    db = FakeDB()
+    store = BlobStore(tempfile.mkdtemp(), "book")
+    upload = put(db, store, create_session(db, store, "u1", "book.pdf", len(DATA)), 0, len(DATA))
+    adopt = store.adopt
+
+    def failing_adopt(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(store, "adopt", failing_adopt)
+    try:
+        commit(db, store, upload)
+        assert False, "commit succeeded without storing the file"
+    except OSError:
+        pass
+    assert db["upload_sessions"].docs[upload["_id"]]["status"] == "open"
+    monkeypatch.setattr(store, "adopt", adopt)
+    assert commit(db, store, upload).size == len(DATA)
+
+if __name__ == "__main__":
+    test_ranges_merge_and_gaps()
+    test_out_of_order_chunks_commit_into_store()
+    test_bad_checksum_is_not_recorded()
+    test_rejects_chunks_outside_the_file()
+    test_commit_waits_for_chunks_in_flight()
+    test_missing_part_file_is_a_conflict()
+    test_dead_writer_stops_blocking_commit_after_timeout()
+    print("✅ Resumable upload tests passed")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-process full-text search index
+"""
+
+from search_engine import SearchIndex, tokenize
+
+BOOKS = [
+    {"_id": "a1", "title": "The Great Gatsby", "author": "F. Scott Fitzgerald", "subject": "Fiction", "tags": ["classic"]},
+    {"_id": "a2", "title": "Animal Farm", "author": "George Orwell", "subject": "Fiction", "tags": ["satire", "classic"]},
+    {"_id": "a3", "title": "1984", "author": "George Orwell", "subject": "Dystopian", "tags": []},
+]
+
+def build_index():
+    index = SearchIndex()
+    index.build(BOOKS)
+    return index
+
+def test_tokenize():
+    assert tokenize("The Great-Gatsby!") == ["the", "great", "gatsby"]
+    assert tokenize(None) == []
+
+def test_search_ranks_title_match_first():
+    index = build_index()
+    assert index.search("gatsby") == ["a1"]
+    assert set(index.search("orwell")) == {"a2", "a3"}
+    assert index.search("orwell farm") == ["a2"]
+    assert index.search("nothing here") == []
+    # Descriptions are not indexed, so tags are the weakest field a term can match
+    index.add({"_id": "a4", "title": "Classic Poems", "author": "Various", "subject": "Poetry", "tags": []})
+    assert index.search("classic")[0] == "a4"
+    assert set(index.search("classic")[1:]) == {"a1", "a2"}
+
+def test_search_prefix_on_last_token():
+    index = build_index()
+    assert index.search("gats") == ["a1"]
+    assert index.search("gats", prefix_last=False) == []
+
+def test_incremental_updates():
+    index = build_index()
+    index.add({"_id": "a2", "title": "Homage to Catalonia", "author": "George Orwell", "subject": "Memoir"})
+    assert index.search("farm") == []
+    assert index.search("catalonia") == ["a2"]
+    index.remove("a3")
+    assert index.search("orwell") == ["a2"]
+    assert len(index) == 2
+
+if __name__ == "__main__":
+    test_tokenize()
+    test_search_ranks_title_match_first()
+    test_search_prefix_on_last_token()
+    test_incremental_updates()
+    print("✅ Search engine tests passed")
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-memory small file cache
+"""
+
+import os
+import tempfile
+
+from small_files import SmallFileCache
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = SmallFileCache(max_bytes=10, max_file_bytes=10)
+    assert cache.put("a", b"aaaa") and cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"          # "b" is now the oldest
+    cache.put("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa" and cache.get("c") == b"cccc"
+    stats = cache.stats()
+    assert stats["resident_bytes"] == 8 and stats["evictions"] == 1
+    assert stats["hits"] == 3 and stats["misses"] == 1 and stats["hit_ratio"] == 0.75
+
+def test_large_files_are_not_cached():
+    cache = SmallFileCache(max_bytes=100, max_file_bytes=4)
+    assert not cache.fits(5) and not cache.fits(None)
+    assert not cache.put("big", b"12345")
+    assert cache.get("big") is None
+    assert cache.stats()["too_large"] == 1 and cache.stats()["resident_bytes"] == 0
+
+def test_read_loads_once_and_discard():
+    path = os.path.join(tempfile.mkdtemp(), "book.pdf")
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4")
+    cache = SmallFileCache()
+    assert cache.read("k", path) == b"%PDF-1.4"
+    os.unlink(path)
+    assert cache.read("k", path) == b"%PDF-1.4"
+    cache.discard("k")
+    assert cache.stats()["entries"] == 0 and cache.stats()["resident_bytes"] == 0
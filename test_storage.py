@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for content-addressed blob storage
+"""
+
+import io
+import os
+import tempfile
+
+from storage import BlobStore, blob_path, is_blob_path
+
+class FakeBlobs:
+    def __init__(self):
+        self.docs = {}
+
+    def update_one(self, query, update, upsert=False):
+        doc = self.docs.get(query["_id"])
+        if doc is None:
+            doc = self.docs[query["_id"]] = {"_id": query["_id"], "refs": 0, **update.get("$setOnInsert", {})}
+        doc["refs"] += update["$inc"]["refs"]
+
+    def find_one_and_update(self, query, update, return_document=None):
+        doc = self.docs.get(query["_id"])
+        if doc is not None:
+            doc["refs"] += update["$inc"]["refs"]
+        return doc
+
+    def delete_one(self, query):
+        class Result:
+            deleted_count = 0
+        doc = self.docs.get(query["_id"])
+        if doc is not None and doc["refs"] <= query["refs"]["$lte"]:
+            del self.docs[query["_id"]]
+            Result.deleted_count = 1
+        return Result
+
+class FakeDB(dict):
+    def __missing__(self, name):
+        self[name] = FakeBlobs()
+        return self[name]
+
+def test_blob_path_is_sharded():
+    digest = "ab" + "cd" + "0" * 60
+    assert blob_path(digest, ".pdf") == f"sha256/ab/cd/{digest}.pdf"
+    assert is_blob_path(blob_path(digest)) and not is_blob_path("book.pdf")
+
+def test_identical_uploads_share_one_file():
+    db = FakeDB()
+    store = BlobStore(tempfile.mkdtemp(), "book")
+    first = store.put(db, io.BytesIO(b"same bytes"), "A Book.PDF")
+    second = store.put(db, io.BytesIO(b"same bytes"), "other name.pdf")
+    assert first.created and not second.created
+    assert first.path == second.path and first.path.endswith(".pdf")
+    with open(store.full_path(first.path), "rb") as f:
+        assert f.read() == b"same bytes"
+    assert os.listdir(os.path.join(store.root, ".incoming")) == []
+    assert db["blobs"].docs[f"book:{first.path}"]["refs"] == 2
+
+def test_last_release_deletes_file():
+    db = FakeDB()
+    store = BlobStore(tempfile.mkdtemp(), "cover")
+    stored = store.put(db, io.BytesIO(b"cover"), "c.jpg")
+    store.acquire(db, stored.path)
+    assert not store.release(db, stored.path)
+    assert os.path.exists(store.full_path(stored.path))
+    assert store.release(db, stored.path)
+    assert not os.path.exists(store.full_path(stored.path))
+    assert not store.release(db, "legacy.jpg")
+
+if __name__ == "__main__":
+    test_blob_path_is_sharded()
+    test_identical_uploads_share_one_file()
+    test_last_release_deletes_file()
+    print("✅ Storage tests passed")
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Tests for the orphan file collector and storage reconciler
+"""
+
+import io
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from storage import BlobStore
+from storage_gc import cover_variants, reconcile, walk_files
+
+class FakeBooks:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection, batch_size=None):
+        return iter(self.docs)
+
+class FakeBlobs:
+    def __init__(self):
+        self.docs = {}
+
+    def update_one(self, query, update, upsert=False):
+        doc = self.docs.setdefault(query["_id"], {"_id": query["_id"], "refs": 0, **update.get("$setOnInsert", {})})
+        doc.update(update.get("$set", {}))
+        doc["refs"] += update.get("$inc", {}).get("refs", 0)
+
+    def find_one(self, query):
+        return self.docs.get(query["_id"])
+
+    def delete_one(self, query):
+        self.docs.pop(query["_id"], None)
+
+class FakeDB(dict):
+    def __init__(self, books):
+        super().__init__(books=FakeBooks(books), blobs=FakeBlobs())
+
+    def __getattr__(self, name):
+        return self[name]
+
+    def __missing__(self, name):
+        self[name] = FakeBlobs()
+        return self[name]
+
+def write(root, path, data=b"x", age_hours=48):
+    full = os.path.join(root, path)
+    os.makedirs(os.path.dirname(full), exist_ok=True)
+    with open(full, "wb") as f:
+        f.write(data)
+    old = time.time() - age_hours * 3600
+    os.utime(full, (old, old))
+
+def make_stores():
+    return BlobStore(tempfile.mkdtemp(), "book"), BlobStore(tempfile.mkdtemp(), "cover")
+
+def test_walk_skips_store_folders():
+    root = tempfile.mkdtemp()
+    write(root, "a.pdf")
+    write(root, "sha256/ab/cd/abcd.pdf")
+    write(root, ".incoming/tmp1")
+    assert sorted(path for _, path, _ in walk_files(root, {".incoming"})) == ["a.pdf", "sha256/ab/cd/abcd.pdf"]
+
+def test_walk_resumes_behind_a_folder():
+    root = tempfile.mkdtemp()
+    for path in ("top.pdf", "a/1.pdf", "a/b/2.pdf", "a-b/3.pdf", "c/4.pdf"):
+        write(root, path)
+    order = [path for _, path, _ in walk_files(root)]
+    assert order == ["top.pdf", "a/1.pdf", "a/b/2.pdf", "a-b/3.pdf", "c/4.pdf"]
+    assert [path for _, path, _ in walk_files(root, after="a")] == ["a/b/2.pdf", "a-b/3.pdf", "c/4.pdf"]
+    assert [path for _, path, _ in walk_files(root, after="a/b")] == ["a-b/3.pdf", "c/4.pdf"]
+
+def test_passes_resume_from_the_stored_position():
+    books, covers = make_stores()
+    quarantine = tempfile.mkdtemp()
+    for folder in "abcd":
+        write(books.root, f"{folder}/kept.pdf")
+        write(books.root, f"{folder}/orphan.pdf")
+    db = FakeDB([{"_id": folder, "filename": f"{folder}/kept.pdf"} for folder in "abcd"] +
+                [{"_id": "gone", "filename": "lost.pdf"}])
+    reports = []
+    while not reports or not reports[-1]["complete"]:
+        reports.append(reconcile(db, books, covers, quarantine, pause=0, max_files=3)[0])
+        assert len(reports) < 10
+    assert [report["scanned"] for report in reports] == [4, 4]
+    assert reports[0]["resumed_after"] is None and reports[1]["resumed_after"] == "b"
+    assert sum(report["quarantined"] for report in reports) == 4
+    # Missing files are only judged once the whole tree was walked
+    assert reports[0]["missing"] == [] and reports[1]["missing"] == [("lost.pdf", ["gone"])]
+    assert db["storage_gc_state"].docs["book"]["after"] is None
+
+def test_quarantines_old_unreferenced_files_only():
+    books, covers = make_stores()
+    quarantine = tempfile.mkdtemp()
+    write(books.root, "kept.pdf")
+    write(books.root, "orphan.pdf", b"12345")
+    write(books.root, "fresh.pdf", age_hours=1)
+    write(covers.root, "c.jpg")
+    write(covers.root, "c.w100.webp")
+    write(covers.root, "gone.w100.webp")
+    db = FakeDB([{"_id": 1, "filename": "kept.pdf", "cover_filename": "c.jpg"}])
+    book_report, cover_report = reconcile(db, books, covers, quarantine, pause=0)
+    assert book_report["quarantined"] == 1 and book_report["quarantined_bytes"] == 5
+    assert book_report["recent"] == 1 and book_report["missing"] == []
+    assert sorted(os.listdir(books.root)) == ["fresh.pdf", "kept.pdf"]
+    day = datetime.now().strftime("%Y-%m-%d")
+    assert os.path.exists(os.path.join(quarantine, "book", day, "orphan.pdf"))
+    assert cover_report["quarantined"] == 1
+    assert sorted(os.listdir(covers.root)) == ["c.jpg", "c.w100.webp"]
+
+def test_recently_acquired_blob_is_kept():
+    books, covers = make_stores()
+    stored = books.put(FakeDB([]), io.BytesIO(b"dedup"), "a.pdf")
+    old = time.time() - 48 * 3600
+    os.utime(books.full_path(stored.path), (old, old))
+    db = FakeDB([])
+    books.acquire(db, stored.path)   # a book using it is about to be saved
+    report = reconcile(db, books, covers, tempfile.mkdtemp(), pause=0)[0]
+    assert report["recent"] == 1 and os.path.exists(books.full_path(stored.path))
+
+def test_missing_files_are_reported_and_restored_from_quarantine():
+    books, covers = make_stores()
+    quarantine = tempfile.mkdtemp()
+    stored = books.put(FakeDB([]), io.BytesIO(b"book"), "a.pdf")
+    old = time.time() - 48 * 3600
+    os.utime(books.full_path(stored.path), (old, old))
+    db = FakeDB([])
+    assert reconcile(db, books, covers, quarantine, pause=0)[0]["quarantined"] == 1
+    assert not os.path.exists(books.full_path(stored.path))
+
+    db = FakeDB([{"_id": 1, "filename": stored.path}, {"_id": 2, "filename": stored.path},
+                 {"_id": 3, "filename": "lost.pdf"}])
+    report = reconcile(db, books, covers, quarantine, pause=0)[0]
+    assert report["restored"] == 1 and report["missing"] == [("lost.pdf", ["3"])]
+    assert os.path.exists(books.full_path(stored.path))
+    assert db["blobs"].docs[f"book:{stored.path}"]["refs"] == 2
+
+def test_stale_temp_files_and_old_quarantine_are_purged():
+    books, covers = make_stores()
+    quarantine = tempfile.mkdtemp()
+    write(books.root, ".incoming/tmpcrash")
+    write(books.root, ".incoming/abc.part")
+    old_day = (datetime.now() - timedelta(days=40)).strftime("%Y-%m-%d")
+    write(quarantine, f"book/{old_day}/old.pdf")
+    report = reconcile(FakeDB([]), books, covers, quarantine, pause=0)[0]
+    assert report["temp_removed"] == 1 and report["purged"] == 1
+    assert os.listdir(os.path.join(books.root, ".incoming")) == ["abc.part"]
+    assert os.listdir(os.path.join(quarantine, "book")) == []
+
+def test_cover_variants():
+    assert "c.w100.webp" in cover_variants(["c.jpg"]) and cover_variants(["c.html"]) == set()
+
+if __name__ == "__main__":
+    test_walk_skips_store_folders()
+    test_walk_resumes_behind_a_folder()
+    test_passes_resume_from_the_stored_position()
+    test_quarantines_old_unreferenced_files_only()
+    test_recently_acquired_blob_is_kept()
+    test_missing_files_are_reported_and_restored_from_quarantine()
+    test_stale_temp_files_and_old_quarantine_are_purged()
+    test_cover_variants()
+    print("✅ Storage GC tests passed")
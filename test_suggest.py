@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Tests for the prefix autocomplete index
+"""
+
+from search_engine import fold
+from suggest import SuggestIndex
+
+BOOKS = [
+    {"_id": "c1", "title": "The Little Prince", "author": "Antoine de Saint-Exupéry", "subject": "Fiction", "tags": ["classic"], "downloads": 5},
+    {"_id": "c2", "title": "The Great Gatsby", "author": "F. Scott Fitzgerald", "subject": "Fiction", "tags": ["classic", "jazz age"], "downloads": 50},
+    {"_id": "c3", "title": "The Hobbit", "author": "J.R.R. Tolkien", "subject": "Fantasy", "tags": [], "downloads": 20},
+]
+
+def build_index():
+    index = SuggestIndex()
+    index.build(BOOKS)
+    return index
+
+def test_fold_strips_diacritics():
+    assert fold("Saint-Exupéry") == "saint-exupery"
+
+def test_prefix_matches_any_word_ranked_by_downloads():
+    index = build_index()
+    assert [s["text"] for s in index.suggest("the", limit=3)] == ["The Great Gatsby", "The Hobbit", "The Little Prince"]
+    assert index.suggest("gats") == [{"text": "The Great Gatsby", "type": "title", "book_id": "c2"}]
+    assert index.suggest("exup")[0]["text"] == "Antoine de Saint-Exupéry"
+    subjects = [s for s in index.suggest("f") if s["type"] == "subject"]
+    assert subjects[0]["text"] == "Fiction"
+
+def test_incremental_updates_and_bumps():
+    index = build_index()
+    index.add({"_id": "c4", "title": "The Hobbit Companion", "author": "Someone", "subject": "Fantasy", "downloads": 1})
+    assert [s["text"] for s in index.suggest("hobbit")] == ["The Hobbit", "The Hobbit Companion"]
+    index.bump("c4", 100)
+    assert index.suggest("hobbit")[0]["text"] == "The Hobbit Companion"
+    index.remove("c3")
+    assert [s["text"] for s in index.suggest("hob")] == ["The Hobbit Companion"]
+    assert index.suggest("tolk") == []
+
+if __name__ == "__main__":
+    test_fold_strips_diacritics()
+    test_prefix_matches_any_word_ranked_by_downloads()
+    test_incremental_updates_and_bumps()
+    print("✅ Suggest tests passed")
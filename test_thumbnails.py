@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Tests for resized cover variants
+"""
+
+import os
+import tempfile
+
+from PIL import Image
+from werkzeug.datastructures import MIMEAccept
+
+from thumbnails import is_image, negotiate_format, render_variants, variant_path
+
+def test_variant_paths_sit_next_to_the_cover():
+    assert variant_path("sha256/ab/cd/abcd.jpeg", 100, "webp") == "sha256/ab/cd/abcd.w100.webp"
+    assert variant_path("Ai_Art.jpg", 200, "jpeg") == "Ai_Art.w200.jpg"
+    assert is_image("cover.PNG") and not is_image("1984_cover.html")
+
+def test_webp_only_when_listed():
+    assert negotiate_format(MIMEAccept([("image/avif", 1), ("image/webp", 1), ("*/*", 0.8)])) == "webp"
+    assert negotiate_format(MIMEAccept([("*/*", 1)])) == "jpeg"
+    assert negotiate_format(MIMEAccept([("image/webp", 0)])) == "jpeg"
+
+def test_render_scales_down_and_flattens_alpha():
+    folder = tempfile.mkdtemp()
+    source = os.path.join(folder, "cover.png")
+    Image.new("RGBA", (600, 900), (200, 10, 10, 0)).save(source)
+    small, large = os.path.join(folder, "cover.w100.jpg"), os.path.join(folder, "cover.w1000.webp")
+    assert render_variants(source, [(small, 100, "jpeg"), (large, 1000, "webp")]) == [small, large]
+    with Image.open(small) as image:
+        assert image.format == "JPEG" and image.size == (100, 150)
+        assert image.getpixel((50, 75)) == (255, 255, 255)
+    with Image.open(large) as image:
+        assert image.format == "WEBP" and image.size == (600, 900)
+    assert sorted(os.listdir(folder)) == ["cover.png", "cover.w100.jpg", "cover.w1000.webp"]
+
+if __name__ == "__main__":
+    test_variant_paths_sit_next_to_the_cover()
+    test_webp_only_when_listed()
+    test_render_scales_down_and_flattens_alpha()
+    print("✅ Thumbnail tests passed")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Tests for the time-decayed trending index
+"""
+
+from datetime import datetime, timedelta
+
+from trending import TrendingIndex
+from usage_events import DOWNLOAD, PREVIEW
+
+BOOKS = [{"_id": "a", "subject": "Fiction"}, {"_id": "b", "subject": "Fiction"},
+         {"_id": "c", "subject": "Science"}, {"_id": "d", "subject": "Science"}]
+
+def bucket(book_id, hour, downloads=0, previews=0):
+    return {"book_id": book_id, "hour": hour, "downloads": downloads, "previews": previews}
+
+def test_build_decays_old_activity():
+    now = datetime(2024, 5, 10, 12)
+    index = TrendingIndex(half_life_hours=24)
+    index.build(BOOKS, [bucket("a", now - timedelta(days=3), downloads=10),
+                        bucket("b", now - timedelta(hours=1), downloads=3),
+                        bucket("c", now - timedelta(hours=2), previews=3)], now=now.timestamp())
+    at = now.timestamp()
+    assert [book_id for book_id, _ in index.top(now=at)] == ["b", "a", "c"]
+    a_score = dict(index.top(now=at))["a"]
+    assert 1.0 < a_score < 1.3   # 10 downloads, three half-lives ago
+    assert [book_id for book_id, _ in index.top(subject="Science")] == ["c"]
+    assert index.ranked() == ["b", "a", "c", "d"]
+    assert index.ranked(restrict={"d", "a"}) == ["a", "d"]
+
+def test_record_updates_top_k_incrementally():
+    index = TrendingIndex(top_k=2)
+    index.build(BOOKS, [], now=1000.0)
+    index.record("c", DOWNLOAD, at=1000.0)
+    index.record("d", PREVIEW, at=1000.0)
+    index.record("a", DOWNLOAD, at=1000.0)
+    assert [book_id for book_id, _ in index.top()] == ["c", "a"]
+    # A later event outweighs an earlier one of the same kind
+    index.record("d", DOWNLOAD, at=5000.0)
+    assert [book_id for book_id, _ in index.top(now=5000.0)] == ["d", "c"]
+    assert [book_id for book_id, _ in index.top(subject="Science", now=5000.0)] == ["d", "c"]
+
+def test_rebase_keeps_ranking():
+    index = TrendingIndex(half_life_hours=1)
+    index.build(BOOKS, [], now=0.0)
+    index.record("a", DOWNLOAD, at=0.0)
+    far = 3600 * 500.0
+    index.record("b", DOWNLOAD, at=far)
+    index.record("a", DOWNLOAD, at=far)
+    top = dict(index.top(now=far))
+    assert abs(top["a"] - 1.0) < 1e-9 and abs(top["b"] - 1.0) < 1e-9
+
+def test_add_and_remove_books():
+    index = TrendingIndex()
+    index.build(BOOKS, [], now=0.0)
+    index.add({"_id": "e", "subject": "History"})
+    index.record("e", DOWNLOAD, at=0.0)
+    index.record("a", DOWNLOAD, at=0.0)
+    index.record("a", DOWNLOAD, at=0.0)
+    assert [book_id for book_id, _ in index.top(subject="History", now=0.0)] == ["e"]
+    index.add({"_id": "e", "subject": "Fiction"})
+    assert [book_id for book_id, _ in index.top(subject="Fiction", now=0.0)] == ["a", "e"]
+    index.remove("a")
+    assert [book_id for book_id, _ in index.top(now=0.0)] == ["e"]
+    assert "a" not in index.ranked()
+
+def test_ranked_order_is_a_snapshot_refreshed_on_a_timer():
+    index = TrendingIndex(order_ttl=3600)
+    index.build(BOOKS, [], now=0.0)
+    assert index.ranked() == ["a", "b", "c", "d"]
+    index.record("d", DOWNLOAD, at=0.0)
+    index.add({"_id": "e", "subject": "History"})
+    # Events do not re-sort every book; new books join the end of the snapshot
+    assert index.ranked() == ["a", "b", "c", "d", "e"]
+    assert index.ranked(restrict={"e", "b"}) == ["b", "e"]
+    assert [book_id for book_id, _ in index.top(now=0.0)] == ["d"]
+    index.order_ttl = 0
+    assert index.ranked() == ["d", "a", "b", "c", "e"]
+    assert index.ranked(restrict={"e", "d"}) == ["d", "e"]
+
+if __name__ == "__main__":
+    test_build_decays_old_activity()
+    test_record_updates_top_k_incrementally()
+    test_rebase_keeps_ranking()
+    test_add_and_remove_books()
+    test_ranked_order_is_a_snapshot_refreshed_on_a_timer()
+    print("✅ Trending tests passed")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Tests for the usage event log and its rollups
+"""
+
+from datetime import datetime, timedelta
+
+import usage_events
+from usage_events import DOWNLOAD, PREVIEW, EventLog, bucket_ops, rollup, subject_totals
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+
+    def _matches(self, doc, query):
+        for field, cond in query.items():
+            value = doc.get(field)
+            if isinstance(cond, dict):
+                if "$gte" in cond and not (value is not None and value >= cond["$gte"]):
+                    return False
+                if "$lt" in cond and not (value or 0) < cond["$lt"]:
+                    return False
+            elif value != cond:
+                return False
+        return True
+
+    def find(self, query, projection=None):
+        return [doc for doc in self.docs if self._matches(doc, query)]
+
+    def find_one(self, query):
+        return next(iter(self.find(query)), None)
+
+    def update_one(self, query, update, upsert=False):
+        doc = self.find_one(query)
+        if doc is None:
+            doc = dict(query)
+            self.docs.append(doc)
+        for field, value in update.get("$max", {}).items():
+            if doc.get(field) is None or value > doc[field]:
+                doc[field] = value
+
+    def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            query, update = op._filter, op._doc
+            doc = next(iter(self.find(query)), None)
+            if doc is None:
+                doc = {field: value for field, value in query.items() if not isinstance(value, dict)}
+                doc.update(update.get("$setOnInsert", {}))
+                self.docs.append(doc)
+            doc.update(update.get("$set", {}))
+            for field, amount in update.get("$inc", {}).items():
+                doc[field] = doc.get(field, 0) + amount
+            for field, push in update.get("$push", {}).items():
+                doc.setdefault(field, []).extend(push["$each"])
+
+class FakeDB(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+def event(kind, book_id, at, subject="Fiction", size=0):
+    return {"kind": kind, "book_id": book_id, "subject": subject, "at": at, "user_id": "u1", "bytes": size}
+
+def test_bucket_ops_group_by_book_and_hour():
+    at = datetime(2024, 5, 1, 10, 15)
+    ops = bucket_ops([event(DOWNLOAD, "a", at, size=100), event(PREVIEW, "a", at + timedelta(minutes=5)),
+                      event(DOWNLOAD, "a", at + timedelta(hours=1)), event(DOWNLOAD, "b", at)])
+    assert len(ops) == 3
+    first = ops[0]._doc
+    assert ops[0]._filter["hour"] == datetime(2024, 5, 1, 10)
+    assert first["$inc"] == {"n": 2, "downloads": 1, "previews": 1, "bytes": 100}
+    assert [e["k"] for e in first["$push"]["events"]["$each"]] == ["d", "p"]
+
+def test_full_bucket_starts_a_new_one(monkeypatch):
+    monkeypatch.setattr(usage_events, "EVENTS_PER_BUCKET", 2)
+    db = FakeDB()
+    at = datetime(2024, 5, 1, 10)
+    for _ in range(3):
+        db[usage_events.EVENTS_COLLECTION].bulk_write(bucket_ops([event(DOWNLOAD, "a", at)]))
+    assert [bucket["n"] for bucket in db[usage_events.EVENTS_COLLECTION].docs] == [2, 1]
+
+def test_rollup_is_idempotent():
+    db = FakeDB()
+    day = datetime(2024, 5, 1)
+    events = [event(DOWNLOAD, "a", day + timedelta(hours=9), size=10),
+              event(DOWNLOAD, "a", day + timedelta(hours=14), size=10),
+              event(PREVIEW, "b", day + timedelta(hours=14), subject="Science")]
+    db[usage_events.EVENTS_COLLECTION].bulk_write(bucket_ops(events))
+    for _ in range(2):
+        rollup(db, day)
+    daily = {doc["book_id"]: doc for doc in db[usage_events.DAILY_COLLECTION].docs}
+    assert daily["a"]["downloads"] == 2 and daily["a"]["bytes"] == 20
+    assert daily["b"]["previews"] == 1
+    assert len(db[usage_events.HOURLY_COLLECTION].docs) == 3
+    totals = subject_totals(db, days=1, now=day)
+    assert totals["Fiction"]["downloads"] == 2
+    assert totals["Science"] == {"downloads": 0, "previews": 1, "bytes": 0}
+
+def test_event_log_batches_writes():
+    db = FakeDB()
+    log = EventLog(db, interval=60, rollup_interval=3600)
+    log.record(DOWNLOAD, "a", subject="Fiction", bytes_sent=5)
+    log.record(DOWNLOAD, "a", subject="Fiction", bytes_sent=5)
+    assert db[usage_events.EVENTS_COLLECTION].docs == []
+    assert log.close() == 2
+    bucket, = db[usage_events.EVENTS_COLLECTION].docs
+    assert bucket["downloads"] == 2 and bucket["bytes"] == 10
+
+def test_restarted_event_log_rolls_up_from_stored_watermark():
+    db = FakeDB()
+    log = EventLog(db, interval=60, rollup_interval=3600)
+    log.record(DOWNLOAD, "a", subject="Fiction")
+    log.close()   # final flush is rolled up too
+    assert db[usage_events.DAILY_COLLECTION].docs[0]["downloads"] == 1
+
+    # Events flushed hours before the next start (e.g. by a process that died before its rollup)
+    stale = datetime.now() - timedelta(hours=5)
+    db[usage_events.STATE_COLLECTION].docs[0]["rolled_through"] = stale
+    db[usage_events.EVENTS_COLLECTION].bulk_write(bucket_ops([event(DOWNLOAD, "b", stale + timedelta(minutes=1))]))
+    restarted = EventLog(db, interval=60, rollup_interval=3600)
+    restarted.run_rollup()
+    assert {doc["book_id"] for doc in db[usage_events.DAILY_COLLECTION].docs} == {"a", "b"}
+    assert db[usage_events.STATE_COLLECTION].docs[0]["rolled_through"] > stale
+
+if __name__ == "__main__":
+    test_bucket_ops_group_by_book_and_hour()
+    test_rollup_is_idempotent()
+    test_event_log_batches_writes()
+    test_restarted_event_log_rolls_up_from_stored_watermark()
+    print("✅ Usage event tests passed")
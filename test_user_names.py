@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Tests for batched user name resolution
+"""
+
+from bson.objectid import ObjectId
+
+from user_names import UNKNOWN_USER, UserNameCache
+
+class FakeUsers:
+    def __init__(self, users):
+        self.users = users
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        wanted = set(query["_id"]["$in"])
+        return [user for user in self.users if user["_id"] in wanted]
+
+class FakeDB:
+    def __init__(self, users):
+        self.users = FakeUsers(users)
+
+def test_resolve_batches_and_caches():
+    alice, bob = ObjectId(), ObjectId()
+    db = FakeDB([{"_id": alice, "name": "Alice"}, {"_id": bob, "name": "Bob"}])
+    cache = UserNameCache()
+    names = cache.resolve(db, [str(alice), str(bob), str(alice), "not-an-id", None])
+    assert names == {str(alice): "Alice", str(bob): "Bob", "not-an-id": UNKNOWN_USER}
+    assert len(db.users.queries) == 1
+    cache.resolve(db, [str(alice), str(bob)])
+    assert len(db.users.queries) == 1
+
+def test_forget_reloads_name():
+    alice = ObjectId()
+    db = FakeDB([{"_id": alice, "name": "Alice"}])
+    cache = UserNameCache()
+    cache.resolve(db, [str(alice)])
+    db.users.users = []
+    cache.forget(str(alice))
+    assert cache.resolve(db, [str(alice)]) == {str(alice): UNKNOWN_USER}
+
+if __name__ == "__main__":
+    test_resolve_batches_and_caches()
+    test_forget_reloads_name()
+    print("✅ User name tests passed")
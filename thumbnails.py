@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Resized cover variants.
+Each uploaded cover is rendered to a few widths as JPEG and WebP in a
+process pool, and the variants are stored next to the original
+(<cover stem>.w<width>.<ext>). Listings point at the small variants through
+srcset instead of pulling full-size wallpapers; variants missing on disk are
+rendered on first request and kept.
+
+Render variants for every existing cover with:
+    python thumbnails.py --backfill [--uri URI] [--workers N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Widths rendered for every cover: 1x and 2x of the 100px catalog cards, and the detail page
+COVER_WIDTHS = (100, 200, 400)
+
+# format -> (Pillow format, file extension, MIME type), preferred first
+FORMATS = {
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+}
+
+ALL_VARIANTS = [(width, fmt) for width in COVER_WIDTHS for fmt in FORMATS]
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+
+QUALITY = 80
+
+
+def is_image(cover_filename):
+    """Only raster covers get variants (some sample covers are HTML pages)."""
+    return os.path.splitext(cover_filename or "")[1].lower() in IMAGE_EXTENSIONS
+
+
+def variant_path(cover_filename, width, fmt):
+    """Relative path of a variant, next to the original cover."""
+    return f"{os.path.splitext(cover_filename)[0]}.w{width}.{FORMATS[fmt][1]}"
+
+
+def negotiate_format(accept_mimetypes):
+    """Pick WebP only when the client lists it explicitly (a bare */* is not enough)."""
+    for mimetype, quality in accept_mimetypes:
+        if mimetype == FORMATS["webp"][2] and quality > 0:
+            return "webp"
+    return "jpeg"
+
+
+def render_variants(source, targets):
+    """
+    Render [(dest, width, fmt)] from one source image (runs in a worker
+    process). Images are only ever scaled down. Each variant is written to a
+    temp file and renamed, so readers never see a partial image. Returns the
+    paths written.
+    """
+    from PIL import Image, ImageOps
+
+    written = []
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ("RGB", "RGBA"):
+            original = original.convert("RGBA")
+        for dest, width, fmt in targets:
+            image = original.copy()
+            image.thumbnail((width, width * 4), Image.LANCZOS)
+            pil_format = FORMATS[fmt][0]
+            if pil_format == "JPEG" and image.mode == "RGBA":
+                background = Image.new("RGB", image.size, "white")
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(dest), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    image.save(f, pil_format, quality=QUALITY, optimize=pil_format == "JPEG")
+                os.replace(temp_path, dest)
+            finally:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+            written.append(dest)
+    return written
+
+
+class ThumbnailPipeline:
+    """Renders cover variants in a process pool started on first use."""
+
+    def __init__(self, folder, max_workers=2, source=None):
+        self.folder = folder
+        self.max_workers = max_workers
+        # Maps a cover to the local path of its original (default: under folder)
+        self.source = source or (lambda cover_filename: os.path.join(folder, cover_filename))
+        self._processes = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._processes
+
+    def _targets(self, cover_filename, variants):
+        return [(os.path.join(self.folder, variant_path(cover_filename, width, fmt)), width, fmt)
+                for width, fmt in variants]
+
+    def submit(self, cover_filename):
+        """Queue every missing variant of a cover; returns a future, or None when there is nothing to do."""
+        if not is_image(cover_filename):
+            return None
+        targets = [target for target in self._targets(cover_filename, ALL_VARIANTS) if not os.path.exists(target[0])]
+        if not targets:
+            return None
+        return self._pool().submit(render_variants, self.source(cover_filename), targets)
+
+    def variant(self, cover_filename, width, fmt, timeout=30):
+        """
+        Return the full path of a variant, rendering it now if it is missing.
+        Raises FileNotFoundError when neither the variant nor the cover exists.
+        """
+        targets = self._targets(cover_filename, [(width, fmt)])
+        dest = targets[0][0]
+        if not os.path.exists(dest):
+            source = self.source(cover_filename)
+            if not source or not os.path.exists(source):
+                raise FileNotFoundError(cover_filename)
+            self._pool().submit(render_variants, source, targets).result(timeout)
+        return dest
+
+    def remove(self, cover_filename):
+        """Delete the variants of a cover whose original was deleted."""
+        for dest, _, _ in self._targets(cover_filename, ALL_VARIANTS):
+            try:
+                os.unlink(dest)
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self, wait=True):
+        if self._processes is not None:
+            self._processes.shutdown(wait=wait)
+
+
+def backfill(db, folder, workers=2):
+    """Render the missing variants of every stored cover. Returns (covers queued, failures)."""
+    pipeline = ThumbnailPipeline(folder, max_workers=workers)
+    futures = []
+    for cover in db.books.distinct("cover_filename"):
+        if cover and os.path.exists(os.path.join(folder, cover)):
+            future = pipeline.submit(cover)
+            if future is not None:
+                futures.append((cover, future))
+    failures = 0
+    for cover, future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            print(f"❌ Failed to render variants of {cover}: {e}")
+            failures += 1
+    pipeline.shutdown()
+    return len(futures), failures
+
+
+def main(argv=None):
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Render resized cover variants")
+    parser.add_argument("--uri", default=os.getenv('MONGO_URI_LOCAL', 'mongodb://localhost:27017/library'))
+    parser.add_argument("--folder", default=os.path.join('static', 'covers'))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--backfill", action="store_true", help="render variants for every cover")
+    args = parser.parse_args(argv)
+
+    if not args.backfill:
+        parser.print_help()
+        return 1
+
+    client = MongoClient(args.uri)
+    db = client.get_default_database("library")
+    queued, failures = backfill(db, args.folder, workers=args.workers)
+    print(f"🖼️ Rendered variants for {queued - failures} cover(s), {failures} failed")
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Time-decayed trending scores.
+Every download or preview adds weight * 2^(-age / half_life) to a book's
+score. Scores are stored relative to a reference time t0, so an event only
+adds exp(lambda * (t - t0)) to one slot and the ranking of the other books
+never has to be touched; the common decay factor is applied when scores are
+read. Full rebuilds from the usage buckets are vectorized with NumPy, and
+small top-K lists (global and per subject) are maintained on every event.
+The full order behind the Trending sort is a snapshot re-sorted at most every
+`order_ttl` seconds, so a busy catalog does not re-sort on every page view.
+"""
+
+import math
+import threading
+import time
+
+import numpy as np
+
+from usage_events import DOWNLOAD, PREVIEW
+
+TRENDING_PROJECTION = {"subject": 1}
+
+# Relative weight of each event kind
+EVENT_WEIGHTS = {DOWNLOAD: 1.0, PREVIEW: 0.3}
+
+# Rebase the reference time before exp() gets anywhere near overflow
+MAX_EXPONENT = 300.0
+
+
+class TrendingIndex:
+    """In-memory decayed scores with incrementally maintained top-K lists."""
+
+    def __init__(self, half_life_hours=24.0, top_k=50, order_ttl=30.0):
+        self.half_life_hours = half_life_hours
+        self.top_k = top_k
+        self.order_ttl = order_ttl
+        self._lambda = math.log(2) / (half_life_hours * 3600)
+        self._lock = threading.Lock()
+        self._reset()
+        self.loaded = False
+        self.built_at = None
+
+    def _reset(self, t0=None):
+        self._t0 = time.time() if t0 is None else t0
+        self._ids = []
+        self._rows = {}
+        self._subjects = []
+        self._scores = np.zeros(64)
+        self._alive = np.zeros(64, dtype=bool)
+        self._tops = {}
+        self._order = None
+        self._position = {}
+        self._order_at = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def window_hours(self):
+        """Events older than this weigh less than 1/1000 of a fresh one."""
+        return self.half_life_hours * 10
+
+    def build(self, books, buckets, now=None):
+        """
+        Rebuild from book documents ({_id, subject}) and usage buckets
+        ({book_id, hour, downloads, previews}) in one vectorized pass.
+        """
+        now = time.time() if now is None else now
+        ids = []
+        rows = {}
+        subjects = []
+        for book in books:
+            book_id = str(book["_id"])
+            rows[book_id] = len(ids)
+            ids.append(book_id)
+            subjects.append(book.get("subject") or "")
+
+        bucket_rows, bucket_times, bucket_weights = [], [], []
+        for bucket in buckets:
+            row = rows.get(bucket["book_id"])
+            if row is None:
+                continue
+            bucket_rows.append(row)
+            # Events are spread over the hour; treat them as arriving mid-hour
+            bucket_times.append(bucket["hour"].timestamp() + 1800)
+            bucket_weights.append(bucket.get("downloads", 0) * EVENT_WEIGHTS[DOWNLOAD] +
+                                  bucket.get("previews", 0) * EVENT_WEIGHTS[PREVIEW])
+
+        capacity = max(64, len(ids) * 2)
+        scores = np.zeros(capacity)
+        if bucket_rows:
+            decayed = np.asarray(bucket_weights) * np.exp(self._lambda * (np.asarray(bucket_times) - now))
+            scores[:len(ids)] = np.bincount(np.asarray(bucket_rows), weights=decayed, minlength=len(ids))
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(ids)] = True
+
+        with self._lock:
+            self._t0 = now
+            self._ids, self._rows, self._subjects = ids, rows, subjects
+            self._scores, self._alive = scores, alive
+            self._order = None
+            self._tops = self._all_tops()
+            self.loaded = True
+            self.built_at = time.monotonic()
+
+    def _all_tops(self):
+        """Global and per-subject top-K from one sort of the scored books."""
+        n = len(self._ids)
+        scored = np.flatnonzero(self._alive[:n] & (self._scores[:n] > 0))
+        tops = {None: []}
+        for row in scored[np.argsort(-self._scores[scored], kind="stable")].tolist():
+            if len(tops[None]) < self.top_k:
+                tops[None].append(row)
+            subject_top = tops.setdefault(self._subjects[row], [])
+            if len(subject_top) < self.top_k:
+                subject_top.append(row)
+        return tops
+
+    def _top_rows(self, subject=None):
+        """Vectorized top-K selection (argpartition, then sort of the K winners)."""
+        n = len(self._ids)
+        mask = self._alive[:n] & (self._scores[:n] > 0)
+        if subject is not None:
+            mask &= np.asarray(self._subjects, dtype=object) == subject
+        candidates = np.flatnonzero(mask)
+        if len(candidates) > self.top_k:
+            part = np.argpartition(-self._scores[candidates], self.top_k - 1)[:self.top_k]
+            candidates = candidates[part]
+        return sorted(candidates.tolist(), key=lambda row: -self._scores[row])
+
+    def _ensure_capacity(self):
+        if len(self._ids) >= len(self._scores):
+            self._scores = np.concatenate([self._scores, np.zeros(len(self._scores))])
+            self._alive = np.concatenate([self._alive, np.zeros(len(self._alive), dtype=bool)])
+
+    def _rebase(self, now):
+        """Fold the decay since t0 into every score and move t0 to now."""
+        self._scores *= math.exp(-self._lambda * (now - self._t0))
+        self._t0 = now
+
+    def _bump_top(self, key, row):
+        top = self._tops.setdefault(key, [])
+        score = self._scores[row]
+        if row in top:
+            top.sort(key=lambda r: -self._scores[r])
+        elif len(top) < self.top_k:
+            top.append(row)
+            top.sort(key=lambda r: -self._scores[r])
+        elif score > self._scores[top[-1]]:
+            top[-1] = row
+            top.sort(key=lambda r: -self._scores[r])
+
+    def record(self, book_id, kind=DOWNLOAD, at=None):
+        """Add one event to a book's score and update the affected top-K lists."""
+        at = time.time() if at is None else at
+        with self._lock:
+            row = self._rows.get(str(book_id))
+            if row is None:
+                return
+            if self._lambda * (at - self._t0) > MAX_EXPONENT:
+                self._rebase(at)
+            self._scores[row] += EVENT_WEIGHTS.get(kind, 1.0) * math.exp(self._lambda * (at - self._t0))
+            self._bump_top(None, row)
+            self._bump_top(self._subjects[row], row)
+
+    def add(self, book):
+        """Register a new book, or pick up a changed subject."""
+        book_id = str(book["_id"])
+        subject = book.get("subject") or ""
+        with self._lock:
+            row = self._rows.get(book_id)
+            if row is None:
+                self._ensure_capacity()
+                row = self._rows[book_id] = len(self._ids)
+                self._ids.append(book_id)
+                self._subjects.append(subject)
+                self._alive[row] = True
+                if self._order is not None:
+                    # No score yet: it joins the end of the current order
+                    self._position[book_id] = len(self._order)
+                    self._order.append(book_id)
+            elif self._subjects[row] != subject:
+                old = self._subjects[row]
+                self._subjects[row] = subject
+                self._tops[old] = self._top_rows(old)
+                self._tops[subject] = self._top_rows(subject)
+
+    def remove(self, book_id):
+        """Forget a deleted book and refill the top-K lists it was in."""
+        with self._lock:
+            row = self._rows.pop(str(book_id), None)
+            if row is None:
+                return
+            self._alive[row] = False
+            self._scores[row] = 0.0
+            self._order = None   # deletes are rare; the next ranked() re-sorts
+            for key in (None, self._subjects[row]):
+                if row in self._tops.get(key, []):
+                    self._tops[key] = self._top_rows(key)
+
+    def top(self, limit=10, subject=None, now=None):
+        """Return [(book_id, score)] from the maintained top-K, scores decayed to now."""
+        now = time.time() if now is None else now
+        with self._lock:
+            decay = math.exp(-self._lambda * (now - self._t0))
+            rows = self._tops.get(subject, [])[:limit]
+            return [(self._ids[row], float(self._scores[row] * decay)) for row in rows]
+
+    def ranked(self, restrict=None):
+        """
+        Live book ids, hottest first as of the order snapshot (ties keep build
+        order), optionally restricted to a set of ids. The unrestricted list is
+        shared with later calls and must not be modified.
+        """
+        with self._lock:
+            stale = self._order_at is None or time.monotonic() - self._order_at > self.order_ttl
+            if self._order is None or stale:
+                n = len(self._ids)
+                order = np.argsort(-self._scores[:n], kind="stable")
+                self._order = [self._ids[row] for row in order.tolist() if self._alive[row]]
+                self._position = {book_id: i for i, book_id in enumerate(self._order)}
+                self._order_at = time.monotonic()
+            order, position = self._order, self._position
+        if restrict is None:
+            return order
+        if len(restrict) * 8 < len(order):
+            # A narrow filter: sort its members by snapshot position instead of scanning everything
+            return sorted((book_id for book_id in restrict if book_id in position), key=position.__getitem__)
+        return [book_id for book_id in order if book_id in restrict]
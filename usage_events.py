@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Download and preview event log with hourly/daily rollups.
+Events are buffered in memory and appended in batches to hourly buckets (one
+document per book per hour, capped at EVENTS_PER_BUCKET events) that also
+carry running totals. A periodic rollup folds the bucket totals into
+per-book hourly and daily summaries and per-subject daily summaries, so
+reports read a handful of pre-aggregated documents instead of raw events.
+
+Re-run the rollup by hand with:
+    python usage_events.py --rollup [--hours N] [--uri URI]
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+from counters import PeriodicFlusher
+
+EVENTS_COLLECTION = "usage_events"
+HOURLY_COLLECTION = "usage_hourly"
+DAILY_COLLECTION = "usage_daily"
+SUBJECT_DAILY_COLLECTION = "usage_subject_daily"
+STATE_COLLECTION = "usage_rollup_state"
+ROLLUP_STATE_ID = "rollup"
+
+# Soft cap on raw events per bucket document; a full bucket starts a new one
+EVENTS_PER_BUCKET = 500
+
+DOWNLOAD = "download"
+PREVIEW = "preview"
+# Short kind codes kept in the raw events
+KIND_CODES = {DOWNLOAD: "d", PREVIEW: "p"}
+# Total fields kept on buckets and summaries
+TOTAL_FIELDS = ("downloads", "previews", "bytes")
+
+
+def hour_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def bucket_ops(events):
+    """
+    Group events by (book, hour) into one upsert per bucket that pushes the
+    raw events and increments the bucket totals.
+    """
+    buckets = {}
+    for event in events:
+        key = (event["book_id"], hour_start(event["at"]))
+        bucket = buckets.setdefault(key, {"subject": event.get("subject") or "", "events": [],
+                                          "downloads": 0, "previews": 0, "bytes": 0})
+        bucket["events"].append({"k": KIND_CODES[event["kind"]], "u": event.get("user_id"),
+                                 "t": event["at"], "b": event.get("bytes", 0)})
+        bucket["downloads" if event["kind"] == DOWNLOAD else "previews"] += 1
+        bucket["bytes"] += event.get("bytes", 0)
+
+    ops = []
+    for (book_id, hour), bucket in buckets.items():
+        ops.append(UpdateOne(
+            {"book_id": book_id, "hour": hour, "n": {"$lt": EVENTS_PER_BUCKET}},
+            {
+                "$push": {"events": {"$each": bucket["events"]}},
+                "$inc": {"n": len(bucket["events"]), **{field: bucket[field] for field in TOTAL_FIELDS}},
+                "$setOnInsert": {"subject": bucket["subject"]},
+            },
+            upsert=True,
+        ))
+    return ops
+
+
+def _add_totals(target, source):
+    for field in TOTAL_FIELDS:
+        target[field] = target.get(field, 0) + source.get(field, 0)
+
+
+def _summary_ops(groups, key_fields):
+    return [
+        UpdateOne(dict(zip(key_fields, key)), {"$set": totals}, upsert=True)
+        for key, totals in groups.items()
+    ]
+
+
+def rollup(db, since):
+    """
+    Recompute every summary from `since` (rounded down to the hour for hourly
+    summaries and to the day for daily ones). Idempotent: summaries are
+    replaced, not incremented. Returns the number of summary documents written.
+    """
+    since_hour = hour_start(since)
+    hourly = {}
+    for bucket in db[EVENTS_COLLECTION].find({"hour": {"$gte": since_hour}}, {"events": 0}):
+        totals = hourly.setdefault((bucket["book_id"], bucket["hour"]), {"subject": bucket.get("subject", "")})
+        _add_totals(totals, bucket)
+    written = 0
+    ops = _summary_ops(hourly, ("book_id", "start"))
+    if ops:
+        db[HOURLY_COLLECTION].bulk_write(ops, ordered=False)
+        written += len(ops)
+
+    daily = {}
+    subject_daily = {}
+    for summary in db[HOURLY_COLLECTION].find({"start": {"$gte": day_start(since)}}):
+        day = day_start(summary["start"])
+        _add_totals(daily.setdefault((summary["book_id"], day), {"subject": summary.get("subject", "")}), summary)
+        _add_totals(subject_daily.setdefault((summary.get("subject", ""), day), {}), summary)
+    for collection, groups, key_fields in ((DAILY_COLLECTION, daily, ("book_id", "start")),
+                                           (SUBJECT_DAILY_COLLECTION, subject_daily, ("subject", "start"))):
+        ops = _summary_ops(groups, key_fields)
+        if ops:
+            db[collection].bulk_write(ops, ordered=False)
+            written += len(ops)
+    return written
+
+
+def top_books(db, days=7, limit=10, now=None):
+    """Return [(book_id, downloads)] for the most downloaded books over the last `days` days."""
+    since = day_start((now or datetime.now()) - timedelta(days=days - 1))
+    pipeline = [
+        {"$match": {"start": {"$gte": since}, "downloads": {"$gt": 0}}},
+        {"$group": {"_id": "$book_id", "downloads": {"$sum": "$downloads"}}},
+        {"$sort": {"downloads": -1, "_id": 1}},
+        {"$limit": limit},
+    ]
+    return [(row["_id"], row["downloads"]) for row in db[DAILY_COLLECTION].aggregate(pipeline)]
+
+
+def subject_totals(db, days=7, now=None):
+    """Return {subject: {downloads, previews, bytes}} over the last `days` days."""
+    since = day_start((now or datetime.now()) - timedelta(days=days - 1))
+    totals = {}
+    for summary in db[SUBJECT_DAILY_COLLECTION].find({"start": {"$gte": since}}):
+        _add_totals(totals.setdefault(summary["subject"], {}), summary)
+    return totals
+
+
+def drop_book_usage(db, book_id):
+    """
+    Remove a deleted book's raw events and per-book summaries. Subject totals
+    of days already rolled up keep its usage; the day being rolled up is
+    recomputed from the remaining hourly summaries, so it drops the book.
+    """
+    book_id = str(book_id)
+    for collection in (EVENTS_COLLECTION, HOURLY_COLLECTION, DAILY_COLLECTION):
+        db[collection].delete_many({"book_id": book_id})
+
+
+class EventLog(PeriodicFlusher):
+    """
+    Buffers events off the request path, appends them to hourly buckets with
+    one bulk_write per flush and runs the rollup every `rollup_interval` seconds.
+    """
+
+    def __init__(self, db, interval=5.0, max_pending=1000, rollup_interval=300):
+        super().__init__("usage events", interval)
+        self.db = db
+        self.max_pending = max_pending
+        self.rollup_interval = rollup_interval
+        self._events = []
+        self._written = 0
+        self._last_rollup = time.monotonic()
+        self._rolled_through = None
+
+    def record(self, kind, book_id, subject=None, user_id=None, bytes_sent=0):
+        """Buffer one event; never touches the database."""
+        event = {"kind": kind, "book_id": str(book_id), "subject": subject, "at": datetime.now(),
+                 "user_id": str(user_id) if user_id else None, "bytes": int(bytes_sent or 0)}
+        with self._lock:
+            self._events.append(event)
+            full = len(self._events) >= self.max_pending
+            self._start()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Append buffered events to their buckets. Returns the number of events written."""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if events:
+                try:
+                    self.db[EVENTS_COLLECTION].bulk_write(bucket_ops(events), ordered=False)
+                except Exception:
+                    with self._lock:
+                        self._events[:0] = events
+                    raise
+                self._written += len(events)
+            if time.monotonic() - self._last_rollup >= self.rollup_interval:
+                self.run_rollup()
+        return len(events)
+
+    def close(self):
+        """Write whatever is still buffered and roll it up before shutting down."""
+        flushed = super().close()
+        self.run_rollup()
+        return flushed
+
+    def run_rollup(self):
+        """
+        Roll up everything since the previous run (one extra hour covers late
+        flushes). The watermark is kept in STATE_COLLECTION, so a restarted
+        app picks up where the last process (or its final flush) left off.
+        """
+        now = datetime.now()
+        if self._rolled_through is None:
+            state = self.db[STATE_COLLECTION].find_one({"_id": ROLLUP_STATE_ID})
+            self._rolled_through = state.get("rolled_through") if state else None
+        since = (self._rolled_through or now) - timedelta(hours=1)
+        written = rollup(self.db, since)
+        self.db[STATE_COLLECTION].update_one({"_id": ROLLUP_STATE_ID}, {"$max": {"rolled_through": now}}, upsert=True)
+        self._rolled_through = now
+        self._last_rollup = time.monotonic()
+        return written
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending_events": len(self._events),
+                "events_written": self._written,
+                "last_rollup": self._rolled_through.isoformat() if self._rolled_through else None,
+                "rollup_interval_seconds": self.rollup_interval,
+            }
+
+
+def main(argv=None):
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Roll up download and preview events")
+    parser.add_argument("--uri", default=os.getenv('MONGO_URI_LOCAL', 'mongodb://localhost:27017/library'))
+    parser.add_argument("--rollup", action="store_true", help="recompute the usage summaries")
+    parser.add_argument("--hours", type=int, default=48, help="how far back to recompute (default 48)")
+    args = parser.parse_args(argv)
+
+    if not args.rollup:
+        parser.print_help()
+        return 1
+
+    client = MongoClient(args.uri)
+    db = client.get_default_database("library")
+    written = rollup(db, datetime.now() - timedelta(hours=args.hours))
+    print(f"✅ Wrote {written} usage summary document(s)")
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Batched user id -> name resolution.
+Pages that show uploader names collect every referenced id first and
+resolve the missing ones with a single $in query; results are kept in a
+small process-wide TTL cache.
+"""
+
+from bson.objectid import ObjectId
+
+from result_cache import ResultCache
+
+UNKNOWN_USER = 'Unknown User'
+
+
+class UserNameCache:
+    """Process-wide TTL cache of user names with one-query batch loading."""
+
+    def __init__(self, max_entries=10000, ttl=300):
+        self._cache = ResultCache(max_entries=max_entries, ttl=ttl)
+
+    def resolve(self, db, user_ids):
+        """Return {user_id: name} for every id, querying only the uncached ones at once."""
+        names = {}
+        missing = []
+        for user_id in {str(user_id) for user_id in user_ids if user_id}:
+            hit, name = self._cache.get(user_id)
+            if hit:
+                names[user_id] = name
+            else:
+                missing.append(user_id)
+
+        valid = [ObjectId(user_id) for user_id in missing if ObjectId.is_valid(user_id)]
+        found = {}
+        if valid:
+            for user in db.users.find({"_id": {"$in": valid}}, {"name": 1}):
+                found[str(user["_id"])] = user.get('name', UNKNOWN_USER)
+        for user_id in missing:
+            names[user_id] = found.get(user_id, UNKNOWN_USER)
+            self._cache.set(user_id, names[user_id])
+        return names
+
+    def forget(self, user_id=None):
+        """Drop cached names after a user is renamed or deleted (all of them if no id)."""
+        if user_id is None:
+            self._cache.bump_version()
+        else:
+            self._cache.discard(str(user_id))
+
+    def stats(self):
+        return self._cache.stats()